@@ -0,0 +1,98 @@
+import redis
+import json
+import time
+import os
+import datetime
+from models.database import SessionLocal, create_tables
+from core.config import HOST_METRICS_STREAM, ALERTS_STREAM, ALERT_RULES_PATH
+from services.alert_service import AlertEngine, load_rules, save_alert_events, load_active_alerts
+
+ALERTER_BATCH_SIZE = int(os.getenv('ALERTER_BATCH_SIZE', '1000'))
+ALERTS_STREAM_MAXLEN = int(os.getenv('ALERTS_STREAM_MAXLEN', '10000'))
+
+
+def _rules_mtime():
+    try:
+        return os.path.getmtime(ALERT_RULES_PATH)
+    except OSError:
+        return None
+
+
+def reload_rules(engine, mtime):
+    """Re-read the rules file if it changed, keeping the old rules when it is invalid"""
+    current = _rules_mtime()
+    if current == mtime:
+        return mtime, []
+    try:
+        rules = load_rules(ALERT_RULES_PATH)
+    except Exception as e:
+        print(f"❌ Cannot load alert rules, keeping {len(engine.rules)} old rules: {e}")
+        return current, []
+    print(f"📋 Loaded {len(rules)} alert rules from {ALERT_RULES_PATH}")
+    return current, engine.set_rules(rules)
+
+
+def publish_transitions(r, transitions):
+    pipe = r.pipeline(transaction=False)
+    for transition in transitions:
+        pipe.xadd(ALERTS_STREAM, {"data": json.dumps(transition, default=str)},
+                  maxlen=ALERTS_STREAM_MAXLEN, approximate=True)
+    pipe.execute()
+
+
+def run_alerter():
+    redis_password = os.getenv('REDIS_PASSWORD', 'your_secure_redis_password_123')
+    r = redis.Redis(
+        host='redis',
+        port=6379,
+        password=redis_password,
+        decode_responses=True
+    )
+
+    db = SessionLocal()
+    create_tables()
+
+    engine = AlertEngine()
+    rules_mtime, _ = reload_rules(engine, None)
+    engine.restore(load_active_alerts(db))
+    print(f"🚨 Alerter started, {len(engine.alerts)} alerts firing")
+
+    # Состояние окон строится из живого потока, прошлое не перечитываем
+    last_id = '$'
+    # Переходы, которые ещё не удалось сохранить
+    unsaved = []
+    while True:
+        try:
+            rules_mtime, removed = reload_rules(engine, rules_mtime)
+            unsaved.extend(removed)
+
+            response = r.xread({HOST_METRICS_STREAM: last_id}, count=ALERTER_BATCH_SIZE, block=5000)
+            for _, entries in response or []:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    try:
+                        timestamp = datetime.datetime.fromisoformat(fields["timestamp"])
+                        metrics = json.loads(fields.get("data") or "{}")
+                    except (KeyError, ValueError) as e:
+                        print(f"⚠️ Skipping bad host sample {entry_id}: {e}")
+                        continue
+                    unsaved.extend(engine.observe(fields.get("host"), timestamp, metrics, fields.get("full") == "1"))
+
+            if unsaved:
+                save_alert_events(db, unsaved)
+                for transition in unsaved:
+                    print(f"🚨 {transition['state'].upper()} {transition['rule']} on {transition['host']} "
+                          f"({transition['series']} = {transition['value']})")
+                try:
+                    publish_transitions(r, unsaved)
+                except redis.RedisError as e:
+                    print(f"⚠️ Cannot publish alert transitions: {e}")
+                unsaved = []
+
+        except Exception as e:
+            print(f"❌ Alerter error: {e}")
+            db.rollback()
+            time.sleep(5)
+
+if __name__ == "__main__":
+    run_alerter()
@@ -0,0 +1,26 @@
+import os
+import redis.asyncio as aioredis
+from core.metrics import REDIS_DURATION
+
+# Один асинхронный клиент Redis на процесс API, внутри у него пул соединений
+redis_password = os.getenv('REDIS_PASSWORD', 'your_secure_redis_password_123')
+
+class InstrumentedRedis(aioredis.Redis):
+    """Async Redis client that records the duration of every command"""
+
+    async def execute_command(self, *args, **options):
+        with REDIS_DURATION.labels(str(args[0]).upper()).time():
+            return await super().execute_command(*args, **options)
+
+
+redis_client = InstrumentedRedis(
+    host='redis',
+    port=6379,
+    password=redis_password,
+    decode_responses=True,
+    max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', '50'))
+)
+
+
+def get_redis():
+    return redis_client
@@ -0,0 +1,39 @@
+import os
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.database import get_async_db
+from core.config import ALERT_RULES_PATH
+from services import alert_service
+
+router = APIRouter(prefix="/api/alerts", tags=["alerts"])
+
+# Разобранные правила и mtime файла, из которого они прочитаны: YAML разбираем только после изменения
+_rules_cache = {"mtime": None, "rules": None}
+
+
+@router.get("")
+async def get_active_alerts(db: AsyncSession = Depends(get_async_db)):
+    """Alerts that are firing now"""
+    return await alert_service.list_active_alerts(db)
+
+
+@router.get("/history")
+async def get_alert_history(hours: float = 24, host: str = None, rule: str = None, limit: int = 1000,
+                            db: AsyncSession = Depends(get_async_db)):
+    return await alert_service.list_alert_history(db, hours, host, rule, min(max(limit, 1), 10000))
+
+
+@router.get("/rules")
+async def get_alert_rules():
+    try:
+        mtime = os.path.getmtime(ALERT_RULES_PATH)
+    except OSError:
+        mtime = None
+    if _rules_cache["rules"] is None or _rules_cache["mtime"] != mtime:
+        try:
+            rules = [rule.to_dict() for rule in alert_service.load_rules(ALERT_RULES_PATH)]
+        except ValueError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        _rules_cache.update(mtime=mtime, rules=rules)
+    return _rules_cache["rules"]
@@ -0,0 +1,50 @@
+import hmac
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.database import get_async_db, async_engine
+from api.dependencies import redis_client
+from services import ingest_service
+from core.config import INGEST_TOKEN
+
+router = APIRouter(prefix="/api/ingest", tags=["ingest"])
+
+# Одна групповая запись на процесс API для всех агентов
+writer = ingest_service.IngestWriter(async_engine)
+
+
+def check_token(request: Request):
+    if not INGEST_TOKEN:
+        return
+    header = request.headers.get("authorization", "")
+    if not hmac.compare_digest(header, f"Bearer {INGEST_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid ingest token")
+
+
+@router.post("", dependencies=[Depends(check_token)])
+async def ingest(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Accept a metrics batch pushed by a collector in agent mode (msgpack or JSON, zstd/gzip)"""
+    try:
+        payload = ingest_service.decode_body(
+            await request.body(),
+            request.headers.get("content-type", "application/msgpack"),
+            request.headers.get("content-encoding", "")
+        )
+        hostname, batches = await ingest_service.validate_batch(db, payload)
+        samples = ingest_service.validate_samples(payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    host_id = await ingest_service.get_host_id(db, hostname)
+    # Соединение сессии больше не нужно, пока ждём групповой записи
+    await db.close()
+    try:
+        rows = await writer.write(host_id, batches)
+    except ingest_service.IngestBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Write failed: {e}")
+    # Алерты и живые обновления видят агентов так же, как хосты с локальным сборщиком
+    await ingest_service.publish_pushed(redis_client, hostname, samples, batches)
+    return {"hostname": hostname, "host_id": host_id, "rows": rows}
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.database import get_async_db
+from services import metrics_service, rollup_service
+
+router = APIRouter(prefix="/api/metrics", tags=["metrics"])
+
+
+@router.get("/hosts")
+async def get_hosts(db: AsyncSession = Depends(get_async_db)):
+    return await metrics_service.list_hosts(db)
+
+
+@router.get("/hosts/{hostname}/memory")
+async def get_host_memory(hostname: str, hours: int = 168, db: AsyncSession = Depends(get_async_db)):
+    return await metrics_service.get_memory_summary(db, hostname, hours)
+
+
+@router.get("/hosts/{hostname}/series")
+async def get_host_series(hostname: str, metric: str, hours: float = 24, points: int = 300,
+                          db: AsyncSession = Depends(get_async_db)):
+    """Time series of one metric, served from the coarsest rollup that still gives enough points"""
+    try:
+        return await rollup_service.get_metric_series(db, hostname, metric, hours, min(max(points, 1), 5000))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
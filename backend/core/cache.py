@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+from fastapi import Request, Response
+
+from core.config import RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
+
+
+class CachedResponse:
+    """Serialized response body with its ETag and extra headers"""
+
+    __slots__ = ("generation", "expires", "body", "etag", "headers", "media_type")
+
+    def __init__(self, generation, expires, body, headers, media_type):
+        self.generation = generation
+        self.expires = expires
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        self.headers = headers
+        self.media_type = media_type
+
+
+class ResponseCache:
+    """In-process LRU cache of serialized responses.
+
+    An entry is valid until it is older than ttl seconds or the generation it
+    was built for changes. Concurrent misses on the same key wait for a single
+    build instead of each running the query.
+    """
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # {(key, generation): Future} - сборки, которые сейчас идут
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generation):
+        entry = self._entries.get(key)
+        if entry is None or entry.generation != generation or entry.expires <= time.monotonic():
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, generation, body, headers=None, media_type="application/json"):
+        entry = CachedResponse(generation, time.monotonic() + self.ttl, body, headers or {}, media_type)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return entry
+
+    async def get_or_build(self, key, generation, build, media_type="application/json"):
+        """Return the cached entry for key, building it with `await build()` on a miss.
+
+        build returns (body bytes, headers dict, store); results with store
+        False (errors) are handed to concurrent waiters but not kept.
+        """
+        entry = self.get(key, generation)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+
+        flight = (key, generation)
+        future = self._inflight.get(flight)
+        if future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # Запрос, который вёл сборку, отменён - собираем сами
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[flight] = future
+        try:
+            body, headers, store = await build()
+            if store:
+                entry = self.put(key, generation, body, headers, media_type)
+            else:
+                entry = CachedResponse(generation, 0, body, headers, media_type)
+            future.set_result(entry)
+            return entry
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Ожидающих может не быть, помечаем исключение как полученное
+            future.exception()
+            raise
+        finally:
+            if self._inflight.get(flight) is future:
+                del self._inflight[flight]
+
+    def clear(self):
+        self._entries.clear()
+
+
+def etag_matches(request: Request, etag: str):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    # Слабое сравнение: W/"x" совпадает с "x"
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def cached_to_response(request: Request, entry: CachedResponse):
+    """304 if the client already has this body, otherwise the cached bytes"""
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    headers.update(entry.headers)
+    return Response(content=entry.body, media_type=entry.media_type, headers=headers)
+
+
+def request_cache_key(request: Request):
+    """Path plus sorted query string, so parameter order does not split entries"""
+    query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    return f"{request.url.path}?{query}"
+
+
+response_cache = ResponseCache()
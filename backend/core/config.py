@@ -0,0 +1,108 @@
+import os
+
+# Ключи Redis, которые пишет docker_collector: hash {id: json}, счётчик версий и поток изменений
+CONTAINERS_HASH = "containers"
+CONTAINERS_VERSION = "containers_version"
+CONTAINERS_STREAM = "containers_events"
+# Поток сводок хоста, который пишет system_collector
+HOST_METRICS_STREAM = "host_metrics"
+# Счётчик поколений истории контейнеров: worker увеличивает его после каждой записи
+HISTORY_GENERATION = "containers_history_generation"
+# Поток переходов алертов, который пишет alerter
+ALERTS_STREAM = "alert_events"
+# Ресурсы контейнеров из cgroup, публикует monitoring-collector: hash на хост, множество хостов, версия
+CONTAINER_STATS_KEY = "container_stats:{host}"
+CONTAINER_STATS_HOSTS = "container_stats:hosts"
+CONTAINER_STATS_VERSION = "container_stats_version"
+# Последние результаты health check: hash {компонент: json}, пишет scheduler
+SERVICE_HEALTH_KEY = "service_health"
+
+# Кэш ответов API в памяти процесса: число записей и время жизни (сек)
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '256'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '5'))
+
+# /api/stream: сколько сообщений ждут медленного клиента до отключения и интервал keepalive (сек)
+STREAM_CLIENT_QUEUE = int(os.getenv('STREAM_CLIENT_QUEUE', '256'))
+STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', '15'))
+
+# Файл правил алертов, alerter перечитывает его при изменении
+ALERT_RULES_PATH = os.getenv('ALERT_RULES_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'alert_rules.yml'))
+
+# Сколько дней вперёд scheduler заранее создаёт дневные партиции
+PARTITION_PREMAKE_DAYS = int(os.getenv('PARTITION_PREMAKE_DAYS', '3'))
+
+
+def _retention_days(table, default):
+    """Retention for table in days, overridable with RETENTION_DAYS_<TABLE>"""
+    return int(os.getenv(f'RETENTION_DAYS_{table.upper()}', str(default)))
+
+
+# Хранение данных по таблицам (дни). Партиции старше срока удаляются целиком
+RETENTION_DAYS = {
+    'memory_info_v2': _retention_days('memory_info_v2', 30),
+    'cpu_info_v2': _retention_days('cpu_info_v2', 30),
+    'disk_info_v2': _retention_days('disk_info_v2', 30),
+    'process_info_v2': _retention_days('process_info_v2', 7),
+    'process_commands': _retention_days('process_commands', 7),
+    'network_info_v2': _retention_days('network_info_v2', 7),
+    'interface_info_v2': _retention_days('interface_info_v2', 30),
+    'tcp_state_info_v2': _retention_days('tcp_state_info_v2', 30),
+    'container_stats_v2': _retention_days('container_stats_v2', 7),
+    'containers_history': _retention_days('containers_history', 7),
+    'metric_rollups_1m': _retention_days('metric_rollups_1m', 7),
+    'metric_rollups_5m': _retention_days('metric_rollups_5m', 30),
+    'metric_rollups_1h': _retention_days('metric_rollups_1h', 365),
+    'alert_events': _retention_days('alert_events', 90),
+}
+
+# Таблицы, разбитые на дневные партиции (создаются monitoring-collector)
+PARTITIONED_TABLES = [
+    'memory_info_v2',
+    'cpu_info_v2',
+    'disk_info_v2',
+    'process_info_v2',
+    'network_info_v2',
+    'interface_info_v2',
+    'tcp_state_info_v2',
+    'container_stats_v2',
+]
+
+# Непартиционированные таблицы, из которых устаревшие строки удаляются пачками: {таблица: колонка времени}
+ROW_RETENTION_TABLES = {
+    'containers_history': 'timestamp',
+    # Команда удаляется, когда её не видел ни один ключевой кадр дольше срока хранения процессов
+    'process_commands': 'last_seen',
+    'metric_rollups_1m': 'bucket',
+    'metric_rollups_5m': 'bucket',
+    'metric_rollups_1h': 'bucket',
+    'alert_events': 'timestamp',
+}
+
+
+# Приём пачек от агентов (/api/ingest)
+INGEST_TOKEN = os.getenv('INGEST_TOKEN', '')
+INGEST_MAX_BODY = int(os.getenv('INGEST_MAX_BODY', str(8 * 1024 * 1024)))
+INGEST_MAX_DECOMPRESSED = int(os.getenv('INGEST_MAX_DECOMPRESSED', str(64 * 1024 * 1024)))
+INGEST_MAX_ROWS = int(os.getenv('INGEST_MAX_ROWS', '200000'))
+# Групповая запись: пачка уходит в COPY по размеру или по времени
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '5000'))
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', '0.5'))
+# Сколько строк может ждать записи, дальше агенты получают 429
+INGEST_MAX_PENDING = int(os.getenv('INGEST_MAX_PENDING', '500000'))
+INGEST_FLUSH_CONCURRENCY = int(os.getenv('INGEST_FLUSH_CONCURRENCY', '2'))
+# Сводки хоста из пачки агента уходят в HOST_METRICS_STREAM, статистика контейнеров - в CONTAINER_STATS_KEY
+INGEST_MAX_SAMPLES = int(os.getenv('INGEST_MAX_SAMPLES', '1000'))
+HOST_METRICS_STREAM_MAXLEN = int(os.getenv('HOST_METRICS_STREAM_MAXLEN', '10000'))
+# Агент шлёт раз в PUSH_FLUSH_INTERVAL (10 с): статистика молчащего агента исчезает через три пропуска
+INGEST_CONTAINER_STATS_TTL = int(os.getenv('INGEST_CONTAINER_STATS_TTL', '31'))
+
+# Idempotency-Key приёма контейнеров: сколько помнить ответ и сколько держать ключ, пока запрос пишется
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', str(24 * 3600)))
+IDEMPOTENCY_LOCK_TTL = int(os.getenv('IDEMPOTENCY_LOCK_TTL', '60'))
+IDEMPOTENCY_PREFIX = "idempotency:"
+
+# Scheduler: проверки доступности и порт /metrics процесса
+HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', '300'))
+HEALTH_PROBE_TIMEOUT = float(os.getenv('HEALTH_PROBE_TIMEOUT', '5'))
+HEALTH_API_URL = os.getenv('HEALTH_API_URL', 'http://backend_container_app:8000/health')
+SCHEDULER_METRICS_PORT = int(os.getenv('SCHEDULER_METRICS_PORT', '9102'))
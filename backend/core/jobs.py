@@ -0,0 +1,169 @@
+import asyncio
+import datetime
+import inspect
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.metrics import JOB_DURATION, JOB_RUNS, JOB_LAST_SUCCESS, JOB_RUNNING
+
+# Потоки для синхронных задач (обслуживание БД); health check идёт в event loop и их не ждёт
+SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', '4'))
+# Сколько ждать идущие задачи при остановке; Docker по умолчанию даёт 10 секунд до SIGKILL
+SCHEDULER_SHUTDOWN_TIMEOUT = float(os.getenv('SCHEDULER_SHUTDOWN_TIMEOUT', '8'))
+
+
+class Job:
+    """A periodic (every seconds) or daily (at "HH:MM", local time) job.
+
+    func is a plain function (run in the worker pool) or a coroutine
+    function (awaited in the event loop). A run that is still going when
+    the next one is due makes that one skipped, not queued.
+    """
+
+    def __init__(self, name, func, every=None, at=None, timeout=None, jitter=0.0, run_at_start=False):
+        if (every is None) == (at is None):
+            raise ValueError(f"Job {name} needs exactly one of every and at")
+        self.name = name
+        self.func = func
+        self.every = every
+        self.at = datetime.datetime.strptime(at, "%H:%M").time() if at else None
+        self.timeout = timeout
+        self.jitter = jitter
+        self.run_at_start = run_at_start
+        self.next_run = None
+        # Текущий запуск: asyncio.Task, для синхронной задачи - пока жив её поток, даже после таймаута
+        self.task = None
+
+    def first_run(self, now):
+        if self.run_at_start:
+            return now
+        return self.following(now)
+
+    def following(self, after):
+        """Next slot strictly after `after` (monotonic seconds), on the job's fixed grid"""
+        if self.every is not None:
+            if self.next_run is None:
+                return after + self.every
+            # Сетка от первого запуска: длинный прогон не сдвигает следующие
+            missed = max(int((after - self.next_run) // self.every), 0)
+            return self.next_run + (missed + 1) * self.every
+        wall = datetime.datetime.now()
+        target = datetime.datetime.combine(wall.date(), self.at)
+        if target <= wall + datetime.timedelta(seconds=1):
+            target += datetime.timedelta(days=1)
+        return after + (target - wall).total_seconds()
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+
+class JobScheduler:
+    """Runs jobs on their schedules without one job delaying another.
+
+    Every job waits for its own slot (plus random jitter) in the event loop,
+    sync jobs run on a thread pool, each run is limited by the job's timeout
+    and reported to Prometheus.
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS):
+        self.jobs = []
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._stop = None
+        self._runs = set()
+
+    def add(self, name, func, **kwargs):
+        job = Job(name, func, **kwargs)
+        self.jobs.append(job)
+        return job
+
+    async def _execute(self, job):
+        if inspect.iscoroutinefunction(job.func):
+            return await job.func()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, job.func)
+
+    async def run_job(self, job):
+        """Run one job now, recording duration and outcome; never raises"""
+        started = time.monotonic()
+        JOB_RUNNING.labels(job.name).set(1)
+        status = "ok"
+        try:
+            inner = asyncio.ensure_future(self._execute(job))
+            job.task = inner
+            # shield: по таймауту перестаём ждать, но поток задачи не прервать - пока он жив,
+            # job.task не завершён и следующие запуски пропускаются
+            await asyncio.wait_for(asyncio.shield(inner), job.timeout)
+        except asyncio.TimeoutError:
+            status = "timeout"
+            print(f"⏱️ Job {job.name} did not finish in {job.timeout}s")
+            if inspect.iscoroutinefunction(job.func):
+                inner.cancel()
+            inner.add_done_callback(lambda f, name=job.name: self._finished_late(name, f))
+        except asyncio.CancelledError:
+            # Остановка планировщика не дождалась задачи
+            status = "cancelled"
+            raise
+        except Exception as e:
+            status = "error"
+            print(f"❌ Job {job.name} failed: {e}")
+        finally:
+            elapsed = time.monotonic() - started
+            JOB_DURATION.labels(job.name, status).observe(elapsed)
+            JOB_RUNS.labels(job.name, status).inc()
+            if status != "timeout":
+                JOB_RUNNING.labels(job.name).set(0)
+            if status == "ok":
+                JOB_LAST_SUCCESS.labels(job.name).set(time.time())
+
+    @staticmethod
+    def _finished_late(name, future):
+        JOB_RUNNING.labels(name).set(0)
+        if not future.cancelled() and future.exception() is not None:
+            print(f"❌ Job {name} failed after its timeout: {future.exception()}")
+
+    async def _loop(self, job):
+        loop = asyncio.get_running_loop()
+        job.next_run = job.first_run(loop.time())
+        while True:
+            delay = job.next_run - loop.time() + random.uniform(0, job.jitter)
+            try:
+                await asyncio.wait_for(self._stop.wait(), max(delay, 0))
+                return
+            except asyncio.TimeoutError:
+                pass
+            if job.running:
+                print(f"⚠️ Job {job.name} is still running, this run is skipped")
+                JOB_RUNS.labels(job.name, "skipped").inc()
+            else:
+                run = asyncio.create_task(self.run_job(job))
+                self._runs.add(run)
+                run.add_done_callback(self._runs.discard)
+            job.next_run = job.following(loop.time())
+
+    async def run(self, shutdown_timeout=SCHEDULER_SHUTDOWN_TIMEOUT):
+        """Run all jobs until stop() is called, then wait for running ones.
+
+        Returns names of jobs still running after shutdown_timeout; their
+        coroutines are cancelled, threads of sync jobs cannot be and are left behind.
+        """
+        self._stop = asyncio.Event()
+        loops = [asyncio.create_task(self._loop(job)) for job in self.jobs]
+        await asyncio.gather(*loops)
+        running = self._runs | {job.task for job in self.jobs if job.running}
+        abandoned = []
+        if running:
+            print(f"⏳ Waiting up to {shutdown_timeout}s for {len(running)} running jobs...")
+            _, pending = await asyncio.wait(running, timeout=shutdown_timeout)
+            if pending:
+                abandoned = [job.name for job in self.jobs if job.running]
+                print(f"⚠️ Abandoning jobs still running after {shutdown_timeout}s: {', '.join(abandoned)}")
+                for task in pending:
+                    task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        return abandoned
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
@@ -0,0 +1,47 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Длительности от миллисекунд до таймаутов запросов
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ROWS_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+API_LATENCY = Histogram(
+    'api_request_duration_seconds', 'Time to produce the response headers of an API request',
+    ['method', 'route', 'status'], buckets=DURATION_BUCKETS
+)
+REDIS_DURATION = Histogram(
+    'api_redis_roundtrip_seconds', 'Redis commands sent by the API process',
+    ['command'], buckets=DURATION_BUCKETS
+)
+INGEST_FLUSH_DURATION = Histogram(
+    'ingest_flush_duration_seconds', 'Time to write one group commit of agent batches',
+    buckets=DURATION_BUCKETS
+)
+INGEST_FLUSH_ROWS = Histogram(
+    'ingest_flush_rows', 'Rows per group commit of agent batches', buckets=ROWS_BUCKETS
+)
+INGEST_FLUSH_ERRORS = Counter('ingest_flush_errors_total', 'Failed group commits of agent batches')
+
+# Процесс scheduler: задачи обслуживания и проверки доступности сервисов
+JOB_DURATION = Histogram(
+    'scheduler_job_duration_seconds', 'Run time of a scheduled job',
+    ['task', 'status'], buckets=DURATION_BUCKETS + (60, 300, 900, 3600)
+)
+JOB_RUNS = Counter(
+    'scheduler_job_runs_total', 'Scheduled job runs by outcome (ok, error, timeout, skipped)', ['task', 'status']
+)
+JOB_LAST_SUCCESS = Gauge('scheduler_job_last_success_timestamp_seconds', 'Last successful run of a job', ['task'])
+JOB_RUNNING = Gauge('scheduler_job_running', 'Whether a job is running now', ['task'])
+HEALTH_UP = Gauge('service_health_up', 'Result of the last health probe (1 - up)', ['component'])
+HEALTH_PROBE_DURATION = Histogram(
+    'service_health_probe_duration_seconds', 'Latency of health probes', ['component'], buckets=DURATION_BUCKETS
+)
+
+
+class SnapshotCollector:
+    """Metric families computed at scrape time (see services/exporter_service.py)"""
+
+    def __init__(self):
+        self.families = []
+
+    def collect(self):
+        return list(self.families)
@@ -1,16 +1,49 @@
-import redis
 import json
-import os
-from fastapi import FastAPI, Depends
-from sqlalchemy.orm import Session
-from models.database import get_db, create_tables, ContainerHistory, SystemMetrics
+import base64
+import asyncio
+import time
+from typing import Optional
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from redis.exceptions import RedisError
+from prometheus_client import CONTENT_TYPE_LATEST
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.database import get_async_db, create_tables_async, AsyncSessionLocal, ContainerHistory, SystemMetrics
+from api.dependencies import redis_client as r
+from api.endpoints import metrics, ingest, alerts
+from core.config import (
+    CONTAINERS_HASH, CONTAINERS_STREAM, CONTAINERS_VERSION, HISTORY_GENERATION, STREAM_HEARTBEAT,
+    CONTAINER_STATS_KEY, CONTAINER_STATS_HOSTS, CONTAINER_STATS_VERSION
+)
+from core.cache import response_cache, cached_to_response, request_cache_key
+from services.stream_service import StreamHub
+from services import exporter_service, ingest_service, health_service
+from core.metrics import API_LATENCY
 import datetime
 
 
 app = FastAPI()
+app.include_router(metrics.router)
+app.include_router(ingest.router)
+app.include_router(alerts.router)
 
 from fastapi.middleware.cors import CORSMiddleware
 
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    started = time.monotonic()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Шаблон пути, а не сам путь: иначе каждый hostname даёт новую серию
+        route = request.scope.get("route")
+        API_LATENCY.labels(request.method, route.path if route else "unmatched", str(status)).observe(
+            time.monotonic() - started)
+
 @app.get("/")
 async def root():
     return {"message": "Monitoring Platform API"}
@@ -18,62 +51,305 @@ async def root():
 @app.get("/health")
 async def health():
     return {"status": "healthy"}
-# Подключение к Redis
 
-redis_password = os.getenv('REDIS_PASSWORD', 'your_secure_redis_password_123')
+@app.get("/api/health")
+async def services_health():
+    """Last probes of the API, PostgreSQL and Redis recorded by the scheduler health check"""
+    try:
+        return await health_service.get_service_health(r)
+    except Exception as e:
+        return {"error": str(e)}
+# Подключение к Redis - асинхронный клиент из api/dependencies.py
 
-r = redis.Redis(
-    host='redis',
-    port=6379, 
-    password=redis_password,
-    decode_responses=True
-)
+def dump_json(data):
+    return json.dumps(data, separators=(",", ":")).encode()
+
+async def cache_generation(key):
+    """Текущее поколение данных; без Redis кэш живёт только по TTL"""
+    try:
+        return await r.get(key) or "0"
+    except Exception:
+        return None
 
 @app.get("/api/containers")
-async def get_containers():
+async def get_containers(request: Request):
+    async def build():
+        try:
+            # Redis<-api, ответ собирается один раз на версию контейнеров
+            data = await r.hgetall(CONTAINERS_HASH)
+            if data:
+                # Значения в hash уже JSON - склеиваем без json.loads/dumps
+                return ("[" + ",".join(data.values()) + "]").encode(), {}, True
+            else:
+                return dump_json({"error": "No data available"}), {}, False
+        except Exception as e:
+            return dump_json({"error": str(e)}), {}, False
+    
+    generation = await cache_generation(CONTAINERS_VERSION)
+    entry = await response_cache.get_or_build(request_cache_key(request), generation, build)
+    return cached_to_response(request, entry)
+
+@app.get("/api/containers/stats")
+async def get_containers_stats(request: Request):
+    """Latest CPU, memory and IO of every container, by host, read from cgroups by the collectors"""
+    async def build():
+        try:
+            hosts = sorted(await r.smembers(CONTAINER_STATS_HOSTS))
+            pipe = r.pipeline(transaction=False)
+            for host in hosts:
+                pipe.hgetall(CONTAINER_STATS_KEY.format(host=host))
+            results = await pipe.execute()
+            # Hash истёк - коллектор хоста молчит дольше TTL, убираем хост из множества.
+            # Гонка с его новой публикацией безвредна: следующая снова сделает SADD
+            stale = [host for host, stats in zip(hosts, results) if not stats]
+            if stale:
+                await r.srem(CONTAINER_STATS_HOSTS, *stale)
+            values = [data for stats in results for data in stats.values()]
+            # Значения уже JSON, как в /api/containers
+            return ("[" + ",".join(values) + "]").encode(), {}, True
+        except Exception as e:
+            return dump_json({"error": str(e)}), {}, False
+
+    generation = await cache_generation(CONTAINER_STATS_VERSION)
+    entry = await response_cache.get_or_build(request_cache_key(request), generation, build)
+    return cached_to_response(request, entry)
+
+@app.get("/api/containers/changes")
+async def get_containers_changes(after: str = "0-0", count: int = 500):
+    """Изменения контейнеров после записи потока `after`, для клиентов, читающих только дельты"""
     try:
-        # Redis<-api
-        data = r.get("containers_status")
-        if data:
-            return json.loads(data)
-        else:
-            return {"error": "No data available"}
+        entries = await r.xrange(CONTAINERS_STREAM, min=f"({after}", max="+", count=min(max(count, 1), 5000))
+        return {
+            "version": await r.get(CONTAINERS_VERSION),
+            "last_id": entries[-1][0] if entries else after,
+            "changes": [
+                {
+                    "op": fields["op"],
+                    "id": fields["id"],
+                    "version": int(fields["version"]),
+                    "container": json.loads(fields["data"]) if fields["data"] else None
+                }
+                for _, fields in entries
+            ]
+        }
     except Exception as e:
         return {"error": str(e)}
 
+# Одно чтение потоков Redis на процесс, раздаётся всем подключённым клиентам
+stream_hub = StreamHub(r)
+
+@app.get("/api/stream")
+async def stream_updates():
+    """Server-sent events with container changes and host metric deltas.
+
+    Only changes are sent: clients load the current state from /api/containers
+    first. Clients that cannot keep up are disconnected and should reconnect.
+    """
+    queue = stream_hub.subscribe()
+    
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                # Отдаём всё накопившееся одним куском
+                messages = [message]
+                while message is not None and not queue.empty():
+                    message = queue.get_nowait()
+                    messages.append(message)
+                if messages[-1] is None:
+                    # Клиент отстал и отключён
+                    if len(messages) > 1:
+                        yield "".join(messages[:-1])
+                    break
+                yield "".join(messages)
+        finally:
+            stream_hub.unsubscribe(queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/metrics")
+async def prometheus_metrics(request: Request):
+    """Prometheus exposition, rendered at most once per RESPONSE_CACHE_TTL"""
+    async def build():
+        async with AsyncSessionLocal() as db:
+            body = await exporter_service.render(r, db, response_cache, stream_hub, ingest.writer)
+        # Content-Type заголовком: Starlette дописал бы второй charset к text/plain
+        return body, {"Content-Type": CONTENT_TYPE_LATEST}, True
+    
+    entry = await response_cache.get_or_build("/metrics", "metrics", build, media_type=None)
+    return cached_to_response(request, entry)
+
 @app.on_event("startup")
 async def startup_event():
-    create_tables()
+    await create_tables_async()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ingest.writer.close()
+    await stream_hub.close()
+    await r.aclose()
 
 # API для сохранения данных в БД
-@app.post("/api/metrics/containers")
-async def save_containers_metrics(containers_data: list, db: Session = Depends(get_db)):
-    for container in containers_data:
-        db_container = ContainerHistory(
-            container_name=container["name"],
-            status=container["status"],
-            image=container.get("image", "unknown"),
-            timestamp=datetime.datetime.utcnow()
+@app.post("/api/metrics/containers", dependencies=[Depends(ingest.check_token)])
+async def save_containers_metrics(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Bulk container statuses: a JSON or msgpack list, optionally gzip/zstd compressed.
+
+    The whole list is validated at once and written with one COPY. With an
+    Idempotency-Key header a retry of an already accepted request gets the
+    first response back instead of writing the rows twice; reusing the key
+    for a different body is rejected with 422.
+    """
+    key = request.headers.get("idempotency-key")
+    claim = None
+    try:
+        body = await request.body()
+        payload = ingest_service.decode_body(
+            body,
+            request.headers.get("content-type", "application/json"),
+            request.headers.get("content-encoding", "")
         )
-        db.add(db_container)
-    db.commit()
-    return {"message": "Data saved successfully"}
+        rows = ingest_service.validate_containers(payload)
+        if key:
+            claim = ingest_service.idempotency_record(key, request.headers.get("authorization", ""), body)
+        stored = await ingest_service.claim_idempotency_key(r, *claim) if claim else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ingest_service.IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except RedisError as e:
+        # Без Redis повтор не распознать - пусть клиент повторит с тем же ключом
+        raise HTTPException(status_code=503, detail=f"Idempotency store unavailable: {e}",
+                            headers={"Retry-After": "5"})
+    if stored == "pending":
+        raise HTTPException(status_code=409, detail="Request with this Idempotency-Key is in progress",
+                            headers={"Retry-After": "5"})
+    if stored is not None:
+        return JSONResponse(stored, headers={"Idempotent-Replayed": "true"})
+
+    try:
+        if rows:
+            if claim:
+                async with ingest_service.renewed_claim(r, claim[0]):
+                    await ingest_service.write_containers(db, rows)
+            else:
+                await ingest_service.write_containers(db, rows)
+    except Exception as e:
+        if claim:
+            try:
+                await ingest_service.release_idempotency_key(r, claim[0])
+            except RedisError as release_error:
+                # Ключ истечёт сам через IDEMPOTENCY_LOCK_TTL
+                print(f"⚠️ Cannot release idempotency key: {release_error}")
+        raise HTTPException(status_code=503, detail=f"Write failed: {e}")
+    response = {"message": "Data saved successfully", "rows": len(rows)}
+    try:
+        if claim:
+            await ingest_service.store_idempotent_response(r, *claim, response)
+        if rows:
+            await r.incr(HISTORY_GENERATION)
+    except Exception as e:
+        # Строки уже закоммичены - отвечаем успехом; повтор после истечения claim запишет их ещё раз
+        print(f"⚠️ Cannot record the accepted request in Redis: {e}")
+    return response
+
+# Курсор пагинации истории: последняя отданная пара (timestamp, id)
+def encode_history_cursor(timestamp, row_id):
+    raw = f"{timestamp.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_history_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.split("|")
+        return datetime.datetime.fromisoformat(timestamp), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def history_query(hours, name=None, status=None, cursor=None):
+    """Только нужные колонки, порядок (timestamp, id) - под keyset-пагинацию"""
+    time_threshold = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    query = select(
+        ContainerHistory.id,
+        ContainerHistory.container_name,
+        ContainerHistory.status,
+        ContainerHistory.image,
+        ContainerHistory.timestamp
+    ).where(ContainerHistory.timestamp >= time_threshold)
+    if name:
+        query = query.where(ContainerHistory.container_name == name)
+    if status:
+        query = query.where(ContainerHistory.status == status)
+    if cursor:
+        last_timestamp, last_id = decode_history_cursor(cursor)
+        query = query.where(
+            tuple_(ContainerHistory.timestamp, ContainerHistory.id) > tuple_(last_timestamp, last_id)
+        )
+    return query.order_by(ContainerHistory.timestamp, ContainerHistory.id)
+
+def history_row(row):
+    return {
+        "name": row.container_name,
+        "status": row.status,
+        "image": row.image,
+        "timestamp": row.timestamp.isoformat()
+    }
+
+# Размер страницы истории по умолчанию и максимум
+HISTORY_PAGE_SIZE = 1000
+HISTORY_MAX_PAGE_SIZE = 10000
+# Сколько строк за раз забираем из серверного курсора при потоковой выдаче
+HISTORY_STREAM_BATCH = 1000
+
+async def stream_history_ndjson(query):
+    # Своя сессия: генератор живёт дольше, чем зависимость запроса
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=HISTORY_STREAM_BATCH))
+        async for rows in result.partitions():
+            yield "".join(json.dumps(history_row(row)) + "\n" for row in rows)
 
 # API для чтения исторических данных
 @app.get("/api/metrics/containers/history")
-async def get_containers_history(hours: int = 24, db: Session = Depends(get_db)):
-    time_threshold = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+async def get_containers_history(
+    request: Request,
+    hours: int = 24,
+    name: Optional[str] = None,
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = HISTORY_PAGE_SIZE,
+    format: str = "json",
+    db: AsyncSession = Depends(get_async_db)
+):
+    """История статусов по возрастанию времени.
+
+    format=json отдаёт страницу не больше limit записей, курсор следующей
+    страницы - в заголовке X-Next-Cursor. format=ndjson отдаёт весь диапазон
+    потоком, строка за строкой, через серверный курсор. Страницы json
+    кэшируются до следующей записи worker'а или до истечения TTL.
+    """
+    if format == "ndjson":
+        query = history_query(hours, name, status, cursor)
+        return StreamingResponse(stream_history_ndjson(query), media_type="application/x-ndjson")
     
-    containers = db.query(ContainerHistory).filter(
-        ContainerHistory.timestamp >= time_threshold
-    ).all()
+    limit = min(max(limit, 1), HISTORY_MAX_PAGE_SIZE)
     
-    return [
-        {
-            "name": c.container_name,
-            "status": c.status,
-            "image": c.image,
-            "timestamp": c.timestamp.isoformat()
-        }
-        for c in containers
-    ]
\ No newline at end of file
+    async def build():
+        query = history_query(hours, name, status, cursor)
+        rows = (await db.execute(query.limit(limit + 1))).all()
+        headers = {}
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers["X-Next-Cursor"] = encode_history_cursor(rows[-1].timestamp, rows[-1].id)
+        return dump_json([history_row(row) for row in rows]), headers, True
+    
+    generation = await cache_generation(HISTORY_GENERATION)
+    entry = await response_cache.get_or_build(request_cache_key(request), generation, build)
+    return cached_to_response(request, entry)
\ No newline at end of file
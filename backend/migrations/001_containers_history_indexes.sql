@@ -0,0 +1,10 @@
+-- no-transaction
+-- Индексы строим CONCURRENTLY, чтобы не блокировать запись истории на большой таблице.
+-- Последний статус контейнера и фильтр истории по имени
+CREATE INDEX CONCURRENTLY IF NOT EXISTS containers_history_name_ts_idx
+    ON containers_history (container_name, timestamp DESC);
+-- Окно по времени и keyset-пагинация по (timestamp, id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS containers_history_ts_id_idx
+    ON containers_history (timestamp, id);
+-- Индекс только по имени покрывается составным
+DROP INDEX CONCURRENTLY IF EXISTS ix_containers_history_container_name;
@@ -0,0 +1,14 @@
+-- Текущее состояние каждого контейнера, worker обновляет его вместе с историей
+CREATE TABLE IF NOT EXISTS containers_current (
+    container_name VARCHAR PRIMARY KEY,
+    status VARCHAR,
+    image VARCHAR,
+    updated_at TIMESTAMP
+);
+
+INSERT INTO containers_current (container_name, status, image, updated_at)
+SELECT DISTINCT ON (container_name) container_name, status, image, timestamp
+FROM containers_history
+WHERE container_name IS NOT NULL
+ORDER BY container_name, timestamp DESC, id DESC
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,6 @@
+-- Контейнеры с одним именем на разных хостах - разные контейнеры: хост входит в ключ текущего состояния
+ALTER TABLE containers_current ADD COLUMN IF NOT EXISTS host VARCHAR NOT NULL DEFAULT '';
+ALTER TABLE containers_current DROP CONSTRAINT IF EXISTS containers_current_pkey;
+ALTER TABLE containers_current ADD PRIMARY KEY (host, container_name);
+
+ALTER TABLE containers_history ADD COLUMN IF NOT EXISTS host VARCHAR;
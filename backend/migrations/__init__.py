@@ -0,0 +1,71 @@
+"""SQL migrations of the backend tables.
+
+Files NNN_name.sql in this directory are applied in name order, each one
+once; applied names are recorded in schema_migrations, the same table the
+collector uses for its own migrations. A file whose first line is
+"-- no-transaction" runs statement by statement in autocommit mode, which
+CREATE INDEX CONCURRENTLY needs.
+"""
+import pathlib
+
+MIGRATIONS_DIR = pathlib.Path(__file__).resolve().parent
+NO_TRANSACTION = "-- no-transaction"
+# Ключ advisory lock: API, worker и scheduler стартуют одновременно
+MIGRATIONS_LOCK_ID = 720012
+
+CREATE_MIGRATIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name VARCHAR(100) PRIMARY KEY,
+        applied_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+"""
+
+
+def _statements(script):
+    """Split a migration script into statements, dropping comment lines"""
+    lines = [line for line in script.splitlines() if not line.strip().startswith("--")]
+    return [s.strip() for s in "\n".join(lines).split(";") if s.strip()]
+
+
+def pending_migrations(applied):
+    return [path for path in sorted(MIGRATIONS_DIR.glob("*.sql")) if path.stem not in applied]
+
+
+def run_migrations(engine):
+    """Apply migrations that are not recorded yet, returns their names"""
+    fairy = engine.raw_connection()
+    conn = fairy.driver_connection
+    done = []
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(CREATE_MIGRATIONS_TABLE_SQL)
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+            try:
+                cur.execute("SELECT name FROM schema_migrations")
+                applied = {row[0] for row in cur.fetchall()}
+                for path in pending_migrations(applied):
+                    script = path.read_text()
+                    if script.startswith(NO_TRANSACTION):
+                        for statement in _statements(script):
+                            cur.execute(statement)
+                        cur.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (path.stem,))
+                    else:
+                        conn.autocommit = False
+                        try:
+                            cur.execute(script)
+                            cur.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (path.stem,))
+                            conn.commit()
+                        except Exception:
+                            conn.rollback()
+                            raise
+                        finally:
+                            conn.autocommit = True
+                    done.append(path.stem)
+                    print(f"✅ Applied migration {path.stem}")
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+    finally:
+        # Соединение побывало в autocommit - в пул его не возвращаем
+        fairy.invalidate()
+    return done
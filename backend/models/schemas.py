@@ -0,0 +1,31 @@
+import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, field_validator
+
+
+class ContainerMetric(BaseModel):
+    """One container status pushed to POST /api/metrics/containers"""
+
+    # docker_collector шлёт ещё id - он не хранится в истории
+    model_config = ConfigDict(extra="ignore", str_strip_whitespace=True)
+
+    name: str = Field(min_length=1, max_length=255)
+    status: str = Field(min_length=1, max_length=64)
+    image: str = Field(default="unknown", max_length=512)
+    # Хост контейнера: часть ключа containers_current, без него - ''
+    host: Optional[str] = Field(default=None, max_length=255)
+    # Без времени строка получает время приёма
+    timestamp: Optional[datetime.datetime] = None
+
+    @field_validator("timestamp")
+    @classmethod
+    def naive_utc(cls, value):
+        # В таблице timestamp without time zone в UTC
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value
+
+
+# Валидатор всей пачки целиком: один вызов pydantic-core вместо модели на каждый элемент
+ContainerMetricList = TypeAdapter(List[ContainerMetric])
@@ -1,21 +1,71 @@
-import time
-import schedule
-from models.database import SessionLocal, ContainerHistory
+import asyncio
+import os
+import signal
+import sys
+import redis.asyncio as aioredis
+from prometheus_client import start_http_server
+from models.database import SessionLocal, create_tables, async_engine
+from services import partition_service, rollup_service, health_service
+from core.config import (
+    PARTITION_PREMAKE_DAYS, RETENTION_DAYS, ROW_RETENTION_TABLES,
+    HEALTH_CHECK_INTERVAL, HEALTH_PROBE_TIMEOUT, SCHEDULER_METRICS_PORT
+)
+from core.jobs import JobScheduler
 import datetime
-import cmd
+
+# Свой клиент, а не api.dependencies.redis_client: пробы планировщика не должны попадать в метрики API
+redis_client = aioredis.Redis(
+    host='redis',
+    port=6379,
+    password=os.getenv('REDIS_PASSWORD', 'your_secure_redis_password_123'),
+    decode_responses=True
+)
+
 def cleanup_old_data():
     print("🧹 Cleaning up old data...")
     db = SessionLocal()
     
-    # Удаляем данные старше 7 дней
-    cutoff_date = datetime.datetime.utcnow() - datetime.timedelta(days=7)
-    
-    deleted_count = db.query(ContainerHistory).filter(
-        ContainerHistory.timestamp < cutoff_date
-    ).delete()
-    
-    db.commit()
-    print(f"✅ Deleted {deleted_count} old records")
+    try:
+        # Метрики хоста: удаляем дневные партиции целиком
+        dropped = partition_service.drop_expired_partitions(db)
+        print(f"✅ Dropped {len(dropped)} expired partitions")
+        
+        # Непартиционированные таблицы чистим пачками, чтобы не держать долгих блокировок
+        now = datetime.datetime.utcnow()
+        for table, column in ROW_RETENTION_TABLES.items():
+            if not partition_service.table_exists(db, table):
+                continue
+            cutoff_date = now - datetime.timedelta(days=RETENTION_DAYS[table])
+            deleted_count = partition_service.delete_expired_rows(db, table, column, cutoff_date)
+            print(f"✅ Deleted {deleted_count} old records from {table}")
+    except Exception:
+        # Ошибку запишет планировщик (лог и scheduler_job_runs_total)
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def create_partitions():
+    """Создаём дневные партиции заранее, чтобы данные не попадали в default"""
+    db = SessionLocal()
+    try:
+        created = partition_service.ensure_partitions(db, PARTITION_PREMAKE_DAYS)
+        print(f"✅ Created {len(created)} partitions")
+    finally:
+        db.close()
+
+def run_rollups():
+    """Досчитываем агрегаты 1m/5m/1h по новым сырым данным"""
+    db = SessionLocal()
+    try:
+        stats = rollup_service.run_rollups(db)
+        if stats:
+            print(f"📈 Rollups updated: {stats}")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
 
 def daily_report():
     print("📊 Generating daily report...")
@@ -23,27 +73,53 @@ def daily_report():
     pass
 
 
-# Каждые 5 минут проверяет что все сервисы работают
-def health_check():
-    # Проверяет доступность API, БД, Redis
-    #cmd("sudo docker exec scheduler")
-    print('health.check')
-    # Отправляет алерт если что-то упало
-    pass
+async def health_check():
+    """Проверяет доступность API, БД и Redis; результат - в Redis (service_health) и метриках"""
+    results = await health_service.check_services(redis_client, async_engine)
+    print("🩺 Health: " + ", ".join(
+        f"{r['component']} {r['status']} {r['latency_ms']}ms" for r in results
+    ))
+
+
+async def run_scheduler():
+    scheduler = JobScheduler()
+    # Каждая задача ждёт своего времени сама: долгая очистка не задерживает остальные.
+    # Потоков пула (SCHEDULER_WORKERS) не меньше, чем синхронных задач
+    scheduler.add("create_partitions", create_partitions, at="01:00", timeout=600, jitter=60)
+    scheduler.add("cleanup_old_data", cleanup_old_data, at="02:00", timeout=2 * 3600, jitter=60)
+    scheduler.add("daily_report", daily_report, at="09:00", timeout=600, jitter=60)
+    scheduler.add("run_rollups", run_rollups, every=60, timeout=300, jitter=5)
+    # Пробы идут в event loop параллельно, пул задач обслуживания им не нужен
+    scheduler.add("health_check", health_check, every=HEALTH_CHECK_INTERVAL,
+                  timeout=HEALTH_PROBE_TIMEOUT * 2, jitter=5, run_at_start=True)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, scheduler.stop)
+    abandoned = await scheduler.run()
+    await redis_client.aclose()
+    await async_engine.dispose()
+    print("⏰ Scheduler stopped")
+    return abandoned
 
 
 def main():
     print("⏰ Scheduler started...")
     
-    # Настраиваем расписание
-    schedule.every().day.at("02:00").do(cleanup_old_data)  # Каждый день в 2:00
-    schedule.every().day.at("09:00").do(daily_report)      # Каждый день в 9:00
-    schedule.every(10).minutes.do(health_check)            # Каждые 10 минут
+    # Таблицы агрегатов и партиции на сегодня и ближайшие дни нужны сразу после старта
+    create_tables()
+    create_partitions()
+    
+    try:
+        start_http_server(SCHEDULER_METRICS_PORT)
+        print(f"📈 Metrics on :{SCHEDULER_METRICS_PORT}/metrics")
+    except OSError as e:
+        print(f"⚠️ Cannot start metrics server: {e}")
     
-    # Бесконечный цикл выполнения задач
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # Проверяем каждую минуту
+    if asyncio.run(run_scheduler()):
+        # Потоки брошенных задач не прервать, а выход интерпретатора их бы дождался
+        sys.stdout.flush()
+        os._exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,379 @@
+import datetime
+import fnmatch
+import operator
+import os
+import re
+from collections import deque
+
+import yaml
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.database import AlertEvent
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+# last - последнее значение, rate - изменение в секунду за окно
+AGGREGATES = ('last', 'avg', 'min', 'max', 'rate')
+
+_DURATION_RE = re.compile(r"^(\d+(?:\.\d+)?)\s*(s|m|h|d)?$")
+_DURATION_UNITS = {None: 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Последнее событие каждого алерта; активны те, у которых оно firing
+ACTIVE_ALERTS_SQL = """
+    SELECT * FROM (
+        SELECT DISTINCT ON (rule, host, series) *
+        FROM alert_events
+        ORDER BY rule, host, series, timestamp DESC, id DESC
+    ) latest
+    WHERE state = 'firing'
+    ORDER BY starts_at
+"""
+
+
+def parse_duration(value):
+    """'30s', '5m', '1h', '1d' or a number of seconds -> seconds"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = _DURATION_RE.match(str(value).strip())
+    if not match:
+        raise ValueError(f"Invalid duration {value!r}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+class AlertRule:
+    """One rule: aggregate(metric over window) <op> threshold, held for `for` seconds"""
+
+    def __init__(self, name, metric, op, threshold, aggregate='last', window=0, for_seconds=0,
+                 severity='warning', summary='', hosts=None):
+        self.name = name
+        self.metric = metric
+        self.op_name = op
+        self.op = OPERATORS[op]
+        self.threshold = threshold
+        self.aggregate = aggregate
+        self.window = window
+        self.for_seconds = for_seconds
+        self.severity = severity
+        self.summary = summary
+        self.hosts = hosts or []
+        self.is_pattern = any(c in metric for c in '*?[')
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise ValueError("rule must be a mapping")
+        missing = [key for key in ('name', 'metric', 'op', 'threshold') if key not in data]
+        if missing:
+            raise ValueError(f"missing {', '.join(missing)}")
+        if data['op'] not in OPERATORS:
+            raise ValueError(f"unknown op {data['op']!r}")
+        aggregate = data.get('aggregate', 'last')
+        if aggregate not in AGGREGATES:
+            raise ValueError(f"unknown aggregate {aggregate!r}")
+        window = parse_duration(data.get('window', 0))
+        if aggregate != 'last' and window <= 0:
+            raise ValueError(f"aggregate {aggregate} needs a window")
+        hosts = data.get('hosts') or []
+        return cls(
+            name=str(data['name']),
+            metric=str(data['metric']),
+            op=data['op'],
+            threshold=float(data['threshold']),
+            aggregate=aggregate,
+            window=window,
+            for_seconds=parse_duration(data.get('for', 0)),
+            severity=str(data.get('severity', 'warning')),
+            summary=str(data.get('summary', '')),
+            hosts=[hosts] if isinstance(hosts, str) else list(hosts),
+        )
+
+    def matches_metric(self, metric):
+        return fnmatch.fnmatchcase(metric, self.metric) if self.is_pattern else metric == self.metric
+
+    def matches_host(self, host):
+        return not self.hosts or any(fnmatch.fnmatchcase(host, pattern) for pattern in self.hosts)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "metric": self.metric,
+            "op": self.op_name,
+            "threshold": self.threshold,
+            "aggregate": self.aggregate,
+            "window_seconds": self.window,
+            "for_seconds": self.for_seconds,
+            "severity": self.severity,
+            "summary": self.summary,
+            "hosts": self.hosts,
+        }
+
+
+def load_rules(path):
+    """Rules from a YAML file with a top-level `rules:` list, raises ValueError on bad rules"""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        data = yaml.safe_load(f) or {}
+    rules = []
+    names = set()
+    for number, item in enumerate(data.get('rules') or []):
+        try:
+            rule = AlertRule.from_dict(item)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"{path}: rule {number}: {e}")
+        if rule.name in names:
+            raise ValueError(f"{path}: duplicate rule name {rule.name}")
+        names.add(rule.name)
+        rules.append(rule)
+    return rules
+
+
+class SlidingWindow:
+    """Samples of one series over the last `seconds`.
+
+    avg, min and max are kept incrementally (running sum and monotonic
+    deques), so adding a sample and reading an aggregate is O(1) amortized.
+    """
+
+    __slots__ = ('seconds', 'values', 'total', '_min', '_max')
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.values = deque()
+        self.total = 0.0
+        self._min = deque()
+        self._max = deque()
+
+    def add(self, ts, value):
+        self.values.append((ts, value))
+        self.total += value
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((ts, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((ts, value))
+        self._expire(ts)
+
+    def _expire(self, now):
+        cutoff = now - datetime.timedelta(seconds=self.seconds)
+        while self.values and self.values[0][0] < cutoff:
+            ts, value = self.values.popleft()
+            self.total -= value
+            if self._min and self._min[0][0] <= ts:
+                self._min.popleft()
+            if self._max and self._max[0][0] <= ts:
+                self._max.popleft()
+        if not self.values:
+            self.total = 0.0
+
+    def aggregate(self, kind):
+        if not self.values:
+            return None
+        if kind == 'avg':
+            return self.total / len(self.values)
+        if kind == 'min':
+            return self._min[0][1]
+        if kind == 'max':
+            return self._max[0][1]
+        if kind == 'rate':
+            (first_ts, first), (last_ts, last) = self.values[0], self.values[-1]
+            span = (last_ts - first_ts).total_seconds()
+            return (last - first) / span if span > 0 else None
+        return self.values[-1][1]
+
+
+def _format_summary(rule, host, metric, value):
+    try:
+        return rule.summary.format(host=host, metric=metric, value=value, threshold=rule.threshold)
+    except (KeyError, IndexError, ValueError, TypeError):
+        return rule.summary
+
+
+class AlertEngine:
+    """Evaluates rules against host samples as they arrive.
+
+    Samples are delta-encoded (only changed metrics), so the engine keeps the
+    current value of every metric per host and feeds it to the windows on
+    each sample. Only rules whose metric is present are evaluated; nothing
+    is read from the database.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = []
+        # {host: {metric: value}}
+        self.hosts = {}
+        # {(host, metric, seconds): SlidingWindow}
+        self.windows = {}
+        # {(rule, host, metric): {'state', 'since', 'starts_at', 'value'}}
+        self.alerts = {}
+        self._rules_for = {}
+        self.set_rules(rules)
+
+    def set_rules(self, rules):
+        """Replace the rule set, returns resolved transitions for alerts of removed rules"""
+        self.rules = list(rules)
+        self._rules_for = {}
+        self.windows = {}
+        names = {rule.name for rule in self.rules}
+        now = datetime.datetime.utcnow()
+        transitions = []
+        for key in [k for k in self.alerts if k[0] not in names]:
+            alert = self.alerts.pop(key)
+            if alert['state'] == 'firing':
+                transitions.append(self._transition_for_removed(key, alert, now))
+        return transitions
+
+    def rules_for(self, metric):
+        rules = self._rules_for.get(metric)
+        if rules is None:
+            rules = [rule for rule in self.rules if rule.matches_metric(metric)]
+            self._rules_for[metric] = rules
+        return rules
+
+    def restore(self, active):
+        """Mark alerts that were firing before a restart (rows of ACTIVE_ALERTS_SQL)"""
+        for row in active:
+            self.alerts[(row.rule, row.host, row.series)] = {
+                'state': 'firing', 'since': None, 'starts_at': row.starts_at, 'value': row.value
+            }
+
+    def observe(self, host, ts, metrics, full=False):
+        """Feed one host sample, returns firing/resolved transitions"""
+        current = self.hosts.setdefault(host, {})
+        if full:
+            # Ключевой кадр содержит все метрики: пропавшие серии (отмонтированный диск) больше не наблюдаются
+            current.clear()
+        current.update(metrics)
+
+        transitions = []
+        for metric, value in current.items():
+            if value is None:
+                continue
+            rules = [rule for rule in self.rules_for(metric) if rule.matches_host(host)]
+            if not rules:
+                continue
+            fed = set()
+            for rule in rules:
+                if rule.aggregate == 'last':
+                    result = value
+                else:
+                    window_key = (host, metric, rule.window)
+                    window = self.windows.get(window_key)
+                    if window is None:
+                        window = self.windows[window_key] = SlidingWindow(rule.window)
+                    if window_key not in fed:
+                        window.add(ts, value)
+                        fed.add(window_key)
+                    result = window.aggregate(rule.aggregate)
+                transition = self._evaluate(rule, host, metric, result, ts)
+                if transition:
+                    transitions.append(transition)
+
+        if full:
+            for key in [k for k in self.alerts if k[1] == host and k[2] not in current]:
+                alert = self.alerts.pop(key)
+                if alert['state'] == 'firing':
+                    transitions.append(self._transition_for_removed(key, alert, datetime.datetime.utcnow()))
+        return transitions
+
+    def _evaluate(self, rule, host, metric, value, ts):
+        if value is None:
+            # Окну пока не хватает точек (rate по одной точке) - состояние не меняем
+            return None
+        key = (rule.name, host, metric)
+        alert = self.alerts.get(key)
+        if rule.op(value, rule.threshold):
+            if alert is None:
+                alert = self.alerts[key] = {'state': 'pending', 'since': ts, 'starts_at': None, 'value': value}
+            alert['value'] = value
+            if alert['state'] == 'pending' and (ts - alert['since']).total_seconds() >= rule.for_seconds:
+                alert['state'] = 'firing'
+                alert['starts_at'] = datetime.datetime.utcnow()
+                return self._transition(rule, host, metric, alert, 'firing')
+        elif alert is not None:
+            del self.alerts[key]
+            if alert['state'] == 'firing':
+                alert['value'] = value
+                return self._transition(rule, host, metric, alert, 'resolved')
+        return None
+
+    def _transition(self, rule, host, metric, alert, state):
+        value = alert['value']
+        return {
+            "rule": rule.name,
+            "host": host,
+            "series": metric,
+            "state": state,
+            "severity": rule.severity,
+            "value": value,
+            "threshold": rule.threshold,
+            "summary": _format_summary(rule, host, metric, value),
+            "starts_at": alert['starts_at'],
+            "timestamp": datetime.datetime.utcnow(),
+        }
+
+    def _transition_for_removed(self, key, alert, now):
+        rule, host, metric = key
+        return {
+            "rule": rule, "host": host, "series": metric, "state": "resolved", "severity": None,
+            "value": None, "threshold": None, "summary": "", "starts_at": alert['starts_at'], "timestamp": now,
+        }
+
+
+def save_alert_events(db: Session, transitions):
+    if transitions:
+        db.execute(insert(AlertEvent), transitions)
+    db.commit()
+
+
+def load_active_alerts(db: Session):
+    return db.execute(text(ACTIVE_ALERTS_SQL)).all()
+
+
+def _event_dict(row):
+    return {
+        "rule": row.rule,
+        "host": row.host,
+        "series": row.series,
+        "state": row.state,
+        "severity": row.severity,
+        "value": row.value,
+        "threshold": row.threshold,
+        "summary": row.summary,
+        "starts_at": row.starts_at.isoformat() if row.starts_at else None,
+        "timestamp": row.timestamp.isoformat(),
+    }
+
+
+async def list_active_alerts(db: AsyncSession):
+    rows = (await db.execute(text(ACTIVE_ALERTS_SQL))).all()
+    return [_event_dict(row) for row in rows]
+
+
+async def list_alert_history(db: AsyncSession, hours: float = 24, host: str = None, rule: str = None,
+                             limit: int = 1000):
+    """Firing/resolved transitions of the last N hours, newest first"""
+    conditions = ["timestamp >= :since"]
+    params = {"since": datetime.datetime.utcnow() - datetime.timedelta(hours=hours), "limit": limit}
+    if host:
+        conditions.append("host = :host")
+        params["host"] = host
+    if rule:
+        conditions.append("rule = :rule")
+        params["rule"] = rule
+    rows = (await db.execute(text(f"""
+        SELECT * FROM alert_events
+        WHERE {' AND '.join(conditions)}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT :limit
+    """), params)).all()
+    return [_event_dict(row) for row in rows]
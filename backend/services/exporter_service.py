@@ -0,0 +1,95 @@
+import datetime
+import json
+from collections import Counter
+
+from prometheus_client import REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import CONTAINERS_HASH, CONTAINERS_STREAM
+from core.metrics import SnapshotCollector
+
+# Сколько минут назад должен быть последний агрегат, чтобы хост считался живым
+HOST_VALUES_MAX_AGE_MINUTES = 10
+
+snapshot = SnapshotCollector()
+REGISTRY.register(snapshot)
+
+
+async def container_families(r):
+    containers = [json.loads(value) for value in (await r.hgetall(CONTAINERS_HASH)).values()]
+    info = GaugeMetricFamily('container_info', 'Containers known to the collectors',
+                             labels=['host', 'name', 'image', 'status'])
+    counts = Counter()
+    for container in containers:
+        host, status = container.get('host', ''), container.get('status', '')
+        info.add_metric([host, container.get('name', ''), container.get('image', ''), status], 1)
+        counts[(host, status)] += 1
+    by_status = GaugeMetricFamily('containers', 'Containers by host and status', labels=['host', 'status'])
+    for (host, status), count in counts.items():
+        by_status.add_metric([host, status], count)
+    return [info, by_status]
+
+
+async def worker_families(r):
+    """Consumer group lag of the container change stream (Redis 7+)"""
+    lag = GaugeMetricFamily('worker_stream_lag', 'Stream entries not yet delivered to the group',
+                            labels=['stream', 'group'])
+    pending = GaugeMetricFamily('worker_stream_pending', 'Entries delivered but not acknowledged',
+                                labels=['stream', 'group'])
+    for group in await r.xinfo_groups(CONTAINERS_STREAM):
+        if group.get('lag') is not None:
+            lag.add_metric([CONTAINERS_STREAM, group['name']], group['lag'])
+        pending.add_metric([CONTAINERS_STREAM, group['name']], group['pending'])
+    return [lag, pending]
+
+
+async def host_families(db: AsyncSession):
+    """Latest value of every rolled-up host metric, from the 1m rollups"""
+    rows = (await db.execute(text("""
+        SELECT DISTINCT ON (r.host_id, r.metric) h.hostname, r.metric, r.last_value
+        FROM metric_rollups_1m r JOIN hosts h ON h.id = r.host_id
+        WHERE r.bucket >= :since
+        ORDER BY r.host_id, r.metric, r.bucket DESC
+    """), {"since": datetime.datetime.utcnow() - datetime.timedelta(minutes=HOST_VALUES_MAX_AGE_MINUTES)})).all()
+    families = {}
+    for row in rows:
+        if row.last_value is None:
+            continue
+        family = families.get(row.metric)
+        if family is None:
+            family = families[row.metric] = GaugeMetricFamily(
+                f'host_{row.metric}', f'Latest {row.metric} of the host', labels=['host']
+            )
+        family.add_metric([row.hostname], row.last_value)
+    return list(families.values())
+
+
+def process_families(response_cache, stream_hub, writer):
+    hits = CounterMetricFamily('api_response_cache_hits', 'Responses served from the in-process cache')
+    hits.add_metric([], response_cache.hits)
+    misses = CounterMetricFamily('api_response_cache_misses', 'Responses that had to be built')
+    misses.add_metric([], response_cache.misses)
+    clients = GaugeMetricFamily('api_stream_clients', 'Connected /api/stream clients')
+    clients.add_metric([], stream_hub.client_count)
+    dropped = CounterMetricFamily('api_stream_dropped_clients', 'Stream clients disconnected for being slow')
+    dropped.add_metric([], stream_hub.dropped)
+    pending = GaugeMetricFamily('ingest_pending_rows', 'Agent rows accepted but not yet committed')
+    pending.add_metric([], writer.pending_rows)
+    return [hits, misses, clients, dropped, pending]
+
+
+async def render(r, db: AsyncSession, response_cache, stream_hub, writer):
+    """Exposition text with scrape-time values refreshed; a failing source is skipped"""
+    families = process_families(response_cache, stream_hub, writer)
+    sources = (("containers", container_families(r)), ("worker", worker_families(r)), ("hosts", host_families(db)))
+    for name, source in sources:
+        try:
+            families.extend(await source)
+        except Exception as e:
+            print(f"⚠️ Metrics source {name} failed: {e}")
+            if name == "hosts":
+                await db.rollback()
+    snapshot.families = families
+    return generate_latest(REGISTRY)
@@ -0,0 +1,79 @@
+import asyncio
+import datetime
+import json
+import time
+
+import requests
+from sqlalchemy import text
+
+from core.config import HEALTH_API_URL, HEALTH_PROBE_TIMEOUT, SERVICE_HEALTH_KEY
+from core.metrics import HEALTH_UP, HEALTH_PROBE_DURATION
+
+# Последний статус компонентов: в лог пишем только переходы up <-> down
+_last_status = {}
+
+
+async def probe_api():
+    # requests синхронный - в поток, чтобы медленный API не держал остальные пробы
+    response = await asyncio.to_thread(requests.get, HEALTH_API_URL, timeout=HEALTH_PROBE_TIMEOUT)
+    response.raise_for_status()
+
+
+async def probe_postgres(engine):
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def probe_redis(r):
+    await r.ping()
+
+
+async def timed_probe(component, probe):
+    """Run one probe with HEALTH_PROBE_TIMEOUT, returns its result record"""
+    started = time.monotonic()
+    error = None
+    try:
+        await asyncio.wait_for(probe(), HEALTH_PROBE_TIMEOUT)
+    except asyncio.TimeoutError:
+        error = f"no answer in {HEALTH_PROBE_TIMEOUT}s"
+    except Exception as e:
+        # Ошибки requests бывают на полэкрана, в hash хватит начала
+        error = (str(e) or type(e).__name__)[:300]
+    latency = time.monotonic() - started
+    HEALTH_PROBE_DURATION.labels(component).observe(latency)
+    HEALTH_UP.labels(component).set(0 if error else 1)
+    return {
+        "component": component,
+        "status": "down" if error else "up",
+        "latency_ms": round(latency * 1000, 2),
+        "error": error,
+        "checked_at": datetime.datetime.utcnow().isoformat(),
+    }
+
+
+async def check_services(r, engine):
+    """Probe the API, PostgreSQL and Redis concurrently and record the results"""
+    results = await asyncio.gather(
+        timed_probe("api", probe_api),
+        timed_probe("postgres", lambda: probe_postgres(engine)),
+        timed_probe("redis", lambda: probe_redis(r)),
+    )
+    for result in results:
+        previous = _last_status.get(result["component"])
+        if result["status"] == "down" and previous != "down":
+            print(f"❌ {result['component']} is down: {result['error']}")
+        elif result["status"] == "up" and previous == "down":
+            print(f"✅ {result['component']} is back up ({result['latency_ms']} ms)")
+        _last_status[result["component"]] = result["status"]
+
+    try:
+        await r.hset(SERVICE_HEALTH_KEY, mapping={result["component"]: json.dumps(result) for result in results})
+    except Exception as e:
+        # Redis лежит - результат остаётся в метриках и логе
+        print(f"⚠️ Cannot save health results: {e}")
+    return results
+
+
+async def get_service_health(r):
+    """Last recorded probe of every component"""
+    return {component: json.loads(data) for component, data in (await r.hgetall(SERVICE_HEALTH_KEY)).items()}
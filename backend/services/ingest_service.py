@@ -0,0 +1,471 @@
+import asyncio
+import contextlib
+import datetime
+import hashlib
+import io
+import json
+import re
+import time
+import zlib
+
+import msgpack
+import zstandard
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import (
+    PARTITIONED_TABLES, INGEST_MAX_BODY, INGEST_MAX_DECOMPRESSED, INGEST_MAX_ROWS,
+    INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL, INGEST_MAX_PENDING, INGEST_FLUSH_CONCURRENCY,
+    IDEMPOTENCY_TTL, IDEMPOTENCY_LOCK_TTL, IDEMPOTENCY_PREFIX,
+    INGEST_MAX_SAMPLES, HOST_METRICS_STREAM, HOST_METRICS_STREAM_MAXLEN, INGEST_CONTAINER_STATS_TTL,
+    CONTAINER_STATS_KEY, CONTAINER_STATS_HOSTS, CONTAINER_STATS_VERSION
+)
+from core.metrics import INGEST_FLUSH_DURATION, INGEST_FLUSH_ROWS, INGEST_FLUSH_ERRORS
+from models.schemas import ContainerMetricList
+
+# Код ext-типа msgpack для datetime, такой же в monitoring-collector/collectors/agent_pusher.py
+MSGPACK_DATETIME = 1
+
+# Таблицы без host_id, которые пишутся upsert'ом: {таблица: (ключ, ON CONFLICT ...)}.
+# Совпадает с UPSERT_TABLES в monitoring-collector/collectors/schema.py
+INGEST_UPSERTS = {
+    'process_commands': (
+        ('command_id',),
+        "ON CONFLICT (command_id) DO UPDATE SET last_seen = GREATEST(process_commands.last_seen, EXCLUDED.last_seen)"
+    ),
+}
+INGEST_TABLES = PARTITIONED_TABLES + list(INGEST_UPSERTS)
+
+HOSTNAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,99}$")
+IDEMPOTENCY_KEY_RE = re.compile(r"^[\x21-\x7e]{1,200}$")
+
+# Колонки containers_history, которые пишет POST /api/metrics/containers
+CONTAINER_COLUMNS = ("container_name", "status", "image", "timestamp", "host")
+
+# {таблица: {колонка: (тип, макс. длина)}}, читается из information_schema один раз
+_table_columns = {}
+# {hostname: id} из таблицы hosts
+_host_ids = {}
+
+
+class IngestBusy(Exception):
+    """Too many rows are waiting for the database, the agent should retry later"""
+
+
+def _ext_hook(code, data):
+    if code == MSGPACK_DATETIME:
+        return datetime.datetime.fromisoformat(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+def decode_body(body: bytes, content_type: str = "application/msgpack", content_encoding: str = ""):
+    """Decompress and parse an ingest body, refusing to inflate past INGEST_MAX_DECOMPRESSED"""
+    if len(body) > INGEST_MAX_BODY:
+        raise ValueError(f"Body is larger than {INGEST_MAX_BODY} bytes")
+    encoding = (content_encoding or "identity").strip().lower()
+    try:
+        if encoding == "zstd":
+            reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body))
+            raw = reader.read(INGEST_MAX_DECOMPRESSED + 1)
+        elif encoding == "gzip":
+            raw = zlib.decompressobj(wbits=31).decompress(body, INGEST_MAX_DECOMPRESSED + 1)
+        elif encoding == "identity":
+            raw = body
+        else:
+            raise ValueError(f"Unsupported Content-Encoding {encoding}")
+    except (zstandard.ZstdError, zlib.error) as e:
+        raise ValueError(f"Cannot decompress body: {e}")
+    # Защита от пачек, которые разжимаются в гигабайты
+    if len(raw) > INGEST_MAX_DECOMPRESSED:
+        raise ValueError(f"Decompressed body is larger than {INGEST_MAX_DECOMPRESSED} bytes")
+
+    try:
+        if "json" in (content_type or ""):
+            return json.loads(raw)
+        return msgpack.unpackb(raw, ext_hook=_ext_hook, raw=False)
+    except (ValueError, msgpack.UnpackException) as e:
+        raise ValueError(f"Cannot parse body: {e}")
+
+
+async def load_table_columns(db: AsyncSession, refresh: bool = False):
+    if _table_columns and not refresh:
+        return _table_columns
+    rows = (await db.execute(text("""
+        SELECT table_name, column_name, data_type, character_maximum_length
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = ANY(:tables)
+    """), {"tables": INGEST_TABLES})).all()
+    columns = {}
+    for row in rows:
+        columns.setdefault(row.table_name, {})[row.column_name] = (row.data_type, row.character_maximum_length)
+    _table_columns.clear()
+    _table_columns.update(columns)
+    return _table_columns
+
+
+def _coerce(value, data_type, max_length):
+    """Value converted to the Python type asyncpg expects for the column"""
+    if value is None:
+        return None
+    if data_type in ("smallint", "integer", "bigint"):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value):
+            raise ValueError(f"expected integer, got {value!r}")
+        return int(value)
+    if data_type in ("real", "double precision", "numeric"):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"expected number, got {value!r}")
+        return float(value)
+    if data_type == "boolean":
+        if not isinstance(value, bool):
+            raise ValueError(f"expected boolean, got {value!r}")
+        return value
+    if data_type.startswith("timestamp"):
+        if isinstance(value, str):
+            value = datetime.datetime.fromisoformat(value)
+        if not isinstance(value, datetime.datetime):
+            raise ValueError(f"expected timestamp, got {value!r}")
+        return value.replace(tzinfo=None)
+    if isinstance(value, (dict, list, bytes)):
+        raise ValueError(f"expected text, got {type(value).__name__}")
+    value = str(value)
+    # Длинные строки обрезаем, иначе PostgreSQL отвергнет всю пачку
+    return value[:max_length] if max_length else value
+
+
+async def validate_batch(db: AsyncSession, payload):
+    """Check an agent batch against the metric table columns.
+
+    Returns (hostname, [(table, columns, rows)]) with rows as tuples in
+    columns order, host_id not yet filled in. Raises ValueError on bad input.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Batch must be a map")
+    hostname = payload.get("hostname")
+    if not isinstance(hostname, str) or not HOSTNAME_RE.match(hostname):
+        raise ValueError("Invalid hostname")
+    tables = payload.get("tables")
+    if not isinstance(tables, dict):
+        raise ValueError("Batch has no tables")
+
+    known = await load_table_columns(db)
+    if any(table in INGEST_TABLES and table not in known for table in tables):
+        # Таблицы могли появиться после первого чтения схемы
+        known = await load_table_columns(db, refresh=True)
+
+    batches = []
+    total = 0
+    for table, batch in tables.items():
+        if table not in INGEST_TABLES:
+            raise ValueError(f"Unknown table {table}")
+        if table not in known:
+            raise RuntimeError(f"Table {table} does not exist yet")
+        if not isinstance(batch, dict) or not isinstance(batch.get("columns"), list) \
+                or not isinstance(batch.get("rows"), list):
+            raise ValueError(f"{table}: batch needs columns and rows")
+        columns = batch["columns"]
+        table_columns = known[table]
+        unknown = [c for c in columns if c not in table_columns or c == "host_id"]
+        if unknown or len(set(columns)) != len(columns):
+            raise ValueError(f"{table}: bad columns {unknown or columns}")
+        required = INGEST_UPSERTS[table][0] if table in INGEST_UPSERTS else ("timestamp",)
+        if any(c not in columns for c in required):
+            raise ValueError(f"{table}: columns {', '.join(required)} are required")
+
+        total += len(batch["rows"])
+        if total > INGEST_MAX_ROWS:
+            raise ValueError(f"Batch has more than {INGEST_MAX_ROWS} rows")
+
+        types = [table_columns[c] for c in columns]
+        rows = []
+        for number, row in enumerate(batch["rows"]):
+            if not isinstance(row, list) or len(row) != len(columns):
+                raise ValueError(f"{table}: row {number} does not match columns")
+            try:
+                rows.append(tuple(_coerce(v, t, n) for v, (t, n) in zip(row, types)))
+            except ValueError as e:
+                raise ValueError(f"{table}: row {number}: {e}")
+        if rows:
+            batches.append((table, tuple(columns), rows))
+    return hostname, batches
+
+
+def validate_samples(payload):
+    """Host summaries of an agent batch as [(timestamp, {metric: number})], raises ValueError on bad input"""
+    samples = payload.get("samples") or []
+    if not isinstance(samples, list) or len(samples) > INGEST_MAX_SAMPLES:
+        raise ValueError(f"samples must be a list of at most {INGEST_MAX_SAMPLES} items")
+    result = []
+    for number, sample in enumerate(samples):
+        timestamp = sample.get("timestamp") if isinstance(sample, dict) else None
+        metrics = sample.get("metrics") if isinstance(sample, dict) else None
+        if not isinstance(timestamp, datetime.datetime) or not isinstance(metrics, dict) or not all(
+                isinstance(k, str) and (v is None or isinstance(v, (int, float))) for k, v in metrics.items()):
+            raise ValueError(f"sample {number} needs a timestamp and numeric metrics")
+        result.append((timestamp, metrics))
+    return result
+
+
+async def publish_pushed(r, hostname, samples, batches):
+    """Publish an agent's host summaries and latest container stats like system_collector does in db mode.
+
+    The rows are already committed, so Redis errors are only logged.
+    """
+    stats = {}
+    for table, columns, rows in batches:
+        if table != "container_stats_v2" or not rows or "container_id" not in columns:
+            continue
+        ts_index = columns.index("timestamp")
+        latest = max(row[ts_index] for row in rows)
+        for row in rows:
+            if row[ts_index] != latest:
+                continue
+            data = {c: v for c, v in zip(columns, row) if c not in ("host_id", "timestamp")}
+            data["host"] = hostname
+            data["timestamp"] = latest.isoformat()
+            stats[data["container_id"]] = json.dumps(data, default=str)
+    if not samples and not stats:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        for timestamp, metrics in samples:
+            # Дельт по агентам не считаем: каждая сводка - ключевой кадр
+            pipe.xadd(HOST_METRICS_STREAM,
+                      {"host": hostname, "timestamp": timestamp.isoformat(), "full": 1, "data": json.dumps(metrics)},
+                      maxlen=HOST_METRICS_STREAM_MAXLEN, approximate=True)
+        if stats:
+            key = CONTAINER_STATS_KEY.format(host=hostname)
+            pipe.delete(key)
+            pipe.hset(key, mapping=stats)
+            pipe.expire(key, INGEST_CONTAINER_STATS_TTL)
+            pipe.sadd(CONTAINER_STATS_HOSTS, hostname)
+            pipe.incr(CONTAINER_STATS_VERSION)
+        await pipe.execute()
+    except Exception as e:
+        print(f"⚠️ Cannot publish live data of {hostname}: {e}")
+
+
+def validate_containers(payload, now=None):
+    """Container statuses as containers_history rows (tuples in CONTAINER_COLUMNS order).
+
+    Raises ValueError on bad input; rows without a timestamp get now.
+    """
+    if not isinstance(payload, list):
+        raise ValueError("Body must be a list of containers")
+    if len(payload) > INGEST_MAX_ROWS:
+        raise ValueError(f"Batch has more than {INGEST_MAX_ROWS} containers")
+    try:
+        containers = ContainerMetricList.validate_python(payload)
+    except ValidationError as e:
+        # Полный список ошибок на большой пачке - мегабайты, отдаём первую
+        errors = e.errors(include_url=False)
+        first = errors[0]
+        location = ".".join(str(part) for part in first["loc"])
+        raise ValueError(f"{len(errors)} validation errors, first at {location}: {first['msg']}")
+    now = now or datetime.datetime.utcnow()
+    return [(c.name, c.status, c.image, c.timestamp or now, c.host) for c in containers]
+
+
+async def write_containers(db: AsyncSession, rows):
+    """Write containers_history rows with one COPY, upsert containers_current in the same transaction"""
+    conn = await db.connection()
+    raw = await conn.get_raw_connection()
+    driver = raw.driver_connection
+    await driver.copy_records_to_table(
+        "containers_history", records=rows, columns=list(CONTAINER_COLUMNS)
+    )
+    # Последний статус каждого контейнера пачки, как save_transitions в worker
+    latest = {}
+    for name, status, image, timestamp, host in rows:
+        key = (host or "", name)
+        if key not in latest or latest[key][3] <= timestamp:
+            latest[key] = (name, status, image, timestamp, host or "")
+    await driver.execute("""
+        INSERT INTO containers_current (container_name, status, image, updated_at, host)
+        SELECT * FROM unnest($1::varchar[], $2::varchar[], $3::varchar[], $4::timestamp[], $5::varchar[])
+        ON CONFLICT (host, container_name) DO UPDATE SET
+            status = EXCLUDED.status, image = EXCLUDED.image, updated_at = EXCLUDED.updated_at
+        WHERE containers_current.updated_at <= EXCLUDED.updated_at
+    """, *(list(column) for column in zip(*latest.values())))
+    await db.commit()
+
+
+class IdempotencyKeyReused(Exception):
+    """The Idempotency-Key was already used for a different request body"""
+
+
+def idempotency_record(key, caller, body):
+    """Redis key for key scoped to caller (the Authorization header), and the request fingerprint"""
+    if not IDEMPOTENCY_KEY_RE.match(key):
+        raise ValueError("Invalid Idempotency-Key")
+    # Одинаковые ключи разных агентов (токенов) не пересекаются
+    scope = hashlib.sha256(caller.encode()).hexdigest()[:16]
+    fingerprint = hashlib.sha256(caller.encode() + b"\n" + body).hexdigest()
+    return f"{IDEMPOTENCY_PREFIX}{scope}:{key}", fingerprint
+
+
+async def claim_idempotency_key(r, name, fingerprint):
+    """None if this request now owns name, otherwise the stored response or "pending".
+
+    The claim expires after IDEMPOTENCY_LOCK_TTL unless renewed, so a request
+    that died mid-write does not block retries forever. Raises
+    IdempotencyKeyReused if the key belongs to a request with another body.
+    """
+    if await r.set(name, json.dumps({"body": fingerprint}), nx=True, ex=IDEMPOTENCY_LOCK_TTL):
+        return None
+    stored = await r.get(name)
+    if stored is None:
+        # Ключ истёк между SET и GET - тогда это всё равно чужой запрос в полёте
+        return "pending"
+    stored = json.loads(stored)
+    if stored["body"] != fingerprint:
+        raise IdempotencyKeyReused("Idempotency-Key was already used with a different request body")
+    return stored.get("response", "pending")
+
+
+@contextlib.asynccontextmanager
+async def renewed_claim(r, name):
+    """Keep extending a pending claim while the request is writing"""
+    async def renew():
+        while True:
+            await asyncio.sleep(IDEMPOTENCY_LOCK_TTL / 3)
+            try:
+                await r.expire(name, IDEMPOTENCY_LOCK_TTL)
+            except Exception as e:
+                print(f"⚠️ Cannot renew idempotency claim: {e}")
+
+    task = asyncio.create_task(renew())
+    try:
+        yield
+    finally:
+        # Дожидаемся отмены, чтобы запоздалый EXPIRE не укоротил уже сохранённый ответ
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+async def store_idempotent_response(r, name, fingerprint, response):
+    await r.set(name, json.dumps({"body": fingerprint, "response": response}), ex=IDEMPOTENCY_TTL)
+
+
+async def release_idempotency_key(r, name):
+    """Forget a failed request so the agent's retry is executed again"""
+    await r.delete(name)
+
+
+async def get_host_id(db: AsyncSession, hostname: str):
+    """Id of hostname in the hosts registry, registering it if needed"""
+    host_id = _host_ids.get(hostname)
+    if host_id is None:
+        host_id = (await db.execute(text("""
+            INSERT INTO hosts (hostname) VALUES (:hostname)
+            ON CONFLICT (hostname) DO UPDATE SET hostname = EXCLUDED.hostname
+            RETURNING id
+        """), {"hostname": hostname})).scalar()
+        await db.commit()
+        _host_ids[hostname] = host_id
+    return host_id
+
+
+class IngestWriter:
+    """Group commit of agent batches.
+
+    Rows of all requests that arrive within flush_interval (or until
+    batch_size rows pile up) are written with COPY in one transaction; every
+    request waits for the flush that carries its rows, so a successful
+    response means the rows are committed.
+    """
+
+    def __init__(self, engine, batch_size=INGEST_BATCH_SIZE, flush_interval=INGEST_FLUSH_INTERVAL,
+                 max_pending=INGEST_MAX_PENDING, concurrency=INGEST_FLUSH_CONCURRENCY):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # Текущая пачка: {(table, columns): [rows]}, её размер и future её записи
+        self._batch = {}
+        self._batch_rows = 0
+        self._future = None
+        self._timer = None
+        # Строки, принятые, но ещё не записанные (включая пачки в полёте)
+        self.pending_rows = 0
+        self._tasks = set()
+
+    async def write(self, host_id, batches):
+        """Queue validated batches for host_id and wait until they are committed"""
+        count = sum(len(rows) for _, _, rows in batches)
+        if self.pending_rows + count > self.max_pending:
+            raise IngestBusy(f"{self.pending_rows} rows are waiting for the database")
+
+        loop = asyncio.get_running_loop()
+        if self._future is None:
+            self._future = loop.create_future()
+            # Если все ожидающие запросы отменены, исключение некому забрать
+            self._future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        future = self._future
+        for table, columns, rows in batches:
+            if table in INGEST_UPSERTS:
+                self._batch.setdefault((table, columns), []).extend(rows)
+            else:
+                self._batch.setdefault((table, ("host_id",) + columns), []).extend((host_id,) + row for row in rows)
+        self._batch_rows += count
+        self.pending_rows += count
+
+        if self._batch_rows >= self.batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_interval, self._start_flush)
+        await asyncio.shield(future)
+        return count
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._batch:
+            return
+        batch, count, future = self._batch, self._batch_rows, self._future
+        self._batch, self._batch_rows, self._future = {}, 0, None
+        task = asyncio.create_task(self._flush(batch, count, future))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, batch, count, future):
+        try:
+            async with self._semaphore:
+                started = time.monotonic()
+                async with self.engine.connect() as conn:
+                    raw = await conn.get_raw_connection()
+                    pg = raw.driver_connection
+                    async with pg.transaction():
+                        for (table, columns), rows in batch.items():
+                            if table in INGEST_UPSERTS:
+                                await self._upsert(pg, table, columns, rows)
+                            else:
+                                await pg.copy_records_to_table(table, records=rows, columns=list(columns))
+                INGEST_FLUSH_DURATION.observe(time.monotonic() - started)
+                INGEST_FLUSH_ROWS.observe(count)
+            future.set_result(count)
+        except Exception as e:
+            INGEST_FLUSH_ERRORS.inc()
+            print(f"❌ Ingest flush of {count} rows failed: {e}")
+            future.set_exception(e)
+        finally:
+            self.pending_rows -= count
+
+    async def _upsert(self, pg, table, columns, rows):
+        key, clause = INGEST_UPSERTS[table]
+        # ON CONFLICT DO UPDATE не может затронуть одну строку дважды - оставляем последнюю
+        index = [columns.index(c) for c in key]
+        rows = list({tuple(row[i] for i in index): row for row in rows}.values())
+        placeholders = ", ".join(f"${i}" for i in range(1, len(columns) + 1))
+        await pg.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) {clause}", rows
+        )
+
+    async def close(self):
+        """Write what is buffered and wait for running flushes"""
+        self._start_flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,33 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+import datetime
+
+
+async def list_hosts(db: AsyncSession):
+    """Hosts registered by collectors"""
+    rows = (await db.execute(text("SELECT id, hostname FROM hosts ORDER BY hostname"))).all()
+    return [{"id": r.id, "hostname": r.hostname} for r in rows]
+
+
+async def get_memory_summary(db: AsyncSession, hostname: str, hours: int = 168):
+    """Aggregate memory usage of one host over the last N hours in SQL"""
+    time_threshold = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    row = (await db.execute(text("""
+        SELECT count(*) AS samples,
+               avg(m.used_bytes)::BIGINT AS avg_used_bytes,
+               max(m.used_bytes) AS max_used_bytes,
+               avg(m.available_bytes)::BIGINT AS avg_available_bytes,
+               max(m.total_bytes) AS total_bytes
+        FROM memory_info_v2 m
+        JOIN hosts h ON h.id = m.host_id
+        WHERE h.hostname = :hostname AND m.timestamp >= :since
+    """), {"hostname": hostname, "since": time_threshold})).one()
+    return {
+        "hostname": hostname,
+        "hours": hours,
+        "samples": row.samples,
+        "avg_used_bytes": row.avg_used_bytes,
+        "max_used_bytes": row.max_used_bytes,
+        "avg_available_bytes": row.avg_available_bytes,
+        "total_bytes": row.total_bytes,
+    }
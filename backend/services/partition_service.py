@@ -0,0 +1,137 @@
+import re
+import datetime
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from core.config import PARTITIONED_TABLES, RETENTION_DAYS
+
+# Границы из pg_get_expr(relpartbound): FOR VALUES FROM ('2024-01-01 00:00:00') TO ('2024-01-02 00:00:00')
+_BOUND_RE = re.compile(r"FROM \((MINVALUE|'[^']*')\) TO \((MAXVALUE|'[^']*')\)")
+
+
+def _parse_bound(value):
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.datetime.fromisoformat(value.strip("'"))
+
+
+def table_exists(db: Session, table: str) -> bool:
+    return db.execute(text("SELECT to_regclass(:t)"), {"t": table}).scalar() is not None
+
+
+def list_partitions(db: Session, table: str):
+    """Return [(name, lower, upper)] of range partitions, None bound means MINVALUE/MAXVALUE"""
+    rows = db.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:t AS regclass)
+    """), {"t": table}).all()
+    partitions = []
+    for row in rows:
+        match = _BOUND_RE.search(row.bound)
+        if match:
+            partitions.append((row.relname, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return partitions
+
+
+def _overlaps(partitions, start, end):
+    for _, lower, upper in partitions:
+        if (lower is None or lower < end) and (upper is None or upper > start):
+            return True
+    return False
+
+
+def create_day_partition(db: Session, table: str, day: datetime.date):
+    """Create partition of table for one day, moving matching rows out of the default partition"""
+    name = f"{table}_p{day:%Y%m%d}"
+    start = datetime.datetime.combine(day, datetime.time.min)
+    end = start + datetime.timedelta(days=1)
+    params = {"start": start, "end": end}
+
+    default = f"{table}_default"
+    has_default_rows = table_exists(db, default) and db.execute(
+        text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE timestamp >= :start AND timestamp < :end)"),
+        params
+    ).scalar()
+
+    if has_default_rows:
+        # Нельзя создать партицию, пока её строки лежат в default: переносим их в отдельную таблицу и подключаем её
+        db.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        db.execute(text(
+            f"WITH moved AS (DELETE FROM {default} WHERE timestamp >= :start AND timestamp < :end RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ), params)
+        db.execute(text(
+            f"ALTER TABLE {table} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{start.isoformat(sep=' ')}') TO ('{end.isoformat(sep=' ')}')"
+        ))
+    else:
+        db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{start.isoformat(sep=' ')}') TO ('{end.isoformat(sep=' ')}')"
+        ))
+    return name
+
+
+def ensure_partitions(db: Session, days_ahead: int):
+    """Create daily partitions from today up to days_ahead for every partitioned table"""
+    today = datetime.datetime.utcnow().date()
+    created = []
+    for table in PARTITIONED_TABLES:
+        if not table_exists(db, table):
+            continue
+        partitions = list_partitions(db, table)
+        for offset in range(days_ahead + 1):
+            day = today + datetime.timedelta(days=offset)
+            start = datetime.datetime.combine(day, datetime.time.min)
+            if _overlaps(partitions, start, start + datetime.timedelta(days=1)):
+                continue
+            try:
+                created.append(create_day_partition(db, table, day))
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f"❌ Failed to create partition of {table} for {day}: {e}")
+    return created
+
+
+def drop_expired_partitions(db: Session):
+    """Drop partitions that lie entirely before the table retention cutoff.
+
+    Dropping a partition is a catalog operation: no row-by-row DELETE, no
+    table bloat and no vacuum afterwards. Rows that ended up in the default
+    partition are few and are deleted normally.
+    """
+    now = datetime.datetime.utcnow()
+    dropped = []
+    for table in PARTITIONED_TABLES:
+        if not table_exists(db, table):
+            continue
+        cutoff = now - datetime.timedelta(days=RETENTION_DAYS[table])
+        for name, _, upper in list_partitions(db, table):
+            if upper is not None and upper <= cutoff:
+                db.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                db.execute(text(f"DROP TABLE {name}"))
+                db.commit()
+                dropped.append(name)
+
+        default = f"{table}_default"
+        if table_exists(db, default):
+            db.execute(text(f"DELETE FROM {default} WHERE timestamp < :cutoff"), {"cutoff": cutoff})
+            db.commit()
+    return dropped
+
+
+def delete_expired_rows(db: Session, table: str, column: str, cutoff: datetime.datetime, batch_size: int = 5000):
+    """Delete rows older than cutoff from a non-partitioned table in short transactions"""
+    deleted_count = 0
+    while True:
+        deleted = db.execute(text(f"""
+            DELETE FROM {table}
+            WHERE ctid IN (SELECT ctid FROM {table} WHERE {column} < :cutoff LIMIT :batch)
+        """), {"cutoff": cutoff, "batch": batch_size}).rowcount
+        db.commit()
+        deleted_count += deleted
+        if deleted < batch_size:
+            break
+    return deleted_count
@@ -0,0 +1,214 @@
+import datetime
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Метрики, которые сворачиваются в агрегаты: {сырая таблица: {имя метрики: выражение}}
+ROLLUP_SOURCES = {
+    'memory_info_v2': {
+        'memory_used_bytes': 's.used_bytes',
+        'memory_available_bytes': 's.available_bytes',
+        'swap_used_bytes': 's.swap_used_bytes',
+    },
+    'cpu_info_v2': {
+        'cpu_us': 's.cpu_us',
+        'cpu_sy': 's.cpu_sy',
+        'cpu_id': 's.cpu_id',
+        'cpu_wa': 's.cpu_wa',
+        'load_1': 's.load_1',
+    },
+}
+
+# Разрешения от мелкого к крупному: (имя, длина бакета в секундах, таблица, источник)
+RESOLUTIONS = [
+    ('1m', 60, 'metric_rollups_1m', None),
+    ('5m', 300, 'metric_rollups_5m', '1m'),
+    ('1h', 3600, 'metric_rollups_1h', '5m'),
+]
+RESOLUTION_BY_NAME = {r[0]: r for r in RESOLUTIONS}
+
+# Данные моложе этого считаем неполными и не сворачиваем
+ROLLUP_DELAY = datetime.timedelta(minutes=1)
+# Максимальный кусок сырых данных за один проход, чтобы догоняющий прогон не держал долгих транзакций
+ROLLUP_MAX_CHUNK = datetime.timedelta(hours=6)
+
+# Каждый проход сворачивает бакеты целиком (границы выровнены по разрешению), поэтому
+# повторный прогон после отката watermark (досылка спула коллектором) просто пересчитывает бакет
+_UPSERT_TAIL = """
+    ON CONFLICT (host_id, metric, bucket) DO UPDATE SET
+        min_value = EXCLUDED.min_value,
+        max_value = EXCLUDED.max_value,
+        avg_value = EXCLUDED.avg_value,
+        last_value = EXCLUDED.last_value,
+        samples = EXCLUDED.samples
+"""
+
+
+def _floor(ts: datetime.datetime, seconds: int) -> datetime.datetime:
+    epoch = datetime.datetime(1970, 1, 1)
+    return epoch + datetime.timedelta(seconds=int((ts - epoch).total_seconds()) // seconds * seconds)
+
+
+def _bucket_expr(column: str, seconds: int) -> str:
+    return f"date_bin('{seconds} seconds', {column}, TIMESTAMP '1970-01-01')"
+
+
+def _get_watermark(db: Session, source: str, resolution: str):
+    return db.execute(
+        text("SELECT watermark FROM rollup_watermarks WHERE source = :source AND resolution = :resolution"),
+        {"source": source, "resolution": resolution}
+    ).scalar()
+
+
+def _set_watermark(db: Session, source: str, resolution: str, watermark: datetime.datetime):
+    db.execute(text("""
+        INSERT INTO rollup_watermarks (source, resolution, watermark)
+        VALUES (:source, :resolution, :watermark)
+        ON CONFLICT (source, resolution) DO UPDATE SET watermark = EXCLUDED.watermark
+    """), {"source": source, "resolution": resolution, "watermark": watermark})
+
+
+def _rollup_raw(db: Session, source: str, metrics: dict, start, end):
+    """Aggregate raw rows of source in [start, end) into 1-minute buckets"""
+    values = ", ".join(f"('{name}', ({expr})::FLOAT8)" for name, expr in metrics.items())
+    table = 'metric_rollups_1m'
+    result = db.execute(text(f"""
+        INSERT INTO {table} (host_id, metric, bucket, min_value, max_value, avg_value, last_value, samples)
+        SELECT s.host_id, v.metric, date_trunc('minute', s.timestamp) AS bucket,
+               min(v.value), max(v.value), avg(v.value),
+               (array_agg(v.value ORDER BY s.timestamp DESC))[1], count(*)
+        FROM {source} s
+        CROSS JOIN LATERAL (VALUES {values}) AS v(metric, value)
+        WHERE s.timestamp >= :start AND s.timestamp < :end AND v.value IS NOT NULL
+        GROUP BY s.host_id, v.metric, bucket
+    """ + _UPSERT_TAIL.format(table=table)), {"start": start, "end": end})
+    return result.rowcount
+
+
+def _rollup_rollup(db: Session, metrics: list, source_table: str, table: str, seconds: int, start, end):
+    """Aggregate finer rollup buckets in [start, end) into coarser ones"""
+    result = db.execute(text(f"""
+        INSERT INTO {table} (host_id, metric, bucket, min_value, max_value, avg_value, last_value, samples)
+        SELECT host_id, metric, {_bucket_expr('bucket', seconds)} AS coarse,
+               min(min_value), max(max_value),
+               sum(avg_value * samples) / NULLIF(sum(samples), 0),
+               (array_agg(last_value ORDER BY bucket DESC))[1], sum(samples)
+        FROM {source_table}
+        WHERE bucket >= :start AND bucket < :end AND metric = ANY(:metrics)
+        GROUP BY host_id, metric, coarse
+    """ + _UPSERT_TAIL.format(table=table)), {"start": start, "end": end, "metrics": metrics})
+    return result.rowcount
+
+
+def run_rollups(db: Session, now: datetime.datetime = None):
+    """Roll up raw data that arrived since the stored watermarks.
+
+    Every resolution only reads data between its watermark and the watermark
+    of its source, so each run touches new data only. Rows arriving later
+    than ROLLUP_DELAY after their timestamp are not rolled up unless the
+    watermark is moved back (the collector does so after a spool replay).
+    """
+    now = now or datetime.datetime.utcnow()
+    stats = {}
+    for source, metrics in ROLLUP_SOURCES.items():
+        if db.execute(text("SELECT to_regclass(:t)"), {"t": source}).scalar() is None:
+            continue
+        metric_names = list(metrics)
+        source_end = None
+        for name, seconds, table, parent in RESOLUTIONS:
+            if parent is None:
+                # Верхняя граница - последняя полная минута
+                upper = _floor(now - ROLLUP_DELAY, seconds)
+            else:
+                upper = _floor(source_end, seconds) if source_end else None
+            if upper is None:
+                break
+
+            start = _get_watermark(db, source, name)
+            if start is None:
+                first = db.execute(text(
+                    f"SELECT min(timestamp) FROM {source}" if parent is None
+                    else f"SELECT min(bucket) FROM {RESOLUTION_BY_NAME[parent][2]} WHERE metric = ANY(:metrics)"
+                ), {"metrics": metric_names}).scalar()
+                if first is None:
+                    break
+                start = _floor(first, seconds)
+
+            end = min(upper, start + ROLLUP_MAX_CHUNK)
+            if end > start:
+                if parent is None:
+                    rows = _rollup_raw(db, source, metrics, start, end)
+                else:
+                    rows = _rollup_rollup(db, metric_names, RESOLUTION_BY_NAME[parent][2],
+                                          table, seconds, start, end)
+                _set_watermark(db, source, name, end)
+                db.commit()
+                stats[f"{source}:{name}"] = rows
+            source_end = max(start, end)
+    return stats
+
+
+def choose_resolution(hours: float, points: int):
+    """Pick the coarsest resolution whose bucket still gives at least `points` points over the range.
+
+    Returns None when raw rows are fine enough.
+    """
+    step = hours * 3600 / max(points, 1)
+    chosen = None
+    for name, seconds, _, _ in RESOLUTIONS:
+        if seconds <= step:
+            chosen = name
+    return chosen
+
+
+async def get_metric_series(db: AsyncSession, hostname: str, metric: str, hours: float = 24, points: int = 300):
+    """Return at most `points` aggregated points of one host metric over the last N hours"""
+    source = next((s for s, metrics in ROLLUP_SOURCES.items() if metric in metrics), None)
+    if source is None:
+        raise ValueError(f"Unknown metric {metric}")
+
+    since = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    step = max(int(hours * 3600 / max(points, 1)), 1)
+    resolution = choose_resolution(hours, points)
+    params = {"hostname": hostname, "since": since}
+
+    if resolution is None:
+        # Диапазон настолько короткий, что хватает сырых строк
+        expr = ROLLUP_SOURCES[source][metric]
+        rows = (await db.execute(text(f"""
+            SELECT {_bucket_expr('s.timestamp', step)} AS bucket,
+                   min({expr}) AS min_value, max({expr}) AS max_value, avg({expr}) AS avg_value,
+                   (array_agg({expr} ORDER BY s.timestamp DESC))[1] AS last_value
+            FROM {source} s JOIN hosts h ON h.id = s.host_id
+            WHERE h.hostname = :hostname AND s.timestamp >= :since
+            GROUP BY 1 ORDER BY 1
+        """), params)).all()
+    else:
+        table = RESOLUTION_BY_NAME[resolution][2]
+        params["metric"] = metric
+        rows = (await db.execute(text(f"""
+            SELECT {_bucket_expr('r.bucket', step)} AS bucket,
+                   min(r.min_value) AS min_value, max(r.max_value) AS max_value,
+                   sum(r.avg_value * r.samples) / NULLIF(sum(r.samples), 0) AS avg_value,
+                   (array_agg(r.last_value ORDER BY r.bucket DESC))[1] AS last_value
+            FROM {table} r JOIN hosts h ON h.id = r.host_id
+            WHERE h.hostname = :hostname AND r.metric = :metric AND r.bucket >= :since
+            GROUP BY 1 ORDER BY 1
+        """), params)).all()
+
+    return {
+        "hostname": hostname,
+        "metric": metric,
+        "resolution": resolution or "raw",
+        "step_seconds": step,
+        "points": [
+            {
+                "timestamp": r.bucket.isoformat(),
+                "min": r.min_value,
+                "max": r.max_value,
+                "avg": r.avg_value,
+                "last": r.last_value,
+            }
+            for r in rows
+        ],
+    }
@@ -0,0 +1,108 @@
+import asyncio
+import json
+from core.config import CONTAINERS_STREAM, HOST_METRICS_STREAM, ALERTS_STREAM, STREAM_CLIENT_QUEUE
+
+# Сколько ждать новых записей в одном XREAD (мс) и сколько забирать за раз
+STREAM_BLOCK_MS = 5000
+STREAM_READ_COUNT = 500
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def format_entry(stream, fields):
+    """SSE message for one Redis stream entry, None for unknown or empty entries"""
+    if stream == CONTAINERS_STREAM:
+        return _sse("container", {
+            "op": fields.get("op"),
+            "id": fields.get("id"),
+            "version": int(fields.get("version", 0)),
+            "container": json.loads(fields["data"]) if fields.get("data") else None
+        })
+    if stream == HOST_METRICS_STREAM:
+        metrics = json.loads(fields.get("data") or "{}")
+        if not metrics:
+            # Запись без изменений нужна только alerter'у, клиентам слать нечего
+            return None
+        return _sse("host", {
+            "host": fields.get("host"),
+            "timestamp": fields.get("timestamp"),
+            "full": fields.get("full") == "1",
+            "metrics": metrics
+        })
+    if stream == ALERTS_STREAM:
+        return _sse("alert", json.loads(fields.get("data") or "{}"))
+    return None
+
+
+class StreamHub:
+    """Fans out new Redis stream entries to connected clients.
+
+    One reader task per process follows the streams with XREAD and formats
+    every entry once; each client gets the same string through its own bounded
+    queue. A client whose queue is full is disconnected instead of slowing
+    everyone else down.
+    """
+
+    def __init__(self, r, streams=(CONTAINERS_STREAM, HOST_METRICS_STREAM, ALERTS_STREAM), queue_size=STREAM_CLIENT_QUEUE):
+        self.r = r
+        self.streams = streams
+        self.queue_size = queue_size
+        self._clients = set()
+        self._task = None
+        self.dropped = 0
+
+    @property
+    def client_count(self):
+        return len(self._clients)
+
+    def subscribe(self):
+        queue = asyncio.Queue(self.queue_size)
+        self._clients.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self._clients.discard(queue)
+
+    def broadcast(self, message):
+        for queue in list(self._clients):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Клиент не успевает читать: очищаем очередь и отдаём ему сигнал на отключение
+                self._clients.discard(queue)
+                self.dropped += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def _run(self):
+        # Клиентам нужны только новые записи, история есть в /api/containers и /api/metrics
+        last_ids = {stream: "$" for stream in self.streams}
+        while self._clients:
+            try:
+                response = await self.r.xread(last_ids, count=STREAM_READ_COUNT, block=STREAM_BLOCK_MS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Stream reader error: {e}")
+                await asyncio.sleep(1)
+                continue
+            for stream, entries in response or []:
+                for entry_id, fields in entries:
+                    last_ids[stream] = entry_id
+                    message = format_entry(stream, fields)
+                    if message:
+                        self.broadcast(message)
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
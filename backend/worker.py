@@ -2,10 +2,167 @@ import redis
 import json
 import time
 import os
+import socket
+import uuid
+from sqlalchemy import insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
-from models.database import SessionLocal, ContainerHistory, create_tables
+from models.database import SessionLocal, ContainerHistory, ContainerCurrent, create_tables
+from core.config import CONTAINERS_HASH, CONTAINERS_STREAM, HISTORY_GENERATION
 import datetime
 
+# Consumer group воркеров в потоке изменений контейнеров
+WORKER_GROUP = os.getenv('WORKER_GROUP', 'worker')
+WORKER_CONSUMER = os.getenv('WORKER_CONSUMER', socket.gethostname())
+WORKER_BATCH_SIZE = int(os.getenv('WORKER_BATCH_SIZE', '1000'))
+# Сообщения упавших воркеров, не подтверждённые дольше этого, забираем себе
+WORKER_CLAIM_IDLE_MS = int(os.getenv('WORKER_CLAIM_IDLE_MS', '60000'))
+# Как часто проверять, не упал ли другой воркер с неподтверждёнными сообщениями
+WORKER_CLAIM_INTERVAL = float(os.getenv('WORKER_CLAIM_INTERVAL', '30'))
+# Читает поток один воркер: кэш статусов верен, только если через него проходят все записи.
+# Остальные ждут, пока лидер не перестанет продлевать ключ
+WORKER_LOCK_KEY = "worker:leader"
+WORKER_LOCK_TTL = int(os.getenv('WORKER_LOCK_TTL', '30'))
+_leader_token = f"{WORKER_CONSUMER}:{uuid.uuid4().hex}"
+# Продлеваем ключ, только если он всё ещё наш
+_RENEW_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def load_last_statuses(db: Session):
+    """Последний статус каждого контейнера из containers_current: {(host, имя): статус}"""
+    rows = db.execute(select(ContainerCurrent.host, ContainerCurrent.container_name, ContainerCurrent.status)).all()
+    return {(row.host, row.container_name): row.status for row in rows}
+
+
+def hold_leadership(r):
+    """Take or renew the worker lock, True while this worker is the one reading the stream"""
+    if r.set(WORKER_LOCK_KEY, _leader_token, nx=True, ex=WORKER_LOCK_TTL):
+        return True
+    return bool(r.eval(_RENEW_LOCK, 1, WORKER_LOCK_KEY, _leader_token, WORKER_LOCK_TTL))
+
+
+def ensure_group(r):
+    try:
+        r.xgroup_create(CONTAINERS_STREAM, WORKER_GROUP, id='$', mkstream=True)
+        return True
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+        return False
+
+
+def claim_stale(r):
+    """Move messages idle longer than WORKER_CLAIM_IDLE_MS to this consumer, returns how many"""
+    claimed = 0
+    start_id = '0-0'
+    while True:
+        # Один вызов просматривает не больше count записей pending - идём по курсору до конца
+        result = r.xautoclaim(CONTAINERS_STREAM, WORKER_GROUP, WORKER_CONSUMER, WORKER_CLAIM_IDLE_MS,
+                              start_id=start_id, count=WORKER_BATCH_SIZE)
+        start_id, messages = result[0], result[1]
+        claimed += len(messages)
+        if start_id == '0-0':
+            return claimed
+
+
+def _entry_time(entry_id):
+    # Id записи потока начинается с времени добавления в миллисекундах
+    return datetime.datetime.utcfromtimestamp(int(entry_id.split('-')[0]) / 1000)
+
+
+def collect_transitions(containers, last_status):
+    """Rows for containers whose status differs from the cached one.
+
+    containers is an iterable of (container dict, timestamp); last_status is
+    keyed by (host, name) and updated in place so several transitions of one
+    container in a batch are all kept.
+    """
+    rows = []
+    for container, timestamp in containers:
+        container_name = container["name"]
+        current_status = container["status"]
+        host = container.get("host") or ""
+        if last_status.get((host, container_name)) != current_status:
+            last_status[(host, container_name)] = current_status
+            rows.append({
+                "host": host,
+                "container_name": container_name,
+                "status": current_status,
+                "image": container.get("image", "unknown"),
+                "timestamp": timestamp
+            })
+    return rows
+
+
+def save_transitions(db: Session, rows):
+    """Одна вставка в историю и один upsert текущего состояния на всю пачку"""
+    if rows:
+        db.execute(insert(ContainerHistory), [dict(row, host=row["host"] or None) for row in rows])
+        # В пачке может быть несколько переходов одного контейнера, в upsert идёт последний
+        latest = {}
+        for row in rows:
+            latest[(row["host"], row["container_name"])] = row
+        stmt = pg_insert(ContainerCurrent).values([
+            {
+                "host": row["host"],
+                "container_name": row["container_name"],
+                "status": row["status"],
+                "image": row["image"],
+                "updated_at": row["timestamp"]
+            }
+            for row in latest.values()
+        ])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[ContainerCurrent.host, ContainerCurrent.container_name],
+            set_={
+                "status": stmt.excluded.status,
+                "image": stmt.excluded.image,
+                "updated_at": stmt.excluded.updated_at
+            },
+            # Запоздавшая пачка не перетирает более свежее состояние
+            where=ContainerCurrent.updated_at <= stmt.excluded.updated_at
+        ))
+    db.commit()
+
+
+def process_entries(r, db, entries, last_status):
+    containers = []
+    ids = []
+    for entry_id, fields in entries:
+        ids.append(entry_id)
+        # Запись могла быть вытеснена из потока по MAXLEN, пока висела в pending
+        fields = fields or {}
+        if fields.get("op") == "set" and fields.get("data"):
+            try:
+                container = json.loads(fields["data"])
+                if not isinstance(container.get("name"), str) or not isinstance(container.get("status"), str):
+                    raise ValueError("no name or status")
+            except (ValueError, AttributeError) as e:
+                # Битая запись подтверждается вместе с пачкой, иначе её перечитывали бы из pending вечно
+                print(f"⚠️ Skipping bad container entry {entry_id}: {e}")
+                continue
+            containers.append((container, _entry_time(entry_id)))
+
+    # Кэш меняем только после успешного commit
+    pending_status = dict(last_status)
+    rows = collect_transitions(containers, pending_status)
+    save_transitions(db, rows)
+    last_status.clear()
+    last_status.update(pending_status)
+    if rows:
+        # Кэш ответов API с историей становится устаревшим
+        r.incr(HISTORY_GENERATION)
+
+    if ids:
+        r.xack(CONTAINERS_STREAM, WORKER_GROUP, *ids)
+    return len(rows)
+
+
 def process_containers_data():
     # Подключение к Redis
     redis_password = os.getenv('REDIS_PASSWORD', 'your_secure_redis_password_123')
@@ -15,74 +172,86 @@ def process_containers_data():
         password=redis_password,
         decode_responses=True
     )
-    
+
     # Подключение к PostgreSQL
     db = SessionLocal()
+    create_tables()
+
+    print(f"🛠️ Worker {_leader_token} started")
+    leader = False
+    last_status = {}
+    read_id = '0'
+    next_claim = 0
 
-    try:
-        # Проверяем существует ли таблица
-        db.query(ContainerHistory).first()
-    except:
-        print(" Tables don't exist, creating...")
-        create_tables()
-        print(" Tables created")
-    
-    print("🛠️ Worker started...")
-    
     while True:
         try:
-            data = r.get("containers_status")
-            
-            if data:
-                containers_data = json.loads(data)
-                containers_to_save = []
-                
-                # БЕЗОПАСНАЯ ПРОВЕРКА ДУБЛИКАТОВ
-                for container in containers_data:
-                    container_name = container["name"]
-                    current_status = container["status"]
-                    
-                    try:
-                        # Проверяем последнюю запись в БД
-                        last_record = db.query(ContainerHistory).filter(
-                            ContainerHistory.container_name == container_name
-                        ).order_by(ContainerHistory.timestamp.desc()).first()
-                        
-                        # Если нет записей или статус изменился
-                        if not last_record or last_record.status != current_status:
-                            containers_to_save.append(container)
-                            
-                    except Exception as e:
-                        # Если таблицы нет, сохраняем все данные
-                        print(f"⚠️ Table error, saving all data: {e}")
-                        containers_to_save = containers_data
-                        break
-                
-                # Сохраняем данные
-                if containers_to_save:
-                    for container in containers_to_save:
-                        db_container = ContainerHistory(
-                            container_name=container["name"],
-                            status=container["status"],
-                            image=container.get("image", "unknown"),
-                            timestamp=datetime.datetime.utcnow()
-                        )
-                        db.add(db_container)
-                    
-                    db.commit()
-                    print(f"✅ Worker saved {len(containers_to_save)} containers to PostgreSQL")
-                else:
-                    print("⏳ No container status changes detected")
-            
-            else:
-                print("⏳ No data in Redis yet...")
-            
-            time.sleep(60)
-            
+            if not hold_leadership(r):
+                if leader:
+                    print("⚠️ Worker lock lost, another worker reads the stream now")
+                    leader = False
+                time.sleep(WORKER_LOCK_TTL / 3)
+                continue
+            if not leader:
+                # Предыдущий лидер мог записать переходы после нашего прошлого чтения - кэш только из БД
+                last_status = load_last_statuses(db)
+                print(f"👑 Worker is the stream reader, {len(last_status)} containers in cache")
+                if ensure_group(r):
+                    # Группа создана только что: сверяем текущее состояние, чтобы не потерять изменения до её появления
+                    now = datetime.datetime.utcnow()
+                    snapshot = [(json.loads(value), now) for value in r.hgetall(CONTAINERS_HASH).values()]
+                    rows = collect_transitions(snapshot, last_status)
+                    save_transitions(db, rows)
+                    r.incr(HISTORY_GENERATION)
+                    print(f"✅ Initial sync saved {len(rows)} containers")
+                # Сначала дочитываем свои неподтверждённые сообщения и сообщения упавших воркеров
+                read_id = '0'
+                next_claim = 0
+                leader = True
+
+            if time.monotonic() >= next_claim:
+                next_claim = time.monotonic() + WORKER_CLAIM_INTERVAL
+                try:
+                    claimed = claim_stale(r)
+                except redis.ResponseError as e:
+                    if 'NOGROUP' in str(e):
+                        raise
+                    print(f"⚠️ XAUTOCLAIM failed: {e}")
+                    claimed = 0
+                if claimed:
+                    print(f"📥 Claimed {claimed} messages of stopped workers")
+                    # Забранные сообщения лежат в нашем pending - читаем его
+                    read_id = '0'
+
+            response = r.xreadgroup(
+                WORKER_GROUP, WORKER_CONSUMER, {CONTAINERS_STREAM: read_id},
+                count=WORKER_BATCH_SIZE, block=5000
+            )
+            entries = response[0][1] if response else []
+
+            if read_id == '0' and not entries:
+                # Pending-сообщения закончились, дальше только новые
+                read_id = '>'
+                continue
+
+            if entries:
+                saved = process_entries(r, db, entries, last_status)
+                if saved:
+                    print(f"✅ Worker saved {saved} container status changes to PostgreSQL")
+
+        except redis.ResponseError as e:
+            if 'NOGROUP' in str(e):
+                # Поток или группа удалены - создаём заново
+                ensure_group(r)
+                read_id = '0'
+                continue
+            print(f"❌ Worker error: {e}")
+            time.sleep(10)
         except Exception as e:
             print(f"❌ Worker error: {e}")
             db.rollback()
+            # Неподтверждённые сообщения перечитаем из pending
+            read_id = '0'
             time.sleep(10)
 
 if __name__ == "__main__":
-    process_containers_data()
\ No newline at end of file
+    process_containers_data()
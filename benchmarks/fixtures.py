@@ -0,0 +1,182 @@
+import json
+import os
+import random
+
+# Состояния TCP в /proc/net/tcp: ESTABLISHED, TIME_WAIT, CLOSE_WAIT, LISTEN
+_SOCKET_STATES = ('01', '06', '08', '0A')
+_COMMANDS = ('/usr/bin/python3 worker.py', 'postgres: writer', 'nginx: worker process', '/usr/sbin/sshd -D',
+             'node server.js --port 3000', 'java -Xmx2g -jar app.jar', '/bin/bash', 'redis-server *:6379')
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def _hex_address(ip, port, v6):
+    if v6:
+        return f"{'0' * 24}{ip:08X}:{port:04X}"
+    return f"{ip:08X}:{port:04X}"
+
+
+class HostTree:
+    """Synthetic host root (proc, etc, mount points) for the collector parsers.
+
+    processes, sockets, mounts and cgroups (container cgroup v2 directories)
+    set the size of the tree; advance() moves process and container counters
+    forward so consecutive samples see changes.
+    """
+
+    def __init__(self, root, processes=500, sockets=2000, mounts=8, interfaces=4, cgroups=0, seed=1):
+        self.root = root
+        self.processes = processes
+        self.sockets = sockets
+        self.mounts = mounts
+        self.interfaces = interfaces
+        # Id контейнеров различаются в первых 12 символах, как настоящие
+        self.cgroups = [f"{number:064x}"[::-1] for number in range(cgroups)]
+        self.random = random.Random(seed)
+        self.ticks = 0
+        self._pids = list(range(1, processes + 1))
+        self._cpu = {pid: 0 for pid in self._pids}
+
+    def path(self, relative):
+        return os.path.join(self.root, relative.lstrip('/'))
+
+    def build(self):
+        rnd = self.random
+        _write(self.path('etc/hostname'), 'bench-host\n')
+        _write(self.path('etc/passwd'), ''.join(f"user{uid}:x:{uid}:{uid}::/home/user{uid}:/bin/sh\n"
+                                                for uid in range(0, 1100, 100)))
+        _write(self.path('proc/meminfo'), (
+            "MemTotal:       32768000 kB\nMemFree:         8192000 kB\nMemAvailable:   16384000 kB\n"
+            "Buffers:          512000 kB\nCached:          4096000 kB\nShmem:            256000 kB\n"
+            "SwapTotal:       2048000 kB\nSwapFree:        1024000 kB\n"
+        ))
+        _write(self.path('proc/loadavg'), f"1.25 0.98 0.75 3/{self.processes} {self.processes}\n")
+        _write(self.path('proc/uptime'), "864000.00 3456000.00\n")
+
+        for pid in self._pids:
+            cmdline = rnd.choice(_COMMANDS).replace(' ', '\0') + f"\0--id={pid}\0"
+            _write(self.path(f'proc/{pid}/cmdline'), cmdline)
+            os.makedirs(self.path(f'proc/{pid}/fd'), exist_ok=True)
+
+        # Сокеты раскладываем по процессам, чтобы socket_owners было что искать
+        lines = {proto: [] for proto in ('tcp', 'tcp6', 'udp', 'udp6')}
+        for number in range(self.sockets):
+            proto = rnd.choice(('tcp', 'tcp', 'tcp', 'tcp6', 'udp', 'udp6'))
+            state = rnd.choice(_SOCKET_STATES) if proto.startswith('tcp') else '07'
+            inode = 100000 + number
+            v6 = proto.endswith('6')
+            local = _hex_address(0x0100007F, 1024 + number % 60000, v6)
+            remote = _hex_address(rnd.getrandbits(32), rnd.randint(1024, 65535), v6) if state != '0A' else \
+                _hex_address(0, 0, v6)
+            lines[proto].append(
+                f"{len(lines[proto]):4d}: {local} {remote} {state} 00000000:00000000 00:00000000 00000000"
+                f" {rnd.choice((0, 100, 1000)):5d} 0 {inode} 1 0000000000000000 100 0 0 10 0"
+            )
+            if state == '0A' or not proto.startswith('tcp'):
+                owner = self._pids[number % len(self._pids)]
+                link = self.path(f'proc/{owner}/fd/{3 + number}')
+                if not os.path.lexists(link):
+                    os.symlink(f'socket:[{inode}]', link)
+        header = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+        for proto, proto_lines in lines.items():
+            _write(self.path(f'proc/net/{proto}'), header + "\n".join(proto_lines) + "\n")
+
+        mounts = ["proc /proc proc rw 0 0", "sysfs /sys sysfs rw 0 0", "overlay / overlay rw 0 0"]
+        for number in range(self.mounts):
+            mount_point = f"/mnt/disk{number}"
+            os.makedirs(self.path(mount_point), exist_ok=True)
+            mounts.append(f"/dev/sd{chr(97 + number % 26)}{number // 26 + 1} {mount_point} ext4 rw,relatime 0 0")
+        _write(self.path('proc/mounts'), "\n".join(mounts) + "\n")
+
+        if self.cgroups:
+            _write(self.path('sys/fs/cgroup/cgroup.controllers'), "cpuset cpu io memory pids\n")
+        for container_id in self.cgroups:
+            _write(self.path(f'sys/fs/cgroup/system.slice/docker-{container_id}.scope/memory.max'),
+                   rnd.choice(("max\n", f"{rnd.randint(1, 64) * 1024 ** 3}\n")))
+
+        self.advance()
+        return self
+
+    def advance(self):
+        """Write the next sample of /proc/stat, /proc/net/dev and per-process counters"""
+        rnd = self.random
+        self.ticks += 1000
+        t = self.ticks
+        _write(self.path('proc/stat'), (
+            f"cpu  {t * 4} {t // 10} {t * 2} {t * 20} {t // 5} 0 {t // 20} 0 0 0\n"
+            f"btime 1700000000\nprocs_running {rnd.randint(1, 8)}\nprocs_blocked {rnd.randint(0, 2)}\n"
+        ))
+        dev = ["Inter-|   Receive                                                |  Transmit",
+               " face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed"]
+        for number in range(self.interfaces):
+            name = 'lo' if number == 0 else f'eth{number - 1}'
+            rx, tx = t * 1500 * (number + 1), t * 700 * (number + 1)
+            dev.append(f"{name:>6}: {rx} {rx // 1000} {t // 10000} 0 0 0 0 0 {tx} {tx // 1000} 0 0 0 0 0 0")
+        _write(self.path('proc/net/dev'), "\n".join(dev) + "\n")
+
+        for number, container_id in enumerate(self.cgroups):
+            directory = f'sys/fs/cgroup/system.slice/docker-{container_id}.scope'
+            usage = t * (number % 50 + 1) * 100
+            _write(self.path(f'{directory}/cpu.stat'), (
+                f"usage_usec {usage}\nuser_usec {usage * 2 // 3}\nsystem_usec {usage // 3}\n"
+                f"nr_periods {t}\nnr_throttled {t // 100}\nthrottled_usec {t * 10}\n"
+            ))
+            anon, file = (number % 64 + 1) * 1024 ** 2 * 8, (number % 16 + 1) * 1024 ** 2 * 4 + t
+            _write(self.path(f'{directory}/memory.current'), f"{anon + file}\n")
+            _write(self.path(f'{directory}/memory.stat'), "".join(
+                f"{key} {value}\n" for key, value in (
+                    ('anon', anon), ('file', file), ('kernel', 4096 * 300), ('kernel_stack', 16384),
+                    ('pagetables', 4096 * 50), ('sec_pagetables', 0), ('percpu', 1024), ('sock', 0),
+                    ('vmalloc', 0), ('shmem', 0), ('zswap', 0), ('zswapped', 0), ('file_mapped', file // 4),
+                    ('file_dirty', 0), ('file_writeback', 0), ('swapcached', 0), ('anon_thp', 0),
+                    ('file_thp', 0), ('shmem_thp', 0), ('inactive_anon', anon // 2), ('active_anon', anon // 2),
+                    ('inactive_file', file // 2), ('active_file', file // 2), ('unevictable', 0),
+                    ('slab_reclaimable', 4096 * 100), ('slab_unreclaimable', 4096 * 80), ('slab', 4096 * 180),
+                    ('workingset_refault_anon', 0), ('workingset_refault_file', t // 100),
+                    ('workingset_activate_anon', 0), ('workingset_activate_file', 0),
+                    ('workingset_restore_anon', 0), ('workingset_restore_file', 0),
+                    ('workingset_nodereclaim', 0), ('pgscan', 0), ('pgsteal', 0), ('pgfault', t * 3),
+                    ('pgmajfault', t // 1000), ('pgrefill', 0), ('pgactivate', t), ('pgdeactivate', 0),
+                    ('pglazyfree', 0), ('pglazyfreed', 0), ('thp_fault_alloc', 0), ('thp_collapse_alloc', 0),
+                )
+            ))
+            _write(self.path(f'{directory}/io.stat'), "".join(
+                f"{major}:0 rbytes={t * 4096 * (major - 7)} wbytes={t * 8192} rios={t} wios={t * 2}"
+                f" dbytes=0 dios=0\n"
+                for major in (8, 9)
+            ))
+
+        # Примерно десятая часть процессов активна между сэмплами
+        for pid in self._pids:
+            if self.ticks == 1000 or rnd.random() < 0.1:
+                self._cpu[pid] += rnd.randint(1, 200)
+                cpu = self._cpu[pid]
+                _write(self.path(f'proc/{pid}/stat'), (
+                    f"{pid} (proc-{pid % 50}) {'R' if cpu % 7 == 0 else 'S'} 1 {pid} {pid} 0 -1 4194560 "
+                    f"100 0 0 0 {cpu} {cpu // 3} 0 0 20 0 1 0 {pid * 10} {pid * 4096 * 256} {pid % 500 + 100} "
+                    "18446744073709551615 0 0 0 0 0 0 0 0 0 0 0 0 17 0 0 0 0 0 0\n"
+                ))
+                _write(self.path(f'proc/{pid}/io'), (
+                    f"rchar: {cpu * 4096}\nwchar: {cpu * 2048}\nsyscr: {cpu}\nsyscw: {cpu}\n"
+                    f"read_bytes: {cpu * 4096}\nwrite_bytes: {cpu * 1024}\ncancelled_write_bytes: 0\n"
+                ))
+
+
+def make_containers(count, hosts=4, seed=1):
+    """Container dicts as published by docker_collector: {id: json}"""
+    rnd = random.Random(seed)
+    containers = {}
+    for number in range(count):
+        container_id = f"{number:012x}"
+        containers[container_id] = json.dumps({
+            "name": f"app-{number}",
+            "status": rnd.choice(("running", "running", "running", "exited", "restarting")),
+            "image": f"registry.local/service-{number % 40}:1.{number % 7}",
+            "id": container_id,
+            "host": f"host-{number % hosts}",
+        })
+    return containers
@@ -0,0 +1,391 @@
+"""Pipeline benchmarks on synthetic data.
+
+Builds a fake host tree (N processes, M sockets, K mounts) and a container
+list, then measures the collector parsers, BatchWriter, the spool, the
+worker, ingest decoding and the API handlers against in-process Redis and
+PostgreSQL stand-ins. No network is used.
+
+    python -m benchmarks.run --out benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json
+
+A comparison run must use the baseline's workload parameters (the
+defaults for the committed baseline), otherwise it exits with code 2.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import msgpack
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# backend первым: main.py есть в обоих каталогах, а бенчмарки API нужен backend/main.py
+sys.path[:0] = [os.path.join(ROOT, 'backend'), os.path.join(ROOT, 'monitoring-collector')]
+# Ничего не слушаем и не пишем за пределы временного каталога
+os.environ.setdefault('METRICS_PORT', '0')
+os.environ.setdefault('COLLECTOR_MODE', 'db')
+
+from benchmarks.fixtures import HostTree, make_containers
+from benchmarks.standins import FakeRedis, FakeAsyncRedis, RedisStore, FakePgConnection, FakeSession
+
+
+def percentile(sorted_values, q):
+    return sorted_values[max(math.ceil(q * len(sorted_values)) - 1, 0)]
+
+
+def measure(func, iterations, setup=None, warmup=1):
+    """Run func iterations times; func returns the number of items it processed"""
+    for _ in range(warmup):
+        if setup:
+            setup()
+        func()
+    times = []
+    items = 0
+    for _ in range(iterations):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        count = func()
+        times.append(time.perf_counter() - started)
+        items += count if isinstance(count, int) else 1
+    ordered = sorted(times)
+    return {
+        "iterations": iterations,
+        "items_per_op": items / iterations,
+        "p50_ms": round(percentile(ordered, 0.5) * 1000, 4),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 4),
+        "mean_ms": round(sum(times) / len(times) * 1000, 4),
+        "throughput_per_sec": round(items / sum(times), 1) if sum(times) else None,
+    }
+
+
+# --- сборщик ---
+
+def make_writer(**kwargs):
+    from collectors import schema
+    from collectors.db_writer import BatchWriter
+
+    class BenchWriter(BatchWriter):
+        """BatchWriter over a stand-in connection"""
+
+        def __init__(self, **kw):
+            super().__init__({}, upserts=schema.UPSERT_TABLES, **kw)
+            self.conn = FakePgConnection()
+
+        def get_connection(self):
+            return self.conn
+
+        def put_connection(self, conn, broken=False):
+            pass
+
+        def _statement(self, conn, table, columns, mode):
+            # Identifier.as_string требует настоящее соединение
+            names = ', '.join(f'"{c}"' for c in columns)
+            if mode == 'copy':
+                return f'COPY "{table}" ({names}) FROM STDIN'
+            statement = f'INSERT INTO "{table}" ({names}) VALUES %s'
+            return f"{statement} {self.upserts[table][1]}" if table in self.upserts else statement
+
+    return BenchWriter(**kwargs)
+
+
+def prepare_collector(args, workdir):
+    """Point system_collector at a fresh host tree and stand-ins"""
+    from collectors import system_collector as sc
+
+    tree = HostTree(os.path.join(workdir, 'host'), args.processes, args.sockets, args.mounts,
+                    cgroups=args.cgroups, seed=args.seed).build()
+    sc.HOST_PREFIX = tree.root
+    sc._redis = FakeRedis()
+    sc._writer = make_writer()
+    return tree
+
+
+def bench_collector(args, tree, workdir):
+    from collectors import system_collector as sc
+
+    now = datetime.datetime.now
+    n = args.iterations
+    results = {}
+
+    results['parse_memory'] = measure(lambda: sc.parse_memory_info_from_host(1, now()) and 1, n)
+    results['parse_cpu'] = measure(lambda: sc.parse_cpu_info_from_host(1, now()) and 1, n, setup=tree.advance)
+    results['parse_disk'] = measure(lambda: len(sc.parse_disk_info_from_host(1, now())), n)
+    results['parse_process'] = measure(lambda: len(sc.parse_process_info_from_host(1, now())), n, setup=tree.advance)
+    results['parse_network'] = measure(lambda: len(sc.parse_network_info_from_host(1, now())), n)
+    results['parse_interface'] = measure(lambda: len(sc.parse_interface_info_from_host(1, now())), n,
+                                         setup=tree.advance)
+    results['parse_tcp_state'] = measure(lambda: len(sc.parse_tcp_states_from_host(1, now())), n)
+    results['parse_container_stats'] = measure(lambda: len(sc.parse_container_stats_from_host(1, now())), n,
+                                               setup=tree.advance)
+    results['collect_sample'] = measure(lambda: sc.collect_sample(1, 'bench-host') and 1, n, setup=tree.advance)
+
+    # Ключевой кадр процессов - самая большая пачка, которую пишет сборщик
+    sc._process_samples = 0
+    rows = sc.parse_process_info_from_host(1, now())
+    columns = tuple(rows[0])
+    values = [tuple(row[c] for c in columns) for row in rows]
+    insert_writer = make_writer(use_copy=False)
+    copy_writer = make_writer(use_copy=True)
+    results['db_write_insert'] = measure(lambda: insert_writer.write_rows('process_info_v2', columns, values)
+                                         or len(values), n)
+    results['db_write_copy'] = measure(lambda: copy_writer.write_rows('process_info_v2', columns, values)
+                                       or len(values), n)
+
+    from collectors.spool import Spool
+    spool = Spool(os.path.join(workdir, 'spool'), fsync_interval=1)
+    results['spool_append'] = measure(lambda: spool.append('process_info_v2', columns, values) or len(values), n)
+    replay_writer = make_writer(spool=spool)
+
+    def fill_spool():
+        for _ in range(10):
+            spool.append('process_info_v2', columns, values)
+    results['spool_replay'] = measure(replay_writer.drain_spool, max(n // 4, 1), setup=fill_spool)
+    spool.close()
+    return results
+
+
+# --- backend ---
+
+def bench_worker(args):
+    import worker
+
+    containers = [json.loads(value) for value in make_containers(args.containers, seed=args.seed).values()]
+    r = FakeRedis()
+    db = FakeSession()
+    last_status = {}
+    state = {"flip": False}
+    entries = []
+
+    def setup():
+        # Каждый прогон меняет статус всех контейнеров, чтобы были переходы
+        state["flip"] = not state["flip"]
+        entries.clear()
+        for number, container in enumerate(containers):
+            data = dict(container, status="running" if state["flip"] else "exited")
+            entries.append((f"{1700000000000 + number}-0", {"op": "set", "id": data["id"], "data": json.dumps(data)}))
+
+    def process():
+        worker.process_entries(r, db, entries, last_status)
+        return len(entries)
+
+    return {'worker_process_entries': measure(process, args.iterations, setup=setup)}
+
+
+def bench_ingest(args):
+    from collectors import system_collector as sc
+    from collectors.agent_pusher import encode_batch
+    from services import ingest_service
+
+    sc._process_samples = 0
+    rows = sc.parse_process_info_from_host(1, datetime.datetime.now())
+    columns = [c for c in rows[0] if c != 'host_id']
+    body = encode_batch('bench-host', {'process_info_v2': (columns, [[row[c] for c in columns] for row in rows])})
+
+    types = {int: 'bigint', float: 'double precision', str: 'character varying', bool: 'boolean',
+             datetime.datetime: 'timestamp without time zone'}
+    sample = next(row for row in rows if row['username'] is not None)
+    # Схема таблицы вместо information_schema
+    ingest_service._table_columns['process_info_v2'] = {
+        c: (types.get(type(sample[c]), 'character varying'), None) for c in rows[0]
+    }
+    loop = asyncio.new_event_loop()
+
+    def decode_and_validate():
+        payload = ingest_service.decode_body(body, 'application/msgpack', 'zstd')
+        _, batches = loop.run_until_complete(ingest_service.validate_batch(None, payload))
+        return sum(len(batch_rows) for _, _, batch_rows in batches)
+
+    containers = [json.loads(c) for c in make_containers(args.containers, seed=args.seed).values()]
+    containers_body = zlib.compress(msgpack.packb(containers), wbits=31)
+
+    def decode_and_validate_containers():
+        payload = ingest_service.decode_body(containers_body, 'application/msgpack', 'gzip')
+        return len(ingest_service.validate_containers(payload))
+
+    result = {
+        'ingest_decode_validate': measure(decode_and_validate, args.iterations),
+        'ingest_containers_validate': measure(decode_and_validate_containers, args.iterations),
+    }
+    loop.close()
+    return result
+
+
+def bench_api(args):
+    from fastapi.testclient import TestClient
+    import main
+    from core.cache import response_cache
+    from core.config import CONTAINERS_HASH, CONTAINERS_STREAM, CONTAINERS_VERSION
+
+    store = RedisStore()
+    sync = FakeRedis(store)
+    containers = make_containers(args.containers, seed=args.seed)
+    sync.hset(CONTAINERS_HASH, containers)
+    sync.set(CONTAINERS_VERSION, 1)
+    for container_id, data in containers.items():
+        sync.xadd(CONTAINERS_STREAM, {"op": "set", "id": container_id, "version": 1, "data": data})
+    main.r = FakeAsyncRedis(store)
+    main.stream_hub.r = main.r
+
+    # Без with: startup не запускается и в PostgreSQL никто не ходит
+    client = TestClient(main.app)
+    n = args.iterations
+
+    def get(path):
+        response = client.get(path)
+        assert response.status_code == 200, response.text
+        return 1
+
+    return {
+        'api_health': measure(lambda: get("/health"), n),
+        'api_containers_cold': measure(lambda: get("/api/containers"), n, setup=response_cache.clear),
+        'api_containers_warm': measure(lambda: get("/api/containers"), n),
+        'api_containers_changes': measure(lambda: get("/api/containers/changes?count=500"), n),
+    }
+
+
+def bench_alerts(args):
+    from services.alert_service import AlertEngine, AlertRule
+
+    metrics = {f"metric_{i}": float(i) for i in range(50)}
+    rules = [AlertRule(f"rule_{i}", f"metric_{i % 50}", '>', 1e9, ('last', 'avg', 'max')[i % 3], 300, 60)
+             for i in range(args.alert_rules)]
+    engine = AlertEngine(rules)
+    clock = {"ts": datetime.datetime(2026, 1, 1), "host": 0}
+
+    def observe():
+        clock["host"] = (clock["host"] + 1) % args.alert_hosts
+        if clock["host"] == 0:
+            clock["ts"] += datetime.timedelta(seconds=10)
+        engine.observe(f"host-{clock['host']}", clock["ts"], metrics)
+        return len(rules)
+
+    return {'alert_engine_observe': measure(observe, args.iterations * 10)}
+
+
+# --- отчёт ---
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Параметры, от которых зависит нагрузка: с другими значениями сравнение с базой бессмысленно
+WORKLOAD_ARGS = ('processes', 'sockets', 'mounts', 'containers', 'cgroups', 'alert_rules', 'alert_hosts', 'seed')
+
+
+def workload_config(args):
+    return {k: v for k, v in vars(args).items() if k not in ('out', 'compare')}
+
+
+def config_mismatch(config, baseline_path):
+    """Workload parameters that differ from the baseline's, as {name: (baseline, current)}"""
+    with open(baseline_path) as f:
+        baseline = json.load(f).get("config", {})
+    return {k: (baseline.get(k), config.get(k)) for k in WORKLOAD_ARGS if baseline.get(k) != config.get(k)}
+
+
+def compare(results, baseline_path, threshold):
+    """Print changes against a baseline file, returns names that got slower than threshold"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    print(f"\nAgainst {baseline_path}:")
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before or not before.get("throughput_per_sec") or not current.get("throughput_per_sec"):
+            continue
+        change = current["throughput_per_sec"] / before["throughput_per_sec"] - 1
+        marker = ""
+        if change < -threshold:
+            regressions.append(name)
+            marker = "  <-- regression"
+        print(f"  {name:28s} {change * 100:+7.1f}% throughput, p50 {before['p50_ms']} -> {current['p50_ms']} ms{marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--processes', type=int, default=500)
+    parser.add_argument('--sockets', type=int, default=2000)
+    parser.add_argument('--mounts', type=int, default=8)
+    parser.add_argument('--containers', type=int, default=1000)
+    parser.add_argument('--cgroups', type=int, default=500, help="container cgroups in the host tree")
+    parser.add_argument('--alert-rules', type=int, default=200)
+    parser.add_argument('--alert-hosts', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', help="comma-separated groups: collector,worker,ingest,api,alerts")
+    parser.add_argument('--out', help="write results to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON to compare with")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed throughput drop, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    if args.compare:
+        # Проверяем до прогона, чтобы не ждать его впустую
+        mismatch = config_mismatch(workload_config(args), args.compare)
+        if mismatch:
+            print(f"❌ {args.compare} was recorded with other parameters, results are not comparable:")
+            for name, (before, current) in mismatch.items():
+                print(f"  --{name.replace('_', '-')} {before} (baseline) vs {current}")
+            sys.exit(2)
+
+    groups = args.only.split(',') if args.only else ['collector', 'worker', 'ingest', 'api', 'alerts']
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='monitoring-bench-') as workdir:
+        tree = None
+        for group in groups:
+            started = time.perf_counter()
+            if group in ('collector', 'ingest') and tree is None:
+                tree = prepare_collector(args, workdir)
+            if group == 'collector':
+                results.update(bench_collector(args, tree, workdir))
+            elif group == 'worker':
+                results.update(bench_worker(args))
+            elif group == 'ingest':
+                results.update(bench_ingest(args))
+            elif group == 'api':
+                results.update(bench_api(args))
+            elif group == 'alerts':
+                results.update(bench_alerts(args))
+            else:
+                parser.error(f"unknown group {group}")
+            print(f"⏱️ {group} done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    print(f"{'benchmark':28s} {'items/op':>10s} {'p50 ms':>10s} {'p99 ms':>10s} {'items/s':>12s}")
+    for name, stats in results.items():
+        print(f"{name:28s} {stats['items_per_op']:10.0f} {stats['p50_ms']:10.3f} {stats['p99_ms']:10.3f} "
+              f"{stats['throughput_per_sec'] or 0:12.0f}")
+
+    report = {
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": workload_config(args),
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results saved to {args.out}")
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} benchmarks regressed more than {args.threshold * 100:.0f}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""In-process stand-ins for Redis and PostgreSQL.
+
+They implement only the calls the benchmarked code makes and keep the data
+in memory, so the numbers show the cost of our own code (parsing, statement
+building, serialization) without network or server time.
+"""
+import itertools
+import time
+
+from psycopg2.extensions import adapt
+from sqlalchemy.dialects import postgresql
+
+
+class RedisStore:
+    """Data shared by the sync and async stand-ins"""
+
+    def __init__(self):
+        self.values = {}
+        self.hashes = {}
+        self.streams = {}
+        self.sets = {}
+        self._ids = itertools.count(1)
+
+
+class FakeRedis:
+    """Synchronous redis.Redis stand-in (decode_responses=True)"""
+
+    def __init__(self, store=None):
+        self.store = store or RedisStore()
+
+    def get(self, key):
+        return self.store.values.get(key)
+
+    def set(self, key, value):
+        self.store.values[key] = str(value)
+        return True
+
+    def incr(self, key):
+        value = int(self.store.values.get(key, 0)) + 1
+        self.store.values[key] = str(value)
+        return value
+
+    def hgetall(self, key):
+        return dict(self.store.hashes.get(key, {}))
+
+    def hset(self, key, mapping):
+        self.store.hashes.setdefault(key, {}).update(mapping)
+        return len(mapping)
+
+    def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            for space in (self.store.values, self.store.hashes, self.store.streams, self.store.sets):
+                removed += space.pop(key, None) is not None
+        return removed
+
+    def expire(self, key, seconds):
+        return True
+
+    def sadd(self, key, *members):
+        members_set = self.store.sets.setdefault(key, set())
+        added = len(set(members) - members_set)
+        members_set.update(members)
+        return added
+
+    def smembers(self, key):
+        return set(self.store.sets.get(key, ()))
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def xadd(self, key, fields, maxlen=None, approximate=True):
+        entry_id = f"{int(time.time() * 1000)}-{next(self.store._ids)}"
+        stream = self.store.streams.setdefault(key, [])
+        stream.append((entry_id, {k: str(v) for k, v in fields.items()}))
+        if maxlen and len(stream) > maxlen:
+            del stream[:len(stream) - maxlen]
+        return entry_id
+
+    def xrange(self, key, min='-', max='+', count=None):
+        entries = self.store.streams.get(key, [])
+        if min.startswith('('):
+            after = min[1:]
+            entries = [e for e in entries if _id_key(e[0]) > _id_key(after)]
+        return entries[:count] if count else list(entries)
+
+    def xack(self, key, group, *ids):
+        return len(ids)
+
+
+class FakePipeline:
+    """Queues FakeRedis calls until execute()"""
+
+    def __init__(self, redis):
+        self._redis = redis
+        self._calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self._redis, name)
+
+        def queue(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        calls, self._calls = self._calls, []
+        return [method(*args, **kwargs) for method, args, kwargs in calls]
+
+
+class FakeAsyncRedis:
+    """redis.asyncio.Redis stand-in over the same store"""
+
+    def __init__(self, store=None):
+        self._sync = FakeRedis(store)
+
+    def __getattr__(self, name):
+        method = getattr(self._sync, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+    async def aclose(self):
+        pass
+
+
+def _id_key(entry_id):
+    ms, _, seq = entry_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+class FakeCursor:
+    """psycopg2 cursor stand-in: statements are rendered, not executed"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.bytes_sent = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def mogrify(self, template, args):
+        if isinstance(template, bytes):
+            template = template.decode()
+        return (template % tuple(adapt(v).getquoted().decode() for v in args)).encode()
+
+    def execute(self, query, args=None):
+        self.connection.bytes_sent += len(query)
+
+    def copy_expert(self, query, buf):
+        self.connection.bytes_sent += len(buf.getvalue())
+
+
+class FakePgConnection:
+    """psycopg2 connection stand-in for BatchWriter"""
+
+    encoding = 'UTF8'
+    closed = 0
+
+    def __init__(self):
+        self.bytes_sent = 0
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+class FakeSession:
+    """SQLAlchemy Session stand-in: statements are compiled for PostgreSQL, not executed"""
+
+    dialect = postgresql.dialect()
+
+    def __init__(self):
+        self.statements = 0
+
+    def execute(self, statement, params=None):
+        statement.compile(dialect=self.dialect)
+        self.statements += 1
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
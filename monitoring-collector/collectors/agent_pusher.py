@@ -0,0 +1,234 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import msgpack
+import requests
+import zstandard
+
+from collectors.exporter import PUSH_DURATION, PUSH_ROWS, PUSH_ERRORS
+
+# Куда агент отправляет пачки и чем подписывается
+INGEST_URL = os.getenv('INGEST_URL', 'http://backend:8000/api/ingest')
+INGEST_TOKEN = os.getenv('INGEST_TOKEN', '')
+PUSH_FLUSH_INTERVAL = float(os.getenv('PUSH_FLUSH_INTERVAL', '10'))
+PUSH_TIMEOUT = float(os.getenv('PUSH_TIMEOUT', '10'))
+# Сколько строк держим в памяти, пока API недоступен
+PUSH_MAX_BUFFERED = int(os.getenv('PUSH_MAX_BUFFERED', '100000'))
+PUSH_ZSTD_LEVEL = int(os.getenv('PUSH_ZSTD_LEVEL', '3'))
+# Сводки хоста для алертов и живых обновлений: сколько хранить, пока API недоступен
+PUSH_MAX_SAMPLES = int(os.getenv('PUSH_MAX_SAMPLES', '360'))
+
+# Код ext-типа msgpack для datetime (ISO-строка), такой же в backend/services/ingest_service.py
+MSGPACK_DATETIME = 1
+
+
+def pack_default(value):
+    if isinstance(value, datetime):
+        return msgpack.ExtType(MSGPACK_DATETIME, value.isoformat().encode())
+    raise TypeError(f"Cannot pack {type(value).__name__}")
+
+
+def encode_batch(hostname, tables, samples=()):
+    """msgpack + zstd body of one push: {hostname, tables: {table: {columns, rows}}, samples}"""
+    payload = {
+        'hostname': hostname,
+        'sent_at': datetime.utcnow(),
+        'tables': {
+            table: {'columns': list(columns), 'rows': rows}
+            for table, (columns, rows) in tables.items()
+        }
+    }
+    if samples:
+        # backend публикует их в поток host_metrics, как system_collector в режиме db
+        payload['samples'] = [{'timestamp': ts, 'metrics': metrics} for ts, metrics in samples]
+    packed = msgpack.packb(payload, default=pack_default, use_bin_type=True)
+    return zstandard.ZstdCompressor(level=PUSH_ZSTD_LEVEL).compress(packed)
+
+
+class AgentPusher:
+    """Buffers rows like BatchWriter but sends them to the backend ingest API.
+
+    All tables collected during flush_interval go out in one compressed
+    request; host_id is assigned by the backend from the hostname, so the
+    agent needs neither a database connection nor its own host id. Host
+    summaries given to add_sample() travel in the same request. add() never
+    waits for the network: requests are encoded and sent outside the buffer
+    lock.
+    """
+
+    def __init__(self, hostname, url=INGEST_URL, token=INGEST_TOKEN, flush_interval=PUSH_FLUSH_INTERVAL,
+                 max_buffered=PUSH_MAX_BUFFERED, timeout=PUSH_TIMEOUT):
+        self.hostname = hostname
+        self.url = url
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.timeout = timeout
+
+        self._session = requests.Session()
+        self._session.headers.update({
+            'Content-Type': 'application/msgpack',
+            'Content-Encoding': 'zstd',
+        })
+        if token:
+            self._session.headers['Authorization'] = f'Bearer {token}'
+
+        self._lock = threading.Lock()
+        # {table: (columns, [row list])}
+        self._buffers = {}
+        # Пачки со старым набором колонок, ждущие отправки: [(table, columns, rows)]
+        self._pending = []
+        # Сводки хоста: [(timestamp, {metric: value})]
+        self._samples = []
+        # Отправки идут по одной, чтобы пачки одной таблицы не обгоняли друг друга
+        self._send_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start background thread that pushes buffers by time"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._push_loop, name="agent-pusher", daemon=True)
+            self._thread.start()
+
+    def add(self, table, data):
+        """Buffer one row (dict) or several rows (list of dicts) for table"""
+        rows = data if isinstance(data, list) else [data]
+        if not rows:
+            return
+        # host_id проставит backend
+        columns = tuple(c for c in rows[0] if c != 'host_id')
+        with self._lock:
+            buffered = self._buffers.get(table)
+            if buffered is not None and buffered[0] != columns:
+                # Набор колонок поменялся - старые строки отправит поток агента отдельным запросом
+                if buffered[1]:
+                    self._pending.append((table, buffered[0], buffered[1]))
+                    self._wake.set()
+                buffered = None
+            if buffered is None:
+                buffered = (columns, [])
+                self._buffers[table] = buffered
+            buffered[1].extend([row[c] for c in columns] for row in rows)
+
+    def add_sample(self, timestamp, summary):
+        """Buffer one host summary for the backend's live stream"""
+        with self._lock:
+            self._samples.append((timestamp, summary))
+            del self._samples[:-PUSH_MAX_SAMPLES]
+
+    def flush(self):
+        """Push everything buffered, returns True on success"""
+        with self._send_lock:
+            with self._lock:
+                batches = self._pending + [(table, columns, rows) for table, (columns, rows) in self._buffers.items()]
+                samples = self._samples
+                self._pending = []
+                self._buffers = {}
+                self._samples = []
+            ok = True
+            bodies = self._group(batches)
+            if samples and not bodies:
+                bodies = [{}]
+            for number, tables in enumerate(bodies):
+                # Сводки едут с первым запросом
+                sent = self._send(tables, samples if number == 0 else ())
+                if sent is None:
+                    # API недоступен - возвращаем эту и все следующие пачки
+                    self._restore(bodies[number:], samples if number == 0 else ())
+                    return False
+                ok = ok and sent
+            return ok
+
+    def close(self):
+        """Stop the push thread and send what is left"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=self.timeout + 1)
+        self.flush()
+
+    def _push_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if not self._stop.is_set():
+                self.flush()
+
+    @staticmethod
+    def _group(batches):
+        """Split batches into request bodies {table: (columns, rows)}, one column set per table and body"""
+        bodies = []
+        for table, columns, rows in batches:
+            if not rows:
+                continue
+            for tables in bodies:
+                if table not in tables:
+                    tables[table] = (columns, list(rows))
+                    break
+                if tables[table][0] == columns:
+                    tables[table][1].extend(rows)
+                    break
+            else:
+                bodies.append({table: (columns, list(rows))})
+        return bodies
+
+    def _send(self, tables, samples=()):
+        """POST one body: True if accepted, False if rejected for good, None to retry later"""
+        total = sum(len(rows) for _, rows in tables.values())
+        started = time.monotonic()
+        try:
+            response = self._session.post(self.url, data=encode_batch(self.hostname, tables, samples),
+                                          timeout=self.timeout)
+            PUSH_DURATION.observe(time.monotonic() - started)
+            # 4xx кроме 429 - пачка сама по себе плохая, повтор не поможет
+            if 400 <= response.status_code < 500 and response.status_code != 429:
+                PUSH_ERRORS.inc()
+                print(f"❌ Ingest rejected {total} rows: {response.status_code} {response.text[:200]}")
+                return False
+            response.raise_for_status()
+            PUSH_ROWS.observe(total)
+            return True
+        except requests.RequestException as e:
+            PUSH_ERRORS.inc()
+            print(f"Error pushing {total} rows to {self.url}: {e}")
+            return None
+
+    def _restore(self, bodies, samples=()):
+        """Put unsent rows back in front of rows buffered meanwhile, keeping the newest max_buffered rows"""
+        with self._lock:
+            self._samples = (list(samples) + self._samples)[-PUSH_MAX_SAMPLES:]
+            restored = []
+            for tables in bodies:
+                for table, (columns, rows) in tables.items():
+                    buffered = self._buffers.get(table)
+                    if buffered is not None and buffered[0] == columns:
+                        self._buffers[table] = (columns, rows + buffered[1])
+                    else:
+                        restored.append((table, columns, rows))
+            self._pending = restored + self._pending
+
+            total = sum(len(rows) for _, _, rows in self._pending) + \
+                sum(len(rows) for _, rows in self._buffers.values())
+            excess = total - self.max_buffered
+            if excess <= 0:
+                return
+            print(f"⚠️ Dropped {excess} rows, push buffer is full")
+            # Выбрасываем самые старые: сначала отложенные пачки, потом начало буферов
+            while excess > 0 and self._pending:
+                table, columns, rows = self._pending[0]
+                if len(rows) <= excess:
+                    excess -= len(rows)
+                    self._pending.pop(0)
+                else:
+                    self._pending[0] = (table, columns, rows[excess:])
+                    excess = 0
+            for table, (columns, rows) in list(self._buffers.items()):
+                if excess <= 0:
+                    break
+                dropped = min(excess, len(rows))
+                self._buffers[table] = (columns, rows[dropped:])
+                excess -= dropped
+
@@ -0,0 +1,153 @@
+import os
+import re
+import time
+
+# Корень cgroup v2 хоста (под префиксом ProcReader, то есть /host/sys/fs/cgroup)
+CGROUP_ROOT = os.getenv('CGROUP_ROOT', '/sys/fs/cgroup')
+# Как часто заново ищем каталоги контейнеров (сек): новый контейнер попадает в сэмплы не позже
+CGROUP_RESCAN_INTERVAL = float(os.getenv('CGROUP_RESCAN_INTERVAL', '30'))
+# Глубина поиска: kubepods.slice/kubepods-burstable.slice/<pod>.slice/<container>.scope
+CGROUP_SCAN_DEPTH = int(os.getenv('CGROUP_SCAN_DEPTH', '5'))
+
+# Каталоги контейнеров: docker-<id>.scope (systemd), docker/<id> (cgroupfs),
+# cri-containerd-<id>.scope, crio-<id>.scope, libpod-<id>.scope
+CONTAINER_DIR_RE = re.compile(r'^(?:docker-|cri-containerd-|crio-|libpod-)?([0-9a-f]{64})(?:\.scope)?$')
+
+# Счётчики, по которым считаются скорости: {имя в результате: (файл, ключ)}
+_CPU_KEYS = {'cpu_usage_usec': b'usage_usec', 'cpu_throttled_usec': b'throttled_usec'}
+_MEMORY_KEYS = {'memory_anon_bytes': b'anon', 'memory_file_bytes': b'file', 'memory_inactive_file_bytes': b'inactive_file'}
+_IO_KEYS = {b'rbytes': 'io_read_bytes', b'wbytes': 'io_write_bytes', b'rios': 'io_read_ops', b'wios': 'io_write_ops'}
+
+
+def parse_flat_keyed(data):
+    """Parse 'key value' lines of cpu.stat / memory.stat into {key (bytes): int}"""
+    values = {}
+    for line in data.split(b'\n'):
+        key, _, value = line.partition(b' ')
+        if value:
+            values[key] = int(value)
+    return values
+
+
+def parse_io_stat(data):
+    """Sum io.stat counters ('8:0 rbytes=1 wbytes=2 ...') over all devices"""
+    totals = dict.fromkeys(_IO_KEYS.values(), 0)
+    for line in data.split(b'\n'):
+        for field in line.split(b' ')[1:]:
+            key, _, value = field.partition(b'=')
+            name = _IO_KEYS.get(key)
+            if name is not None:
+                totals[name] += int(value)
+    return totals
+
+
+def parse_memory_max(data):
+    value = data.strip()
+    return None if value == b'max' else int(value)
+
+
+class CgroupReader:
+    """Reads per-container resource counters straight from the host cgroup v2 tree.
+
+    Container directories are found by walking the tree at most every
+    rescan_interval seconds; every sample then reads cpu.stat,
+    memory.current, memory.stat and io.stat of each container through the
+    ProcReader descriptor cache, so a container costs four preads.
+    """
+
+    def __init__(self, reader, root=CGROUP_ROOT, rescan_interval=CGROUP_RESCAN_INTERVAL,
+                 scan_depth=CGROUP_SCAN_DEPTH):
+        self.reader = reader
+        self.root = root
+        self.rescan_interval = rescan_interval
+        self.scan_depth = scan_depth
+        # {id контейнера (12 символов): путь cgroup относительно префикса хоста}
+        self.paths = {}
+        # memory.max меняется редко - читаем при поиске, а не в каждом сэмпле
+        self.limits = {}
+        self._next_scan = 0.0
+        self._warned = False
+
+    def available(self):
+        return os.path.exists(f"{self.reader.host_prefix}{self.root}/cgroup.controllers")
+
+    def discover(self):
+        """Walk the cgroup tree and refresh {container id: cgroup path}"""
+        if not self.available():
+            if not self._warned:
+                print(f"⚠️ No cgroup v2 hierarchy at {self.reader.host_prefix}{self.root}, container stats are off")
+                self._warned = True
+            self.paths = {}
+            return self.paths
+
+        paths = {}
+        pending = [(self.root, 0)]
+        while pending:
+            path, depth = pending.pop()
+            try:
+                entries = os.scandir(f"{self.reader.host_prefix}{path}")
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False):
+                        continue
+                    match = CONTAINER_DIR_RE.match(entry.name)
+                    if match:
+                        # Вложенные cgroup контейнера уже учтены в его счётчиках
+                        paths[match.group(1)[:12]] = f"{path}/{entry.name}"
+                    elif depth + 1 < self.scan_depth:
+                        pending.append((f"{path}/{entry.name}", depth + 1))
+
+        for container_id in self.paths.keys() - paths.keys():
+            self._forget(container_id)
+        limits = {}
+        for container_id, path in paths.items():
+            try:
+                limits[container_id] = parse_memory_max(self.reader.read_bytes(f"{path}/memory.max", cache=False))
+            except (OSError, ValueError):
+                limits[container_id] = None
+        self.paths, self.limits = paths, limits
+        return paths
+
+    def _forget(self, container_id):
+        path = self.paths.pop(container_id, None)
+        self.limits.pop(container_id, None)
+        if path is not None:
+            self.reader.forget(path + '/')
+
+    def read_container(self, path):
+        """Raw counters and gauges of one container cgroup"""
+        read = self.reader.read_bytes
+        cpu = parse_flat_keyed(read(f"{path}/cpu.stat"))
+        memory = parse_flat_keyed(read(f"{path}/memory.stat"))
+        values = {name: cpu.get(key, 0) for name, key in _CPU_KEYS.items()}
+        values.update((name, memory.get(key, 0)) for name, key in _MEMORY_KEYS.items())
+        values['memory_bytes'] = int(read(f"{path}/memory.current"))
+        values.update(parse_io_stat(read(f"{path}/io.stat")))
+        return values
+
+    def read_all(self):
+        """{container id: counters} of every known container, rescanning the tree when due"""
+        now = time.monotonic()
+        if now >= self._next_scan:
+            self.discover()
+            self._next_scan = now + self.rescan_interval
+
+        stats = {}
+        gone = []
+        for container_id, path in self.paths.items():
+            try:
+                values = self.read_container(path)
+            except FileNotFoundError:
+                # Контейнер удалён между поисками
+                gone.append(container_id)
+                continue
+            except (OSError, ValueError) as e:
+                print(f"Error reading cgroup {path}: {e}")
+                continue
+            values['memory_limit_bytes'] = self.limits.get(container_id)
+            stats[container_id] = values
+        for container_id in gone:
+            self._forget(container_id)
+        return stats
@@ -0,0 +1,401 @@
+import io
+import os
+import time
+import threading
+from datetime import datetime, date
+
+import psycopg2
+from psycopg2 import sql, pool
+from psycopg2.extras import execute_values
+
+from collectors.exporter import (
+    DB_FLUSH_DURATION, DB_FLUSH_ROWS, DB_FLUSH_ERRORS, SPOOL_BYTES, SPOOLED_ROWS, REPLAYED_ROWS
+)
+
+# Размер пачки и максимальная задержка строки в буфере
+WRITER_BATCH_SIZE = int(os.getenv('WRITER_BATCH_SIZE', '500'))
+WRITER_FLUSH_INTERVAL = float(os.getenv('WRITER_FLUSH_INTERVAL', '5'))
+# COPY FROM STDIN быстрее execute_values на больших пачках
+WRITER_USE_COPY = os.getenv('WRITER_USE_COPY', 'false').lower() in ('1', 'true', 'yes')
+# Сколько строк держим в памяти, пока база недоступна
+WRITER_MAX_BUFFERED = int(os.getenv('WRITER_MAX_BUFFERED', '100000'))
+WRITER_POOL_SIZE = int(os.getenv('WRITER_POOL_SIZE', '2'))
+# Лежащий PostgreSQL не должен держать поток записи дольше этого (TCP-таймаут - минуты)
+WRITER_CONNECT_TIMEOUT = int(os.getenv('WRITER_CONNECT_TIMEOUT', '5'))
+WRITER_STATEMENT_TIMEOUT_MS = int(os.getenv('WRITER_STATEMENT_TIMEOUT_MS', '60000'))
+# Досылка спула: строк в одной транзакции и пауза между попытками, пока база недоступна
+SPOOL_REPLAY_ROWS = int(os.getenv('SPOOL_REPLAY_ROWS', '50000'))
+SPOOL_RETRY_INTERVAL = float(os.getenv('SPOOL_RETRY_INTERVAL', '10'))
+
+# Ошибки, после которых база считается недоступной (а не пачка - плохой)
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, pool.PoolError)
+
+
+def _copy_value(value):
+    """Format a value for COPY ... FROM STDIN text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    text = str(value)
+    return (text.replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class BatchWriter:
+    """Buffers rows per table and writes them in batches over pooled connections.
+
+    Rows are flushed by a background thread when a buffer reaches batch_size
+    or when its oldest row is older than flush_interval seconds; add() never
+    waits for the database. With a spool, batches
+    that cannot reach the database are appended to it and a background
+    thread replays them in large COPY transactions once the database is back.
+    """
+
+    def __init__(self, db_config, batch_size=WRITER_BATCH_SIZE, flush_interval=WRITER_FLUSH_INTERVAL,
+                 use_copy=WRITER_USE_COPY, max_buffered=WRITER_MAX_BUFFERED, pool_size=WRITER_POOL_SIZE,
+                 upserts=None, spool=None):
+        self.db_config = db_config
+        # {table: (key columns, "ON CONFLICT ...")} - такие таблицы пишутся INSERT ... ON CONFLICT, не COPY
+        self.upserts = upserts or {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.use_copy = use_copy
+        self.max_buffered = max_buffered
+        self.pool_size = pool_size
+        self.spool = spool
+        # База недоступна: новые пачки сразу идут в спул, пока досылка его не опустошит
+        self._db_down = False
+        if spool is not None:
+            SPOOL_BYTES.set_function(lambda: spool.size)
+
+        self._pool = None
+        # Защищает только буферы: запись в базу и спул идёт без него
+        self._lock = threading.Lock()
+        # {(table, columns): {'rows': [tuple], 'since': monotonic}}
+        self._buffers = {}
+        # Буфер дорос до batch_size - будим поток записи, не дожидаясь интервала
+        self._wake = threading.Event()
+        # Готовые тексты запросов: {(table, columns, mode): str}
+        self._statements = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._drain_thread = None
+
+    # --- пул соединений ---
+
+    def _get_pool(self):
+        if self._pool is None:
+            config = {
+                'connect_timeout': WRITER_CONNECT_TIMEOUT,
+                'options': f'-c statement_timeout={WRITER_STATEMENT_TIMEOUT_MS}',
+                **self.db_config,
+            }
+            self._pool = pool.ThreadedConnectionPool(1, self.pool_size, **config)
+        return self._pool
+
+    def get_connection(self):
+        """Borrow a connection from the pool"""
+        return self._get_pool().getconn()
+
+    def put_connection(self, conn, broken=False):
+        """Return a connection to the pool, closing it if it is broken"""
+        if self._pool is None:
+            return
+        try:
+            self._pool.putconn(conn, close=broken or conn.closed != 0)
+        except pool.PoolError:
+            pass
+
+    # --- буферизация ---
+
+    def start(self):
+        """Start background thread that flushes buffers by time"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, name="db-writer", daemon=True)
+            self._thread.start()
+        if self.spool is not None and self._drain_thread is None:
+            self._drain_thread = threading.Thread(target=self._drain_loop, name="spool-drainer", daemon=True)
+            self._drain_thread.start()
+
+    def add(self, table, data):
+        """Buffer one row (dict) or several rows (list of dicts) for table"""
+        rows = data if isinstance(data, list) else [data]
+        if not rows:
+            return
+        columns = tuple(rows[0].keys())
+        with self._lock:
+            # Отдельный буфер на набор колонок: смена колонок не требует сброса
+            buffer = self._buffers.get((table, columns))
+            if buffer is None:
+                buffer = self._buffers[(table, columns)] = {'rows': [], 'since': time.monotonic()}
+            if not buffer['rows']:
+                buffer['since'] = time.monotonic()
+            buffer['rows'].extend(tuple(row[c] for c in columns) for row in rows)
+            self._trim(table, buffer)
+            full = len(buffer['rows']) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def _trim(self, table, buffer):
+        """Keep at most max_buffered rows while the database does not take them"""
+        extra = len(buffer['rows']) - self.max_buffered
+        if extra > 0:
+            del buffer['rows'][:extra]
+            print(f"⚠️ Dropped {extra} rows for {table}, buffer is full")
+
+    def _take(self, keys):
+        """Swap out the rows of the given buffers, returns [(table, columns, rows)]"""
+        batches = []
+        with self._lock:
+            for key in keys:
+                buffer = self._buffers.get(key)
+                if buffer and buffer['rows']:
+                    batches.append(key + (buffer['rows'],))
+                    buffer['rows'] = []
+        return batches
+
+    def _put_back(self, table, columns, rows):
+        """Return rows that could not be written in front of the newer ones"""
+        with self._lock:
+            buffer = self._buffers.setdefault((table, columns), {'rows': [], 'since': time.monotonic()})
+            buffer['rows'] = rows + buffer['rows']
+            buffer['since'] = time.monotonic()
+            self._trim(table, buffer)
+
+    def flush(self, table=None):
+        """Write buffered rows of one table or of all tables, returns True on success"""
+        with self._lock:
+            keys = [key for key in self._buffers if table is None or key[0] == table]
+        ok = True
+        for name, columns, rows in self._take(keys):
+            ok = self._write_batch(name, columns, rows) and ok
+        return ok
+
+    def close(self):
+        """Stop the flush thread, write what is left and close the pool"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=self.flush_interval + WRITER_CONNECT_TIMEOUT + 1)
+        if self._drain_thread:
+            self._drain_thread.join(timeout=SPOOL_RETRY_INTERVAL + 1)
+        self.flush()
+        if self.spool is not None:
+            self.spool.close()
+        if self._pool:
+            self._pool.closeall()
+            self._pool = None
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(min(self.flush_interval, 1.0))
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            now = time.monotonic()
+            with self._lock:
+                due = [
+                    key for key, buffer in self._buffers.items()
+                    if buffer['rows'] and (len(buffer['rows']) >= self.batch_size
+                                           or now - buffer['since'] >= self.flush_interval)
+                ]
+            for table, columns, rows in self._take(due):
+                self._write_batch(table, columns, rows)
+
+    def _write_batch(self, table, columns, rows):
+        """Write (or spool) one batch outside the buffer lock, putting it back on failure"""
+        if self._db_down and self._spool_rows(table, columns, rows):
+            return True
+        started = time.monotonic()
+        try:
+            self.write_rows(table, columns, rows)
+            DB_FLUSH_DURATION.labels(table).observe(time.monotonic() - started)
+            DB_FLUSH_ROWS.labels(table).observe(len(rows))
+            return True
+        except Exception as e:
+            DB_FLUSH_ERRORS.labels(table).inc()
+            if self.spool is not None and isinstance(e, CONNECTION_ERRORS):
+                print(f"⚠️ Database is unavailable ({e}), spooling rows to {self.spool.directory}")
+                self._db_down = True
+                if self._spool_rows(table, columns, rows):
+                    return True
+            print(f"Error saving {len(rows)} rows to {table}: {e}")
+            # Оставляем строки до следующей попытки, но не больше max_buffered
+            self._put_back(table, columns, rows)
+            return False
+
+    # --- спул ---
+
+    def _spool_rows(self, table, columns, rows):
+        if self.spool is None:
+            return False
+        try:
+            self.spool.append(table, columns, rows)
+            SPOOLED_ROWS.labels(table).inc(len(rows))
+            return True
+        except Exception as e:
+            # Диск переполнен или недоступен - строки остаются в памяти
+            print(f"Error spooling {len(rows)} rows of {table}: {e}")
+            return False
+
+    def _drain_loop(self):
+        delay = 1.0
+        while not self._stop.wait(delay):
+            delay = 1.0
+            try:
+                self.spool.sync()
+                if not self.spool.has_data():
+                    self._db_down = False
+                    continue
+                replayed = self.drain_spool()
+                if replayed:
+                    print(f"✅ Replayed {replayed} spooled rows")
+            except CONNECTION_ERRORS as e:
+                print(f"Spool replay postponed, database is unavailable: {e}")
+                delay = SPOOL_RETRY_INTERVAL
+            except Exception as e:
+                print(f"Error replaying spool: {e}")
+                delay = SPOOL_RETRY_INTERVAL
+
+    def drain_spool(self):
+        """Replay spooled batches, SPOOL_REPLAY_ROWS rows per transaction; returns rows written"""
+        if not self.spool.sealed_segments():
+            # Всё старое дослано - забираем то, что накопилось в активном сегменте
+            self.spool.seal()
+        written = 0
+        position, position_offset = self.spool.read_position()
+        for name in self.spool.sealed_segments():
+            groups = {}
+            count = 0
+            for end, table, columns, rows in self.spool.read(name, position_offset if name == position else 0):
+                # Соседние пачки одной таблицы склеиваются в одну большую
+                groups.setdefault((table, columns), []).extend(rows)
+                count += len(rows)
+                if count >= SPOOL_REPLAY_ROWS:
+                    self._replay(groups)
+                    self.spool.save_position(name, end)
+                    written += count
+                    groups, count = {}, 0
+                    if self._stop.is_set():
+                        return written
+            if groups:
+                self._replay(groups)
+                written += count
+            self.spool.remove(name)
+        return written
+
+    def _replay(self, groups):
+        batches = [(table, columns, rows) for (table, columns), rows in groups.items()]
+        try:
+            self.write_batches(batches, use_copy=True, rewind_rollups=True)
+        except CONNECTION_ERRORS:
+            raise
+        except Exception as e:
+            # Одна таблица может не принимать строки (например, партиция уже удалена) - не держим остальные
+            print(f"⚠️ Spooled batch failed ({e}), replaying tables one by one")
+            for batch in batches:
+                try:
+                    self.write_batches([batch], use_copy=True, rewind_rollups=True)
+                except CONNECTION_ERRORS:
+                    raise
+                except Exception as e:
+                    print(f"❌ Dropped {len(batch[2])} spooled rows of {batch[0]}: {e}")
+                    continue
+        REPLAYED_ROWS.inc(sum(len(rows) for _, _, rows in batches))
+
+    # --- запись ---
+
+    def _statement(self, conn, table, columns, mode):
+        key = (table, columns, mode)
+        statement = self._statements.get(key)
+        if statement is None:
+            if mode == 'copy':
+                query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+                    sql.Identifier(table),
+                    sql.SQL(', ').join(map(sql.Identifier, columns))
+                )
+            else:
+                query = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+                    sql.Identifier(table),
+                    sql.SQL(', ').join(map(sql.Identifier, columns))
+                )
+                if table in self.upserts:
+                    query = sql.SQL(' ').join([query, sql.SQL(self.upserts[table][1])])
+            statement = query.as_string(conn)
+            self._statements[key] = statement
+        return statement
+
+    def write_rows(self, table, columns, rows):
+        """Write rows (tuples in columns order) in one transaction"""
+        self.write_batches([(table, columns, rows)])
+
+    def write_batches(self, batches, use_copy=None, rewind_rollups=False):
+        """Write several (table, columns, rows) batches in one transaction.
+
+        With rewind_rollups the rollup watermarks of the written tables are
+        moved back to the hour of their oldest row in the same transaction,
+        so the backend re-aggregates buckets that missed these rows.
+        """
+        use_copy = self.use_copy if use_copy is None else use_copy
+        conn = self.get_connection()
+        broken = False
+        try:
+            with conn.cursor() as cur:
+                for table, columns, rows in batches:
+                    self._write(conn, cur, table, columns, rows, use_copy)
+                if rewind_rollups:
+                    self._rewind_rollups(cur, batches)
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.put_connection(conn, broken)
+
+    @staticmethod
+    def _rewind_rollups(cur, batches):
+        oldest = {}
+        for table, columns, rows in batches:
+            if 'timestamp' not in columns:
+                continue
+            i = columns.index('timestamp')
+            stamps = [row[i] for row in rows if row[i] is not None]
+            if stamps:
+                ts = min(stamps)
+                oldest[table] = min(oldest.get(table, ts), ts)
+        if not oldest:
+            return
+        cur.execute("SELECT to_regclass('rollup_watermarks')")
+        if cur.fetchone()[0] is None:
+            return
+        # Час - самое крупное разрешение: откат всех разрешений источника на начало часа
+        # пересчитывает каждый затронутый бакет целиком
+        for table, ts in oldest.items():
+            cur.execute(
+                "UPDATE rollup_watermarks SET watermark = LEAST(watermark, date_trunc('hour', %s::timestamp)) "
+                "WHERE source = %s",
+                (ts, table)
+            )
+
+    def _write(self, conn, cur, table, columns, rows, use_copy):
+        upsert = self.upserts.get(table)
+        if upsert:
+            # ON CONFLICT DO UPDATE не может затронуть одну строку дважды за запрос - оставляем последнюю
+            key = [columns.index(c) for c in upsert[0]]
+            rows = list({tuple(row[i] for i in key): row for row in rows}.values())
+        if use_copy and not upsert:
+            buf = io.StringIO()
+            for row in rows:
+                buf.write('\t'.join(_copy_value(v) for v in row))
+                buf.write('\n')
+            buf.seek(0)
+            cur.copy_expert(self._statement(conn, table, columns, 'copy'), buf)
+        else:
+            execute_values(cur, self._statement(conn, table, columns, 'insert'), rows,
+                           page_size=self.batch_size)
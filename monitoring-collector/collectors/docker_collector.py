@@ -3,42 +3,296 @@ import time
 import redis
 import json
 import os
+import queue
+import socket
+import threading
 import requests
+from collectors.exporter import REDIS_DURATION
 
-def main():
-    client = docker.from_env()
-    print("🚀 Docker Monitor started...")
-    
+# events - подписка на поток событий Docker, poll - старый полный опрос
+DOCKER_COLLECTOR_MODE = os.getenv('DOCKER_COLLECTOR_MODE', 'events')
+POLL_INTERVAL = int(os.getenv('DOCKER_POLL_INTERVAL', '30'))
+# Как часто в режиме events сверяем кэш с полным списком контейнеров
+RECONCILE_INTERVAL = int(os.getenv('DOCKER_RECONCILE_INTERVAL', '300'))
+
+# Ключи Redis: hash {id контейнера: json}, счётчик версий, поток изменений, id контейнеров каждого хоста
+CONTAINERS_HASH = "containers"
+CONTAINERS_VERSION = "containers_version"
+CONTAINERS_STREAM = "containers_events"
+CONTAINERS_HOST_SET = "containers:host:{host}"
+# Сколько последних изменений хранится в потоке
+CONTAINERS_STREAM_MAXLEN = int(os.getenv('CONTAINERS_STREAM_MAXLEN', '100000'))
+
+# Атомарно применяет пачку изменений: одна версия на пачку, по записи в поток на каждое изменение
+PUBLISH_CHANGES_LUA = """
+local version = redis.call('INCR', KEYS[2])
+for i = 2, #ARGV, 3 do
+    local op, id, data = ARGV[i], ARGV[i + 1], ARGV[i + 2]
+    if op == 'del' then
+        redis.call('HDEL', KEYS[1], id)
+        redis.call('SREM', KEYS[4], id)
+    else
+        data = string.sub(data, 1, -2) .. ',"version":' .. version .. '}'
+        redis.call('HSET', KEYS[1], id, data)
+        redis.call('SADD', KEYS[4], id)
+    end
+    redis.call('XADD', KEYS[3], 'MAXLEN', '~', ARGV[1], '*', 'op', op, 'id', id, 'version', version, 'data', data)
+end
+return version
+"""
+
+# Статус контейнера после события; kill - только сигнал (SIGHUP и т.п. не останавливают), выход придёт как die
+EVENT_STATUS = {
+    'create': 'created',
+    'start': 'running',
+    'restart': 'running',
+    'unpause': 'running',
+    'pause': 'paused',
+    'die': 'exited',
+    'stop': 'exited',
+}
+
+
+def get_docker_hostname():
+    """Hostname of the Docker host, the container's own hostname is its id"""
+    try:
+        with open("/host/etc/hostname", 'r') as f:
+            return f.read().strip() or socket.gethostname()
+    except OSError:
+        return socket.gethostname()
+
+
+def get_redis():
     redis_password = os.getenv('REDIS_PASSWORD', 'your_secure_redis_password_123')
-    r = redis.Redis(
+    return redis.Redis(
         host='redis',
-        port=6379, 
+        port=6379,
         password=redis_password,
         decode_responses=True
     )
-    
+
+
+class ContainerCache:
+    """In-memory view of containers on this host, kept current by Docker events"""
+
+    def __init__(self, client, host):
+        self.api = client.api
+        self.host = host
+        self.containers = {}
+        # Изменения, ещё не отправленные в Redis: [(op, id, data)]
+        self.changes = []
+        # {image_id: первый тег}
+        self.image_tags = {}
+
+    def refresh_images(self):
+        """One /images/json call instead of container.image.tags per container"""
+        self.image_tags = {
+            image['Id']: image['RepoTags'][0]
+            for image in self.api.images()
+            if image.get('RepoTags') and image['RepoTags'][0] != '<none>:<none>'
+        }
+
+    def image_tag(self, image_id, image_ref=None):
+        if image_id not in self.image_tags and image_id:
+            self.refresh_images()
+        tag = self.image_tags.get(image_id)
+        if tag:
+            return tag
+        # Образ без тега: в событиях и списке Docker отдаёт ссылку, с которой контейнер создан
+        if image_ref and not image_ref.startswith('sha256:'):
+            return image_ref
+        return "unknown"
+
+    def reconcile(self):
+        """Rebuild the cache from one container list call, returns True if anything changed"""
+        self.refresh_images()
+        containers = {}
+        for raw in self.api.containers(all=True):
+            container_id = raw['Id']
+            containers[container_id] = {
+                "name": raw['Names'][0].lstrip('/') if raw.get('Names') else container_id[:12],
+                "status": raw.get('State', 'unknown'),
+                "image": self.image_tag(raw.get('ImageID'), raw.get('Image')),
+                "id": container_id[:12],
+                "host": self.host
+            }
+        changed = False
+        for container_id in self.containers.keys() - containers.keys():
+            self._record('del', container_id)
+            changed = True
+        for container_id, container in containers.items():
+            if self.containers.get(container_id) != container:
+                self._record('set', container_id, container)
+                changed = True
+        self.containers = containers
+        return changed
+
+    def _record(self, op, container_id, container=None):
+        self.changes.append((op, container_id[:12], json.dumps(container) if container else ''))
+
+    def apply_event(self, event):
+        """Apply one container event, returns True if the cache changed"""
+        action = event.get('Action') or event.get('status') or ''
+        # health_status: healthy и exec_start: ... приходят с суффиксом через ':'
+        action = action.split(':')[0]
+        actor = event.get('Actor', {})
+        container_id = actor.get('ID') or event.get('id')
+        attributes = actor.get('Attributes', {})
+        if not container_id:
+            return False
+
+        if action == 'destroy':
+            if self.containers.pop(container_id, None) is None:
+                return False
+            self._record('del', container_id)
+            return True
+
+        current = self.containers.get(container_id)
+        if action == 'rename' and current:
+            current['name'] = attributes.get('name', current['name'])
+            self._record('set', container_id, current)
+            return True
+
+        status = EVENT_STATUS.get(action)
+        if status is None:
+            return False
+        if current is None:
+            current = {
+                "name": attributes.get('name', container_id[:12]),
+                "status": status,
+                "image": self.image_tag(None, attributes.get('image')),
+                "id": container_id[:12],
+                "host": self.host
+            }
+            self.containers[container_id] = current
+        elif current['status'] == status:
+            return False
+        else:
+            current['status'] = status
+        # Каждый переход попадает в поток, даже если за пачку статус успел вернуться обратно
+        self._record('set', container_id, current)
+        return True
+
+
+class ContainerPublisher:
+    """Writes container changes to the Redis hash and change stream"""
+
+    def __init__(self, r, host):
+        self.r = r
+        self.host_set = CONTAINERS_HOST_SET.format(host=host)
+        self._script = r.register_script(PUBLISH_CHANGES_LUA)
+
+    def drop_stale(self, cache):
+        """Queue deletes for containers this host published earlier but no longer has"""
+        known = {cid[:12] for cid in cache.containers}
+        for container_id in self.r.smembers(self.host_set) - known:
+            cache.changes.append(('del', container_id, ''))
+
+    def publish(self, cache):
+        """Send pending changes, returns the new version or None if there was nothing to send"""
+        if not cache.changes:
+            return None
+        args = [CONTAINERS_STREAM_MAXLEN]
+        for op, container_id, data in cache.changes:
+            args.extend((op, container_id, data))
+        with REDIS_DURATION.labels('publish_containers').time():
+            version = self._script(
+                keys=[CONTAINERS_HASH, CONTAINERS_VERSION, CONTAINERS_STREAM, self.host_set],
+                args=args
+            )
+        cache.changes = []
+        self.r.set("last_update", time.time())
+        return version
+
+
+def _read_events(client, events_queue, since):
+    """Forward Docker container events to the queue, reconnecting from the last seen event"""
     while True:
         try:
-            containers = client.containers.list(all=True)
-            containers_data = []
-            
-            for container in containers:
-                containers_data.append({
-                    "name": container.name,
-                    "status": container.status,
-                    "image": container.image.tags[0] if container.image.tags else "unknown",
-                    "id": container.short_id
-                })
-            
-            # Сохраняем в Redis 
-            r.set("containers_status", json.dumps(containers_data))
-            r.set("last_update", time.time())
-            
-            print(f"📊 Updated {len(containers_data)} containers")
-            time.sleep(30)
+            for event in client.events(decode=True, filters={'type': 'container'}, since=since):
+                since = event.get('time', since)
+                events_queue.put(event)
+        except Exception as e:
+            print(f"❌ Docker events stream error: {e}")
+        # Поток оборвался - после переподключения нужна сверка
+        events_queue.put(None)
+        time.sleep(5)
+
+
+def watch_events(client, publisher, host):
+    cache = ContainerCache(client, host)
+    events_queue = queue.Queue()
+    # Подписываемся до первой сверки, чтобы не потерять события между ними
+    threading.Thread(
+        target=_read_events, args=(client, events_queue, int(time.time())), name="docker-events", daemon=True
+    ).start()
+    print("📡 Watching Docker events")
+
+    # Первая сверка выполнится сразу в цикле
+    next_reconcile = 0
+    while True:
+        try:
+            timeout = max(next_reconcile - time.monotonic(), 0)
+            try:
+                event = events_queue.get(timeout=timeout)
+            except queue.Empty:
+                event = None
+
+            if event is not None:
+                cache.apply_event(event)
+                # Забираем всё, что накопилось, и отправляем в Redis одним вызовом
+                while True:
+                    try:
+                        event = events_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if event is None:
+                        next_reconcile = 0
+                        continue
+                    cache.apply_event(event)
+            else:
+                next_reconcile = 0
+
+            if next_reconcile <= time.monotonic():
+                cache.reconcile()
+                publisher.drop_stale(cache)
+                next_reconcile = time.monotonic() + RECONCILE_INTERVAL
+
+            version = publisher.publish(cache)
+            if version is not None:
+                print(f"📊 Updated {len(cache.containers)} containers (version {version})")
         except Exception as e:
             print(f"❌ Error: {e}")
             time.sleep(5)
+            next_reconcile = 0
+
+
+def poll(client, publisher, host):
+    cache = ContainerCache(client, host)
+    while True:
+        try:
+            cache.reconcile()
+            publisher.drop_stale(cache)
+            publisher.publish(cache)
+
+            print(f"📊 Updated {len(cache.containers)} containers")
+            time.sleep(POLL_INTERVAL)
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            time.sleep(5)
+
+
+def main():
+    client = docker.from_env()
+    print(f"🚀 Docker Monitor started ({DOCKER_COLLECTOR_MODE} mode)...")
+
+    host = get_docker_hostname()
+    publisher = ContainerPublisher(get_redis(), host)
+
+    if DOCKER_COLLECTOR_MODE == 'poll':
+        poll(client, publisher, host)
+    else:
+        watch_events(client, publisher, host)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
+
+# Порт /metrics сборщика, 0 - не поднимать
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9101'))
+# Готовый текст /metrics отдаётся из кэша, пока не устареет (сек)
+METRICS_CACHE_TTL = float(os.getenv('METRICS_CACHE_TTL', '5'))
+
+# Длительности от миллисекунд до таймаута сборщика
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROWS_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+registry = CollectorRegistry()
+
+COLLECTOR_DURATION = Histogram(
+    'collector_duration_seconds', 'Time spent in one metric collector',
+    ['collector'], buckets=DURATION_BUCKETS, registry=registry
+)
+COLLECTOR_TIMEOUTS = Counter(
+    'collector_timeouts_total', 'Collectors that did not finish within COLLECTOR_TIMEOUT',
+    ['collector'], registry=registry
+)
+SAMPLE_DURATION = Histogram(
+    'collector_sample_duration_seconds', 'Time to collect, buffer and publish one sample',
+    buckets=DURATION_BUCKETS, registry=registry
+)
+DB_FLUSH_DURATION = Histogram(
+    'collector_db_flush_duration_seconds', 'Time to write one buffered batch to PostgreSQL',
+    ['table'], buckets=DURATION_BUCKETS, registry=registry
+)
+DB_FLUSH_ROWS = Histogram(
+    'collector_db_flush_rows', 'Rows per batch written to PostgreSQL',
+    ['table'], buckets=ROWS_BUCKETS, registry=registry
+)
+DB_FLUSH_ERRORS = Counter(
+    'collector_db_flush_errors_total', 'Failed batch writes to PostgreSQL',
+    ['table'], registry=registry
+)
+PUSH_DURATION = Histogram(
+    'collector_push_duration_seconds', 'Time of one push request to the ingest API',
+    buckets=DURATION_BUCKETS, registry=registry
+)
+PUSH_ROWS = Histogram(
+    'collector_push_rows', 'Rows per push request to the ingest API',
+    buckets=ROWS_BUCKETS, registry=registry
+)
+PUSH_ERRORS = Counter(
+    'collector_push_errors_total', 'Failed or rejected push requests', registry=registry
+)
+SPOOL_BYTES = Gauge('collector_spool_bytes', 'Size of the on-disk spool', registry=registry)
+SPOOLED_ROWS = Counter(
+    'collector_spooled_rows_total', 'Rows written to the spool while PostgreSQL was unavailable',
+    ['table'], registry=registry
+)
+REPLAYED_ROWS = Counter(
+    'collector_spool_replayed_rows_total', 'Spooled rows written to PostgreSQL', registry=registry
+)
+REDIS_DURATION = Histogram(
+    'collector_redis_roundtrip_seconds', 'Redis round trips of the collector',
+    ['operation'], buckets=DURATION_BUCKETS, registry=registry
+)
+
+# Метрики сводки, у которых после ':' идёт не просто серия: {метрика: имя label}
+SUMMARY_LABELS = {'disk_use_percent': 'mountpoint'}
+
+
+class HostSummaryCollector:
+    """Exposes the latest host summary as host_<metric>{host=...} gauges"""
+
+    def __init__(self):
+        self.hostname = None
+        self.summary = {}
+
+    def update(self, hostname, summary):
+        self.hostname, self.summary = hostname, summary
+
+    def collect(self):
+        hostname, summary = self.hostname, self.summary
+        families = {}
+        for key, value in summary.items():
+            if value is None:
+                continue
+            name, _, series = key.partition(':')
+            label = SUMMARY_LABELS.get(name, 'series')
+            family = families.get(name)
+            if family is None:
+                family = families[name] = GaugeMetricFamily(
+                    f'host_{name}', f'Latest {name} of the host', labels=['host', label] if series else ['host']
+                )
+            family.add_metric([hostname, series] if series else [hostname], value)
+        return list(families.values())
+
+
+host_summary = HostSummaryCollector()
+registry.register(host_summary)
+
+
+class _Exposition:
+    """Rendered exposition text, re-rendered at most once per ttl"""
+
+    def __init__(self, ttl=METRICS_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._body = b''
+        self._expires = 0.0
+
+    def render(self):
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._expires:
+                self._body = generate_latest(registry)
+                self._expires = now + self.ttl
+            return self._body
+
+
+exposition = _Exposition()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = exposition.render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE_LATEST)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Prometheus ходит каждые 15s, не засоряем лог
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics in a background thread, returns the server or None if disabled"""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(('', port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"📈 Metrics on :{port}/metrics")
+    return server
@@ -0,0 +1,427 @@
+import os
+import resource
+import socket
+import struct
+import threading
+
+# Псевдо-файловые системы, которые df не показывает
+PSEUDO_FILESYSTEMS = {
+    'proc', 'sysfs', 'devpts', 'cgroup', 'cgroup2', 'securityfs', 'pstore',
+    'debugfs', 'tracefs', 'configfs', 'fusectl', 'mqueue', 'hugetlbfs',
+    'bpf', 'autofs', 'binfmt_misc', 'rpc_pipefs', 'nsfs', 'selinuxfs',
+    'efivarfs', 'rootfs', 'fuse.gvfsd-fuse', 'fuse.portal',
+}
+
+# Коды состояний TCP из include/net/tcp_states.h
+TCP_STATES = {
+    '01': 'ESTAB', '02': 'SYN-SENT', '03': 'SYN-RECV', '04': 'FIN-WAIT-1',
+    '05': 'FIN-WAIT-2', '06': 'TIME-WAIT', '07': 'UNCONN', '08': 'CLOSE-WAIT',
+    '09': 'LAST-ACK', '0A': 'LISTEN', '0B': 'CLOSING', '0C': 'NEW-SYN-RECV',
+}
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# Сколько дескрипторов держим открытыми, остальные файлы читаем open/pread/close
+MAX_CACHED_FDS = int(os.getenv('PROC_READER_MAX_FDS', '8192'))
+
+
+def _raise_nofile_limit(wanted):
+    """Raise RLIMIT_NOFILE soft limit towards the hard limit, return usable fd budget"""
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        target = wanted + 256
+        if hard != resource.RLIM_INFINITY:
+            target = min(target, hard)
+        if target > soft:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        return max(soft - 256, 0)
+    except (ValueError, OSError):
+        return 0
+
+
+def _decode_address(hex_address):
+    """Decode '0100007F:0035' style address from /proc/net/* into 'ip:port'"""
+    ip_hex, port_hex = hex_address.split(':')
+    port = int(port_hex, 16)
+    raw = bytes.fromhex(ip_hex)
+    if len(raw) == 4:
+        ip = socket.inet_ntop(socket.AF_INET, raw[::-1])
+        return f"{ip}:{port}"
+    # IPv6 хранится четырьмя 32-битными словами в порядке хоста
+    words = struct.unpack('<4I', raw)
+    ip = socket.inet_ntop(socket.AF_INET6, struct.pack('>4I', *words))
+    return f"[{ip}]:{port}"
+
+
+def _decode_tty(tty_nr):
+    """Decode tty_nr from /proc/<pid>/stat the way ps prints it"""
+    if tty_nr == 0:
+        return '?'
+    major = (tty_nr >> 8) & 0xfff
+    minor = (tty_nr & 0xff) | ((tty_nr >> 12) & 0xfff00)
+    if 136 <= major <= 143:
+        return f"pts/{minor + (major - 136) * 256}"
+    if major == 4:
+        return f"tty{minor}" if minor < 64 else f"ttyS{minor - 64}"
+    return '?'
+
+
+class ProcReader:
+    """Reads host /proc and mount information without forking df/ps/ss.
+
+    Descriptors of frequently read files are kept open and re-read with
+    os.pread from offset 0, so one sample costs one syscall per file instead
+    of open/read/close.
+    """
+
+    def __init__(self, host_prefix="/host"):
+        self.host_prefix = host_prefix
+        self.proc = f"{host_prefix}/proc"
+        self._fds = {}
+        # Сборщики работают в разных потоках: блокировка только на словарь, читают они параллельно
+        self._fd_lock = threading.RLock()
+        self._max_fds = min(MAX_CACHED_FDS, _raise_nofile_limit(MAX_CACHED_FDS))
+        self._users = {}
+        self._passwd_mtime = None
+        self._cmdlines = {}
+        self._socket_owners = {}
+        self._boot_time = None
+        # Сетевые таблицы хоста видны через init, /proc/net показал бы namespace контейнера
+        self.net_dir = "/proc/1/net" if os.path.isdir(f"{self.proc}/1/net") else "/proc/net"
+
+    def close(self):
+        """Close all cached descriptors"""
+        with self._fd_lock:
+            for fd in self._fds.values():
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+            self._fds.clear()
+
+    def _pread_all(self, fd):
+        chunks = []
+        offset = 0
+        while True:
+            chunk = os.pread(fd, 65536, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+        return b''.join(chunks)
+
+    def read_bytes(self, path, cache=True):
+        """Read a file under host prefix, reusing a cached descriptor when possible"""
+        with self._fd_lock:
+            cached = self._fds.get(path)
+            # Читаем через dup вне блокировки: forget()/close() из другого потока закрывают
+            # только оригинал, а dup дешевле open (нет разбора пути)
+            fd = os.dup(cached) if cached is not None else None
+        if fd is not None:
+            try:
+                return self._pread_all(fd)
+            except OSError:
+                # Процесс завершился или pid переиспользован - открываем заново
+                with self._fd_lock:
+                    if self._fds.get(path) == cached:
+                        self._drop_fd(path)
+            finally:
+                os.close(fd)
+
+        fd = os.open(f"{self.host_prefix}{path}", os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            data = self._pread_all(fd)
+        except OSError:
+            os.close(fd)
+            raise
+        with self._fd_lock:
+            # Другой поток мог успеть закешировать этот же файл
+            if cache and path not in self._fds and len(self._fds) < self._max_fds:
+                self._fds[path] = fd
+                fd = None
+        if fd is not None:
+            os.close(fd)
+        return data
+
+    def read_text(self, path, cache=True):
+        return self.read_bytes(path, cache).decode('utf-8', 'replace')
+
+    def _drop_fd(self, path):
+        fd = self._fds.pop(path, None)
+        if fd is not None:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _forget_pids(self, alive):
+        """Close descriptors and caches of processes that no longer exist"""
+        with self._fd_lock:
+            for path in [p for p in self._fds if p.startswith('/proc/') and p.split('/')[2].isdigit()]:
+                if int(path.split('/')[2]) not in alive:
+                    self._drop_fd(path)
+        for key in [k for k in self._cmdlines if k[0] not in alive]:
+            del self._cmdlines[key]
+
+    def forget(self, prefix):
+        """Close cached descriptors of files under prefix (e.g. a removed cgroup)"""
+        with self._fd_lock:
+            for path in [p for p in self._fds if p.startswith(prefix)]:
+                self._drop_fd(path)
+
+    # --- системные файлы ---
+
+    def boot_time(self):
+        if self._boot_time is None:
+            for line in self.read_text("/proc/stat", cache=False).splitlines():
+                if line.startswith('btime'):
+                    self._boot_time = int(line.split()[1])
+                    break
+            else:
+                self._boot_time = 0
+        return self._boot_time
+
+    def mem_total_kb(self):
+        for line in self.read_text("/proc/meminfo").splitlines():
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1])
+        return 0
+
+    def user_name(self, uid):
+        """Resolve uid via host /etc/passwd, reloading it only when it changes"""
+        passwd = f"{self.host_prefix}/etc/passwd"
+        try:
+            mtime = os.stat(passwd).st_mtime
+        except OSError:
+            mtime = None
+        if mtime != self._passwd_mtime:
+            self._passwd_mtime = mtime
+            self._users = {}
+            try:
+                with open(passwd, 'r') as f:
+                    for line in f:
+                        parts = line.split(':')
+                        if len(parts) > 2 and parts[2].isdigit():
+                            self._users.setdefault(int(parts[2]), parts[0])
+            except OSError:
+                pass
+        return self._users.get(uid, str(uid))
+
+    # --- процессы ---
+
+    def list_pids(self):
+        return [int(name) for name in os.listdir(self.proc) if name.isdigit()]
+
+    def read_process_stat(self, pid):
+        """Parse /proc/<pid>/stat, returns None if the process is gone"""
+        try:
+            data = self.read_text(f"/proc/{pid}/stat")
+        except OSError:
+            return None
+        # comm может содержать пробелы и скобки, поэтому режем по последней ')'
+        lparen = data.find('(')
+        rparen = data.rfind(')')
+        if lparen < 0 or rparen < 0:
+            return None
+        fields = data[rparen + 2:].split()
+        if len(fields) < 22:
+            return None
+        return {
+            'pid': pid,
+            'comm': data[lparen + 1:rparen],
+            'state': fields[0],
+            'ppid': int(fields[1]),
+            'tty_nr': int(fields[4]),
+            'utime': int(fields[11]),
+            'stime': int(fields[12]),
+            'starttime': int(fields[19]),
+            'vsize': int(fields[20]),
+            'rss_pages': int(fields[21]),
+        }
+
+    def read_processes(self):
+        """Read stat of every process on the host"""
+        processes = []
+        for pid in self.list_pids():
+            stat = self.read_process_stat(pid)
+            if stat:
+                processes.append(stat)
+        self._forget_pids({p['pid'] for p in processes})
+        return processes
+
+    def read_process_io(self, pid):
+        """Storage IO of a process from /proc/<pid>/io, None if unreadable (no permission or gone)"""
+        try:
+            data = self.read_text(f"/proc/{pid}/io")
+        except OSError:
+            return None
+        io = {}
+        for line in data.splitlines():
+            name, _, value = line.partition(':')
+            if name in ('read_bytes', 'write_bytes'):
+                io[name] = int(value)
+        return io if len(io) == 2 else None
+
+    def process_uid(self, pid):
+        try:
+            return os.stat(f"{self.proc}/{pid}").st_uid
+        except OSError:
+            return None
+
+    def process_cmdline(self, pid, starttime, comm):
+        """Return command line, cached per (pid, starttime) since it never changes"""
+        key = (pid, starttime)
+        cmdline = self._cmdlines.get(key)
+        if cmdline is None:
+            try:
+                raw = self.read_bytes(f"/proc/{pid}/cmdline", cache=False)
+            except OSError:
+                raw = b''
+            cmdline = raw.rstrip(b'\0').replace(b'\0', b' ').decode('utf-8', 'replace')
+            # У потоков ядра cmdline пустой, ps показывает их как [comm]
+            cmdline = cmdline or f"[{comm}]"
+            self._cmdlines[key] = cmdline
+        return cmdline
+
+    def process_tty(self, tty_nr):
+        return _decode_tty(tty_nr)
+
+    # --- сеть ---
+
+    def read_sockets(self, protocols=('tcp', 'tcp6', 'udp', 'udp6'), tcp_states=None):
+        """Parse /proc/net/{tcp,tcp6,udp,udp6} into socket dicts.
+
+        tcp_states limits TCP sockets to the given state names; other lines
+        are skipped before decoding, which matters with tens of thousands of
+        connections.
+        """
+        codes = {code for code, name in TCP_STATES.items() if name in tcp_states} if tcp_states else None
+        sockets = []
+        for proto in protocols:
+            try:
+                lines = self.read_text(f"{self.net_dir}/{proto}").splitlines()[1:]
+            except OSError:
+                continue
+            for line in lines:
+                if codes is not None and proto.startswith('tcp'):
+                    head = line.split(None, 4)
+                    if len(head) < 4 or head[3] not in codes:
+                        continue
+                parts = line.split()
+                if len(parts) < 10:
+                    continue
+                sockets.append({
+                    'proto': proto,
+                    'local_address': _decode_address(parts[1]),
+                    'foreign_address': _decode_address(parts[2]),
+                    'state': TCP_STATES.get(parts[3], parts[3]),
+                    'uid': int(parts[7]),
+                    'inode': int(parts[9]),
+                })
+        return sockets
+
+    def count_tcp_states(self):
+        """Number of TCP sockets (IPv4 and IPv6) per state, without building per-socket objects"""
+        counts = {}
+        for proto in ('tcp', 'tcp6'):
+            try:
+                lines = self.read_text(f"{self.net_dir}/{proto}").splitlines()[1:]
+            except OSError:
+                continue
+            for line in lines:
+                # sl local rem st ... - нужно только четвёртое поле
+                head = line.split(None, 4)
+                if len(head) >= 4:
+                    counts[head[3]] = counts.get(head[3], 0) + 1
+        return {TCP_STATES.get(code, code): count for code, count in counts.items()}
+
+    def read_net_dev(self):
+        """Cumulative counters per interface from /proc/net/dev"""
+        interfaces = {}
+        for line in self.read_text(f"{self.net_dir}/dev").splitlines()[2:]:
+            name, _, values = line.partition(':')
+            fields = values.split()
+            if len(fields) < 16:
+                continue
+            # rx: bytes packets errs drop fifo frame compressed multicast, tx: bytes packets errs drop ...
+            interfaces[name.strip()] = {
+                'rx_bytes': int(fields[0]),
+                'rx_packets': int(fields[1]),
+                'rx_errors': int(fields[2]),
+                'rx_dropped': int(fields[3]),
+                'tx_bytes': int(fields[8]),
+                'tx_packets': int(fields[9]),
+                'tx_errors': int(fields[10]),
+                'tx_dropped': int(fields[11]),
+            }
+        return interfaces
+
+    def socket_owners(self, inodes):
+        """Map socket inodes to (pid, comm), scanning /proc/<pid>/fd only for unknown inodes"""
+        missing = {i for i in inodes if i and i not in self._socket_owners}
+        if missing:
+            for pid in self.list_pids():
+                fd_dir = f"{self.proc}/{pid}/fd"
+                try:
+                    fds = os.listdir(fd_dir)
+                except OSError:
+                    continue
+                for fd in fds:
+                    try:
+                        target = os.readlink(f"{fd_dir}/{fd}")
+                    except OSError:
+                        continue
+                    if target.startswith('socket:['):
+                        inode = int(target[8:-1])
+                        if inode in missing:
+                            stat = self.read_process_stat(pid)
+                            comm = stat['comm'] if stat else ''
+                            self._socket_owners[inode] = (pid, comm)
+                            missing.discard(inode)
+                if not missing:
+                    break
+            # Не найденные сокеты запоминаем, чтобы не сканировать /proc на каждом сэмпле
+            for inode in missing:
+                self._socket_owners[inode] = (0, '')
+        wanted = set(inodes)
+        for inode in [i for i in self._socket_owners if i not in wanted]:
+            del self._socket_owners[inode]
+        return {i: self._socket_owners.get(i, (0, '')) for i in inodes}
+
+    # --- диски ---
+
+    def read_mounts(self):
+        """Return real mounted filesystems with statvfs sizes in bytes"""
+        try:
+            # Точки монтирования хоста видны через init, /proc/mounts показал бы наш namespace
+            text = self.read_text("/proc/1/mounts")
+        except OSError:
+            text = self.read_text("/proc/mounts")
+
+        mounts = []
+        seen = set()
+        for line in text.splitlines():
+            parts = line.split()
+            if len(parts) < 3:
+                continue
+            device, mount_point, fstype = parts[0], parts[1].replace('\\040', ' '), parts[2]
+            if fstype in PSEUDO_FILESYSTEMS or (device, mount_point) in seen:
+                continue
+            seen.add((device, mount_point))
+            try:
+                st = os.statvfs(f"{self.host_prefix}{mount_point}")
+            except OSError:
+                continue
+            if st.f_blocks == 0:
+                continue
+            mounts.append({
+                'filesystem': device,
+                'fstype': fstype,
+                'mounted_on': mount_point,
+                'size_bytes': st.f_blocks * st.f_frsize,
+                'used_bytes': (st.f_blocks - st.f_bfree) * st.f_frsize,
+                'available_bytes': st.f_bavail * st.f_frsize,
+            })
+        return mounts
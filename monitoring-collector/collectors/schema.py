@@ -0,0 +1,389 @@
+"""Typed (v2) storage schema for host metrics and migration from v1 tables.
+
+v1 tables (memory_info, cpu_info, ...) stored sizes as human-formatted
+strings like "15.6G" and percentages as VARCHAR. v2 tables keep byte counts
+in BIGINT, percentages in REAL and reference the host by SMALLINT id.
+
+Run the data migration once with:
+
+    python -m collectors.schema migrate
+"""
+import sys
+from datetime import datetime, timedelta
+
+# Таблицы v2 по семействам метрик
+METRIC_TABLES = {
+    'memory': 'memory_info_v2',
+    'cpu': 'cpu_info_v2',
+    'disk': 'disk_info_v2',
+    'process': 'process_info_v2',
+    'network': 'network_info_v2',
+    'interface': 'interface_info_v2',
+    'tcp_state': 'tcp_state_info_v2',
+    'container': 'container_stats_v2',
+}
+
+# Справочник командных строк процессов: строки process_info_v2 ссылаются на него по command_id
+COMMANDS_TABLE = 'process_commands'
+
+# Таблицы, куда строки пишутся через upsert: {таблица: (ключ, ON CONFLICT ...)}
+UPSERT_TABLES = {
+    COMMANDS_TABLE: (
+        ('command_id',),
+        "ON CONFLICT (command_id) DO UPDATE SET last_seen = GREATEST(process_commands.last_seen, EXCLUDED.last_seen)"
+    ),
+}
+
+CREATE_TABLES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name VARCHAR(100) PRIMARY KEY,
+        applied_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS hosts (
+        id SMALLSERIAL PRIMARY KEY,
+        hostname VARCHAR(100) NOT NULL UNIQUE,
+        created_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS memory_info_v2 (
+        host_id SMALLINT NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        total_bytes BIGINT,
+        used_bytes BIGINT,
+        free_bytes BIGINT,
+        shared_bytes BIGINT,
+        buffer_cache_bytes BIGINT,
+        available_bytes BIGINT,
+        swap_total_bytes BIGINT,
+        swap_used_bytes BIGINT,
+        swap_free_bytes BIGINT
+    ) PARTITION BY RANGE (timestamp)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS cpu_info_v2 (
+        host_id SMALLINT NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        load_1 REAL,
+        load_5 REAL,
+        load_15 REAL,
+        tasks_total INTEGER,
+        tasks_running INTEGER,
+        tasks_blocked INTEGER,
+        cpu_us REAL,
+        cpu_sy REAL,
+        cpu_ni REAL,
+        cpu_id REAL,
+        cpu_wa REAL,
+        cpu_hi REAL,
+        cpu_si REAL,
+        cpu_st REAL
+    ) PARTITION BY RANGE (timestamp)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS disk_info_v2 (
+        host_id SMALLINT NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        filesystem VARCHAR(100),
+        mounted_on VARCHAR(100),
+        size_bytes BIGINT,
+        used_bytes BIGINT,
+        available_bytes BIGINT,
+        use_percent REAL
+    ) PARTITION BY RANGE (timestamp)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS process_info_v2 (
+        host_id SMALLINT NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        pid INTEGER,
+        username VARCHAR(50),
+        cpu_percent REAL,
+        mem_percent REAL,
+        vsz_bytes BIGINT,
+        rss_bytes BIGINT,
+        tty VARCHAR(20),
+        state VARCHAR(10),
+        start_time TIMESTAMP,
+        cpu_seconds REAL,
+        command TEXT
+    ) PARTITION BY RANGE (timestamp)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS network_info_v2 (
+        host_id SMALLINT NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        proto VARCHAR(5),
+        state VARCHAR(12),
+        local_address VARCHAR(50),
+        foreign_address VARCHAR(50),
+        pid INTEGER,
+        program_name VARCHAR(100)
+    ) PARTITION BY RANGE (timestamp)
+    """,
+    # Скорости по сетевым интерфейсам за интервал между сэмплами, из счётчиков /proc/net/dev
+    """
+    CREATE TABLE IF NOT EXISTS interface_info_v2 (
+        host_id SMALLINT NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        interface VARCHAR(32),
+        rx_bytes_per_sec REAL,
+        tx_bytes_per_sec REAL,
+        rx_packets_per_sec REAL,
+        tx_packets_per_sec REAL,
+        rx_errors_per_sec REAL,
+        tx_errors_per_sec REAL,
+        rx_dropped_per_sec REAL,
+        tx_dropped_per_sec REAL
+    ) PARTITION BY RANGE (timestamp)
+    """,
+    # Число TCP-соединений (IPv4 + IPv6) по состояниям вместо строки на каждый сокет
+    """
+    CREATE TABLE IF NOT EXISTS tcp_state_info_v2 (
+        host_id SMALLINT NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        state VARCHAR(12),
+        connections INTEGER
+    ) PARTITION BY RANGE (timestamp)
+    """,
+    # Ресурсы контейнеров из cgroup v2: скорости по дельтам счётчиков, память - текущие значения.
+    # container_id - первые 12 символов, как в hash containers
+    """
+    CREATE TABLE IF NOT EXISTS container_stats_v2 (
+        host_id SMALLINT NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        container_id VARCHAR(12) NOT NULL,
+        cpu_percent REAL,
+        cpu_throttled_percent REAL,
+        memory_bytes BIGINT,
+        memory_working_set_bytes BIGINT,
+        memory_anon_bytes BIGINT,
+        memory_file_bytes BIGINT,
+        memory_limit_bytes BIGINT,
+        read_bytes_per_sec REAL,
+        write_bytes_per_sec REAL,
+        read_ops_per_sec REAL,
+        write_ops_per_sec REAL
+    ) PARTITION BY RANGE (timestamp)
+    """,
+    "CREATE INDEX IF NOT EXISTS container_stats_v2_container_ts_idx ON container_stats_v2 (container_id, timestamp)",
+    # command_id - 64-битный хэш строки, сборщик вычисляет его сам без запроса к базе.
+    # last_seen обновляется каждым ключевым кадром, по нему backend удаляет старые команды
+    """
+    CREATE TABLE IF NOT EXISTS process_commands (
+        command_id BIGINT PRIMARY KEY,
+        command TEXT NOT NULL,
+        last_seen TIMESTAMP NOT NULL
+    )
+    """,
+] + [
+    statement
+    for table in METRIC_TABLES.values()
+    for statement in (
+        # Строки, для дня которых ещё нет партиции, попадают в default до следующего запуска scheduler
+        f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT",
+        f"CREATE INDEX IF NOT EXISTS {table}_host_ts_idx ON {table} (host_id, timestamp)",
+    )
+]
+
+# Колонки, добавленные после появления v2. Выполняются после подключения _legacy партиций,
+# чтобы ALTER прошёл и по ним
+ALTER_TABLES_SQL = [
+    # Полные снимки процессов: command_id вместо повторяющегося command, счётчики IO,
+    # keyframe - строка полного снимка, остальные строки - только изменившиеся процессы
+    """
+    ALTER TABLE process_info_v2
+        ADD COLUMN IF NOT EXISTS command_id BIGINT,
+        ADD COLUMN IF NOT EXISTS read_bytes BIGINT,
+        ADD COLUMN IF NOT EXISTS write_bytes BIGINT,
+        ADD COLUMN IF NOT EXISTS keyframe BOOLEAN NOT NULL DEFAULT false
+    """,
+]
+
+# "15.6G" / "512K" / "20G" -> байты. ps отдаёт vsz/rss в килобайтах без суффикса
+SIZE_TO_BYTES_SQL = """
+    CREATE OR REPLACE FUNCTION pg_temp.size_to_bytes(value TEXT, unit BIGINT DEFAULT 1) RETURNS BIGINT
+    LANGUAGE sql IMMUTABLE AS $$
+        SELECT CASE
+            WHEN value ~ '^[0-9]+(\\.[0-9]+)?[KMGTP]?$' THEN
+                (substring(value FROM '^[0-9.]+')::NUMERIC *
+                 CASE right(value, 1)
+                     WHEN 'K' THEN 1024::NUMERIC
+                     WHEN 'M' THEN 1024::NUMERIC ^ 2
+                     WHEN 'G' THEN 1024::NUMERIC ^ 3
+                     WHEN 'T' THEN 1024::NUMERIC ^ 4
+                     WHEN 'P' THEN 1024::NUMERIC ^ 5
+                     ELSE unit
+                 END)::BIGINT
+        END
+    $$
+"""
+
+TO_REAL_SQL = """
+    CREATE OR REPLACE FUNCTION pg_temp.to_real(value TEXT) RETURNS REAL
+    LANGUAGE sql IMMUTABLE AS $$
+        SELECT CASE WHEN rtrim(value, '%') ~ '^-?[0-9]+(\\.[0-9]+)?$' THEN rtrim(value, '%')::REAL END
+    $$
+"""
+
+# Перенос данных v1 -> v2, по одному запросу на таблицу
+MIGRATE_V1_SQL = {
+    'memory_info': """
+        INSERT INTO memory_info_v2 (host_id, timestamp, total_bytes, used_bytes, free_bytes, shared_bytes,
+                                    buffer_cache_bytes, available_bytes, swap_total_bytes, swap_used_bytes,
+                                    swap_free_bytes)
+        SELECT h.id, m.timestamp,
+               pg_temp.size_to_bytes(m.total_memory), pg_temp.size_to_bytes(m.used_memory),
+               pg_temp.size_to_bytes(m.free_memory), pg_temp.size_to_bytes(m.shared_memory),
+               pg_temp.size_to_bytes(m.buffer_cache), pg_temp.size_to_bytes(m.available_memory),
+               pg_temp.size_to_bytes(m.swap_total), pg_temp.size_to_bytes(m.swap_used),
+               pg_temp.size_to_bytes(m.swap_free)
+        FROM memory_info m JOIN hosts h ON h.hostname = m.hostname
+        WHERE m.timestamp IS NOT NULL
+    """,
+    'cpu_info': """
+        INSERT INTO cpu_info_v2 (host_id, timestamp, load_1, load_5, load_15, tasks_total, tasks_running,
+                                 tasks_blocked, cpu_us, cpu_sy, cpu_ni, cpu_id, cpu_wa, cpu_hi, cpu_si, cpu_st)
+        SELECT h.id, c.timestamp,
+               pg_temp.to_real(split_part(c.load_average, ', ', 1)),
+               pg_temp.to_real(split_part(c.load_average, ', ', 2)),
+               pg_temp.to_real(split_part(c.load_average, ', ', 3)),
+               NULLIF(c.tasks_total, 0), c.tasks_running, c.tasks_sleeping,
+               pg_temp.to_real(c.cpu_us), pg_temp.to_real(c.cpu_sy), pg_temp.to_real(c.cpu_ni),
+               pg_temp.to_real(c.cpu_id), pg_temp.to_real(c.cpu_wa), pg_temp.to_real(c.cpu_hi),
+               pg_temp.to_real(c.cpu_si), pg_temp.to_real(c.cpu_st)
+        FROM cpu_info c JOIN hosts h ON h.hostname = c.hostname
+        WHERE c.timestamp IS NOT NULL
+    """,
+    'disk_info': """
+        INSERT INTO disk_info_v2 (host_id, timestamp, filesystem, mounted_on, size_bytes, used_bytes,
+                                  available_bytes, use_percent)
+        SELECT h.id, d.timestamp, d.filesystem, d.mounted_on,
+               pg_temp.size_to_bytes(d.size), pg_temp.size_to_bytes(d.used),
+               pg_temp.size_to_bytes(d.available), pg_temp.to_real(d.use_percent)
+        FROM disk_info d JOIN hosts h ON h.hostname = d.hostname
+        WHERE d.timestamp IS NOT NULL
+    """,
+    'process_info': """
+        INSERT INTO process_info_v2 (host_id, timestamp, pid, username, cpu_percent, mem_percent, vsz_bytes,
+                                     rss_bytes, tty, state, command)
+        SELECT h.id, p.timestamp, p.pid, p."user", p.cpu_percent, p.mem_percent,
+               pg_temp.size_to_bytes(p.vsz, 1024), pg_temp.size_to_bytes(p.rss, 1024),
+               p.tty, p.stat, p.command
+        FROM process_info p JOIN hosts h ON h.hostname = p.hostname
+        WHERE p.timestamp IS NOT NULL
+    """,
+    'network_info': """
+        INSERT INTO network_info_v2 (host_id, timestamp, state, local_address, foreign_address, pid,
+                                     program_name)
+        SELECT h.id, n.timestamp, n.state, n.local_address, n.foreign_address, n.pid, n.program_name
+        FROM network_info n JOIN hosts h ON h.hostname = n.hostname
+        WHERE n.timestamp IS NOT NULL
+    """,
+}
+
+
+def create_tables(conn):
+    """Create v2 tables and indexes if they don't exist.
+
+    v2 metric tables are range-partitioned by day; daily partitions are created
+    ahead of time and dropped on retention by the backend scheduler. A v2 table
+    created before partitioning is renamed to <table>_legacy and attached as a
+    partition covering everything up to tomorrow.
+    """
+    tomorrow = datetime.utcnow().date() + timedelta(days=1)
+    with conn.cursor() as cur:
+        legacy = []
+        for table in METRIC_TABLES.values():
+            cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+            row = cur.fetchone()
+            if row and row[0] == 'r':
+                cur.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+                cur.execute(f"ALTER INDEX IF EXISTS {table}_host_ts_idx RENAME TO {table}_legacy_host_ts_idx")
+                legacy.append(table)
+        
+        for statement in CREATE_TABLES_SQL:
+            cur.execute(statement)
+        
+        for table in legacy:
+            cur.execute(
+                f"ALTER TABLE {table} ATTACH PARTITION {table}_legacy FOR VALUES FROM (MINVALUE) TO (%s)",
+                (datetime.combine(tomorrow, datetime.min.time()),)
+            )
+        
+        for statement in ALTER_TABLES_SQL:
+            cur.execute(statement)
+    conn.commit()
+
+
+def get_host_id(conn, hostname):
+    """Return id of hostname in hosts registry, registering it if needed"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM hosts WHERE hostname = %s", (hostname,))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute(
+                "INSERT INTO hosts (hostname) VALUES (%s) "
+                "ON CONFLICT (hostname) DO UPDATE SET hostname = EXCLUDED.hostname RETURNING id",
+                (hostname,)
+            )
+            row = cur.fetchone()
+    conn.commit()
+    return row[0]
+
+
+def migrate_v1(conn):
+    """Copy rows of existing v1 tables into v2 tables, each table only once.
+
+    Returns {v1_table: copied_rows}. v1 tables are left in place so they can
+    be checked and dropped by hand.
+    """
+    create_tables(conn)
+    copied = {}
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SIZE_TO_BYTES_SQL)
+            cur.execute(TO_REAL_SQL)
+            for v1_table, insert_sql in MIGRATE_V1_SQL.items():
+                migration = f"v1_to_v2_{v1_table}"
+                cur.execute("SELECT to_regclass(%s)", (v1_table,))
+                if cur.fetchone()[0] is None:
+                    continue
+                cur.execute("SELECT 1 FROM schema_migrations WHERE name = %s", (migration,))
+                if cur.fetchone():
+                    continue
+                cur.execute(
+                    f"INSERT INTO hosts (hostname) SELECT DISTINCT hostname FROM {v1_table} "
+                    f"WHERE hostname IS NOT NULL ON CONFLICT (hostname) DO NOTHING"
+                )
+                cur.execute(insert_sql)
+                copied[v1_table] = cur.rowcount
+                cur.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (migration,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return copied
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in ("init", "migrate"):
+        from collectors.system_collector import get_db_connection
+        conn = get_db_connection()
+        if not conn:
+            sys.exit(1)
+        try:
+            if sys.argv[1] == "init":
+                # Для установок, где все сборщики работают в режиме push и сами таблицы не создают
+                create_tables(conn)
+                print("✅ Tables created")
+            else:
+                for table, count in migrate_v1(conn).items():
+                    print(f"✅ {table}: {count} rows copied to v2")
+        finally:
+            conn.close()
+    else:
+        print("usage: python -m collectors.schema init|migrate")
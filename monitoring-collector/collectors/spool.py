@@ -0,0 +1,212 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import msgpack
+import zstandard
+
+from collectors.agent_pusher import MSGPACK_DATETIME, pack_default
+
+# Куда складываются пачки, пока PostgreSQL недоступен; пустая строка - спул выключен
+SPOOL_DIR = os.getenv('SPOOL_DIR', '/var/spool/collector')
+# Размер сегмента и всего спула: при переполнении удаляется самый старый сегмент
+SPOOL_SEGMENT_BYTES = int(os.getenv('SPOOL_SEGMENT_BYTES', str(16 * 1024 * 1024)))
+SPOOL_MAX_BYTES = int(os.getenv('SPOOL_MAX_BYTES', str(1024 * 1024 * 1024)))
+# fsync не чаще раза в столько секунд: при сбое питания теряется не больше этого окна
+SPOOL_FSYNC_INTERVAL = float(os.getenv('SPOOL_FSYNC_INTERVAL', '1'))
+
+# Заголовок записи: длина сжатого тела и его crc32
+_HEADER = struct.Struct('<II')
+_SEGMENT_SUFFIX = '.seg'
+_POSITION_FILE = 'position'
+
+
+def _ext_hook(code, data):
+    if code == MSGPACK_DATETIME:
+        return datetime.fromisoformat(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+def encode_record(table, columns, rows):
+    packed = msgpack.packb([table, list(columns), rows], default=pack_default, use_bin_type=True)
+    body = zstandard.ZstdCompressor(level=1).compress(packed)
+    return _HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode_record(body):
+    table, columns, rows = msgpack.unpackb(
+        zstandard.ZstdDecompressor().decompress(body), ext_hook=_ext_hook, raw=False, use_list=False
+    )
+    return table, tuple(columns), list(rows)
+
+
+class Spool:
+    """Append-only, segment-rotated file queue of row batches.
+
+    Each record is one batch of a table (msgpack, zstd-compressed, framed by
+    length and crc32). Writes go to the active segment and are fsynced at
+    most every fsync_interval seconds; readers only see sealed segments.
+    The read position survives restarts, a torn record at the end of a
+    segment (crash during write) is skipped.
+    """
+
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES, max_bytes=SPOOL_MAX_BYTES,
+                 fsync_interval=SPOOL_FSYNC_INTERVAL):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._sealed = []
+        self._sizes = {}
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(_SEGMENT_SUFFIX):
+                continue
+            size = os.path.getsize(self._path(name))
+            if size:
+                self._sealed.append(name)
+                self._sizes[name] = size
+            else:
+                os.remove(self._path(name))
+        self._next_seq = int(self._sealed[-1][:-len(_SEGMENT_SUFFIX)]) + 1 if self._sealed else 1
+        # Активный сегмент открывается при первой записи; после рестарта старые сегменты только читаются
+        self._active = None
+        self._file = None
+        self._dirty = False
+        self._last_fsync = time.monotonic()
+        self.dropped_bytes = 0
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def size(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def has_data(self):
+        with self._lock:
+            return any(self._sizes.values())
+
+    def append(self, table, columns, rows):
+        """Write one batch of rows (tuples in columns order)"""
+        record = encode_record(table, columns, rows)
+        with self._lock:
+            if self._file is None or self._sizes[self._active] >= self.segment_bytes:
+                self._rotate()
+            self._file.write(record)
+            self._file.flush()
+            self._sizes[self._active] += len(record)
+            self._dirty = True
+            if time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._fsync()
+            self._enforce_limit()
+
+    def _rotate(self):
+        if self._file is not None:
+            self._fsync()
+            self._file.close()
+            self._sealed.append(self._active)
+        self._active = f"{self._next_seq:012d}{_SEGMENT_SUFFIX}"
+        self._next_seq += 1
+        self._file = open(self._path(self._active), 'ab')
+        self._sizes[self._active] = 0
+
+    def _fsync(self):
+        if self._dirty and self._file is not None:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+        self._last_fsync = time.monotonic()
+
+    def _enforce_limit(self):
+        total = sum(self._sizes.values())
+        while total > self.max_bytes and self._sealed:
+            oldest = self._sealed.pop(0)
+            size = self._sizes.pop(oldest)
+            total -= size
+            self.dropped_bytes += size
+            os.remove(self._path(oldest))
+            print(f"⚠️ Spool is over {self.max_bytes} bytes, dropped segment {oldest} ({size} bytes)")
+
+    def sync(self):
+        """fsync the active segment if it has unsynced records"""
+        with self._lock:
+            self._fsync()
+
+    def seal(self):
+        """Close the active segment so its records become readable"""
+        with self._lock:
+            if self._file is not None and self._sizes[self._active]:
+                self._fsync()
+                self._file.close()
+                self._sealed.append(self._active)
+                self._file = None
+                self._active = None
+
+    def sealed_segments(self):
+        with self._lock:
+            return list(self._sealed)
+
+    def read_position(self):
+        """(segment, offset) to continue reading from"""
+        try:
+            with open(self._path(_POSITION_FILE)) as f:
+                name, offset = f.read().split()
+                return name, int(offset)
+        except (OSError, ValueError):
+            return None, 0
+
+    def save_position(self, name, offset):
+        tmp = self._path(_POSITION_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            f.write(f"{name} {offset}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(_POSITION_FILE))
+
+    def read(self, name, offset=0):
+        """Yield (end offset, table, columns, rows) of the records in a sealed segment"""
+        try:
+            f = open(self._path(name), 'rb')
+        except FileNotFoundError:
+            # Сегмент удалён по лимиту размера
+            return
+        with f:
+            f.seek(offset)
+            while True:
+                header = f.read(_HEADER.size)
+                if not header:
+                    return
+                length, crc = _HEADER.unpack(header) if len(header) == _HEADER.size else (0, None)
+                body = f.read(length)
+                if crc is None or len(body) < length or zlib.crc32(body) != crc:
+                    print(f"⚠️ Spool segment {name} has a torn record at {offset}, rest of it is skipped")
+                    return
+                offset += _HEADER.size + length
+                yield (offset,) + decode_record(body)
+
+    def remove(self, name):
+        """Delete a segment that was fully replayed"""
+        with self._lock:
+            if name in self._sealed:
+                self._sealed.remove(name)
+            self._sizes.pop(name, None)
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._fsync()
+                self._file.close()
+                self._file = None
+                if not self._sizes[self._active]:
+                    os.remove(self._path(self._active))
+                    del self._sizes[self._active]
@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 import os
 import time
-import subprocess
 import socket
+import hashlib
+import signal
+import threading
+import json
 from datetime import datetime
 import psycopg2
-from psycopg2 import sql
+import redis
+from collectors import schema
+from collectors.db_writer import BatchWriter
+from collectors.agent_pusher import AgentPusher
+from collectors.spool import Spool, SPOOL_DIR
+from collectors import exporter
+from collectors.exporter import COLLECTOR_DURATION, COLLECTOR_TIMEOUTS, SAMPLE_DURATION, REDIS_DURATION
+from collectors.proc_reader import ProcReader, CLOCK_TICKS, PAGE_SIZE
+from collectors.cgroup_reader import CgroupReader
 
 # Database configuration
 DB_CONFIG = {
@@ -13,12 +24,83 @@ DB_CONFIG = {
     'database': 'postgres_db',
     'user': 'app_user',
     'password': 'app_pass',
-    'port': 5432
+    'port': 5432,
+    # Недоступная база не должна вешать запуск и запись на TCP-таймаут
+    'connect_timeout': 5
 }
 
 # Пути к хостовым файлам
 HOST_PREFIX = "/host"
 
+# db - писать в PostgreSQL напрямую, push - отправлять пачки в backend (/api/ingest)
+COLLECTOR_MODE = os.getenv('COLLECTOR_MODE', 'db')
+
+# Интервал между сэмплами в секундах
+COLLECT_INTERVAL = float(os.getenv('COLLECT_INTERVAL', '10'))
+# Сколько ждём каждый сборщик в сэмпле (зависший df на NFS не должен держать остальные)
+COLLECTOR_TIMEOUT = float(os.getenv('COLLECTOR_TIMEOUT', str(min(5.0, COLLECT_INTERVAL))))
+
+# Счётчики /proc/stat с прошлого сэмпла (user, nice, system, idle, iowait, irq, softirq, steal)
+_prev_cpu_times = None
+
+# Читатель /proc с закешированными дескрипторами
+_proc_reader = None
+_proc_reader_lock = threading.Lock()
+
+# Потоки сборщиков, не уложившихся в таймаут: {имя: Thread}. Пока поток жив, сборщик не перезапускаем
+_hung_collectors = {}
+
+# Тики CPU процессов с прошлого сэмпла: {(pid, starttime): utime + stime}
+_prev_proc_ticks = {}
+_prev_proc_time = None
+
+# Счётчики /proc/net/dev с прошлого сэмпла: {interface: {counter: value}}
+_prev_net_dev = None
+_prev_net_time = None
+
+# Читатель cgroup v2 контейнеров и их счётчики с прошлого сэмпла: {id контейнера: {counter: value}}
+_cgroup_reader = None
+_prev_container_stats = None
+_prev_container_time = None
+# Счётчики, из которых считаются скорости; остальные значения cgroup - текущие
+CONTAINER_COUNTERS = ('cpu_usage_usec', 'cpu_throttled_usec', 'io_read_bytes', 'io_write_bytes',
+                      'io_read_ops', 'io_write_ops')
+
+# Снимки процессов: раз в PROCESS_KEYFRAME_EVERY сэмплов пишутся все процессы (keyframe),
+# между ними - только процессы, изменившиеся с их последней записанной строки больше порогов
+PROCESS_KEYFRAME_EVERY = int(os.getenv('PROCESS_KEYFRAME_EVERY', '30'))
+PROCESS_CPU_SECONDS_THRESHOLD = float(os.getenv('PROCESS_CPU_SECONDS_THRESHOLD', '0.5'))
+PROCESS_RSS_THRESHOLD = int(os.getenv('PROCESS_RSS_THRESHOLD', str(1024 * 1024)))
+PROCESS_IO_THRESHOLD = int(os.getenv('PROCESS_IO_THRESHOLD', str(1024 * 1024)))
+# Сколько строк изменений максимум пишем за сэмпл, остальные дождутся следующего
+PROCESS_MAX_DELTA_ROWS = int(os.getenv('PROCESS_MAX_DELTA_ROWS', '500'))
+
+# Последняя записанная строка каждого процесса: {(pid, starttime): {cpu_ticks, rss, read_bytes, write_bytes, state}}
+_process_baseline = {}
+_process_samples = 0
+# command_id, уже отправленные в process_commands с последнего ключевого кадра
+_sent_commands = set()
+
+# Пакетная запись в PostgreSQL через пул соединений или AgentPusher в режиме push
+_writer = None
+
+# Поток сводок хоста в Redis для живых обновлений API (/api/stream)
+HOST_METRICS_STREAM = "host_metrics"
+HOST_METRICS_STREAM_MAXLEN = int(os.getenv('HOST_METRICS_STREAM_MAXLEN', '10000'))
+# Раз в столько сэмплов отправляем сводку целиком, чтобы новые клиенты получили все поля
+HOST_METRICS_KEYFRAME = int(os.getenv('HOST_METRICS_KEYFRAME', '30'))
+# Последние ресурсы контейнеров хоста: hash {id: json}, живёт пару интервалов после остановки сборщика
+CONTAINER_STATS_KEY = "container_stats:{host}"
+CONTAINER_STATS_HOSTS = "container_stats:hosts"
+CONTAINER_STATS_VERSION = "container_stats_version"
+_redis = None
+# Последняя отправленная сводка: в поток уходят только изменившиеся поля
+_last_published = {}
+_published_since_keyframe = 0
+
+# Флаг остановки демона по SIGTERM/SIGINT
+_stop_event = threading.Event()
+
 def get_db_connection():
     """Create and return database connection"""
     try:
@@ -35,100 +117,8 @@ def create_tables():
         return False
     
     try:
-        with conn.cursor() as cur:
-            # Memory info table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS memory_info (
-                    id SERIAL PRIMARY KEY,
-                    hostname VARCHAR(100),
-                    timestamp TIMESTAMP,
-                    total_memory VARCHAR(50),
-                    used_memory VARCHAR(50),
-                    free_memory VARCHAR(50),
-                    shared_memory VARCHAR(50),
-                    buffer_cache VARCHAR(50),
-                    available_memory VARCHAR(50),
-                    swap_total VARCHAR(50),
-                    swap_used VARCHAR(50),
-                    swap_free VARCHAR(50)
-                )
-            """)
-            
-            # CPU info table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS cpu_info (
-                    id SERIAL PRIMARY KEY,
-                    hostname VARCHAR(100),
-                    timestamp TIMESTAMP,
-                    load_average VARCHAR(100),
-                    tasks_total INTEGER,
-                    tasks_running INTEGER,
-                    tasks_sleeping INTEGER,
-                    tasks_stopped INTEGER,
-                    tasks_zombie INTEGER,
-                    cpu_us VARCHAR(10),
-                    cpu_sy VARCHAR(10),
-                    cpu_ni VARCHAR(10),
-                    cpu_id VARCHAR(10),
-                    cpu_wa VARCHAR(10),
-                    cpu_hi VARCHAR(10),
-                    cpu_si VARCHAR(10),
-                    cpu_st VARCHAR(10)
-                )
-            """)
-            
-            # Disk info table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS disk_info (
-                    id SERIAL PRIMARY KEY,
-                    hostname VARCHAR(100),
-                    timestamp TIMESTAMP,
-                    filesystem VARCHAR(100),
-                    size VARCHAR(20),
-                    used VARCHAR(20),
-                    available VARCHAR(20),
-                    use_percent VARCHAR(10),
-                    mounted_on VARCHAR(100)
-                )
-            """)
-            
-            # Process info table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS process_info (
-                    id SERIAL PRIMARY KEY,
-                    hostname VARCHAR(100),
-                    timestamp TIMESTAMP,
-                    user VARCHAR(50),
-                    pid INTEGER,
-                    cpu_percent FLOAT,
-                    mem_percent FLOAT,
-                    vsz VARCHAR(20),
-                    rss VARCHAR(20),
-                    tty VARCHAR(20),
-                    stat VARCHAR(10),
-                    start_time VARCHAR(20),
-                    cpu_time VARCHAR(20),
-                    command TEXT
-                )
-            """)
-            
-            # Network info table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS network_info (
-                    id SERIAL PRIMARY KEY,
-                    hostname VARCHAR(100),
-                    timestamp TIMESTAMP,
-                    interface VARCHAR(50),
-                    state VARCHAR(20),
-                    local_address VARCHAR(50),
-                    foreign_address VARCHAR(50),
-                    pid INTEGER,
-                    program_name VARCHAR(100)
-                )
-            """)
-            
-            conn.commit()
-            return True
+        schema.create_tables(conn)
+        return True
     except Exception as e:
         print(f"Error creating tables: {e}")
         conn.rollback()
@@ -136,6 +126,21 @@ def create_tables():
     finally:
         conn.close()
 
+def register_host(hostname):
+    """Return host id from hosts registry, None if database is unavailable"""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        return schema.get_host_id(conn, hostname)
+    except Exception as e:
+        print(f"Error registering host {hostname}: {e}")
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+
 def read_host_file(filepath):
     """Чтение файла с хоста"""
     try:
@@ -145,46 +150,42 @@ def read_host_file(filepath):
         print(f"Error reading {filepath}: {e}")
         return ""
 
-def parse_memory_info_from_host(hostname, timestamp):
+def parse_memory_info_from_host(host_id, timestamp):
     """Parse memory info from host's /proc/meminfo"""
     try:
         meminfo = read_host_file("/proc/meminfo")
         lines = meminfo.strip().split('\n')
         
-        mem_data = {}
+        # Значения в /proc/meminfo в килобайтах
+        mem_kb = {}
         for line in lines:
             if ':' in line:
                 key, value = line.split(':', 1)
-                mem_data[key.strip()] = value.strip().split()[0]
+                mem_kb[key.strip()] = int(value.strip().split()[0])
         
-        # Convert kB to MB/GB for consistency with free command
-        def convert_kb(value_kb):
-            kb = int(value_kb)
-            if kb >= 1024*1024:
-                return f"{kb/(1024*1024):.1f}G"
-            elif kb >= 1024:
-                return f"{kb/1024:.1f}M"
-            return f"{kb}K"
+        def to_bytes(key):
+            return mem_kb.get(key, 0) * 1024
         
         return {
-            'hostname': hostname,
+            'host_id': host_id,
             'timestamp': timestamp,
-            'total_memory': convert_kb(mem_data.get('MemTotal', '0')),
-            'used_memory': convert_kb(str(int(mem_data.get('MemTotal', '0')) - int(mem_data.get('MemFree', '0')))),
-            'free_memory': convert_kb(mem_data.get('MemFree', '0')),
-            'shared_memory': convert_kb(mem_data.get('Shmem', '0')),
-            'buffer_cache': convert_kb(mem_data.get('Buffers', '0')),
-            'available_memory': convert_kb(mem_data.get('MemAvailable', '0')),
-            'swap_total': convert_kb(mem_data.get('SwapTotal', '0')),
-            'swap_used': convert_kb(str(int(mem_data.get('SwapTotal', '0')) - int(mem_data.get('SwapFree', '0')))),
-            'swap_free': convert_kb(mem_data.get('SwapFree', '0'))
+            'total_bytes': to_bytes('MemTotal'),
+            'used_bytes': to_bytes('MemTotal') - to_bytes('MemFree'),
+            'free_bytes': to_bytes('MemFree'),
+            'shared_bytes': to_bytes('Shmem'),
+            'buffer_cache_bytes': to_bytes('Buffers'),
+            'available_bytes': to_bytes('MemAvailable'),
+            'swap_total_bytes': to_bytes('SwapTotal'),
+            'swap_used_bytes': to_bytes('SwapTotal') - to_bytes('SwapFree'),
+            'swap_free_bytes': to_bytes('SwapFree')
         }
     except Exception as e:
         print(f"Error parsing memory info: {e}")
         return None
 
-def parse_cpu_info_from_host(hostname, timestamp):
+def parse_cpu_info_from_host(host_id, timestamp):
     """Parse CPU info from host's /proc files"""
+    global _prev_cpu_times
     try:
         # Read load average
         loadavg = read_host_file("/proc/loadavg")
@@ -194,237 +195,598 @@ def parse_cpu_info_from_host(hostname, timestamp):
         stat = read_host_file("/proc/stat")
         lines = stat.strip().split('\n')
         
+        # /proc/loadavg: "0.43 0.18 0.05 1/123 4567"
+        tasks = load_parts[3].split('/') if len(load_parts) >= 4 else []
+        
         cpu_data = {
-            'hostname': hostname,
+            'host_id': host_id,
             'timestamp': timestamp,
-            'load_average': f"{load_parts[0]}, {load_parts[1]}, {load_parts[2]}" if len(load_parts) >= 3 else '',
-            'tasks_total': 0,
+            'load_1': float(load_parts[0]) if len(load_parts) >= 3 else None,
+            'load_5': float(load_parts[1]) if len(load_parts) >= 3 else None,
+            'load_15': float(load_parts[2]) if len(load_parts) >= 3 else None,
+            'tasks_total': int(tasks[1]) if len(tasks) == 2 else None,
             'tasks_running': 0,
-            'tasks_sleeping': 0,
-            'tasks_stopped': 0,
-            'tasks_zombie': 0,
-            'cpu_us': '', 'cpu_sy': '', 'cpu_ni': '', 'cpu_id': '',
-            'cpu_wa': '', 'cpu_hi': '', 'cpu_si': '', 'cpu_st': ''
+            'tasks_blocked': 0,
+            'cpu_us': None, 'cpu_sy': None, 'cpu_ni': None, 'cpu_id': None,
+            'cpu_wa': None, 'cpu_hi': None, 'cpu_si': None, 'cpu_st': None
         }
         
         # Parse process stats from /proc/stat
+        cpu_times = None
         for line in lines:
             if line.startswith('procs_running'):
                 cpu_data['tasks_running'] = int(line.split()[1])
             elif line.startswith('procs_blocked'):
-                cpu_data['tasks_sleeping'] = int(line.split()[1])
+                cpu_data['tasks_blocked'] = int(line.split()[1])
             elif line.startswith('cpu '):
-                parts = line.split()
-                # Calculate CPU percentages (simplified)
-                total = sum(int(x) for x in parts[1:])
-                if total > 0:
-                    cpu_data['cpu_us'] = f"{(int(parts[1]) + int(parts[2])) * 100 / total:.1f}"
-                    cpu_data['cpu_sy'] = f"{int(parts[3]) * 100 / total:.1f}"
-                    cpu_data['cpu_id'] = f"{int(parts[4]) * 100 / total:.1f}"
+                # guest/guest_nice уже входят в user/nice, поэтому берём первые 8 полей
+                cpu_times = [int(x) for x in line.split()[1:9]]
+                cpu_times += [0] * (8 - len(cpu_times))
+
+        if cpu_times:
+            # Считаем проценты за интервал между сэмплами, а не среднее с момента загрузки
+            if _prev_cpu_times:
+                deltas = [max(cur - prev, 0) for cur, prev in zip(cpu_times, _prev_cpu_times)]
+            else:
+                deltas = cpu_times
+            _prev_cpu_times = cpu_times
+
+            total = sum(deltas)
+            if total > 0:
+                for key, value in zip(('cpu_us', 'cpu_ni', 'cpu_sy', 'cpu_id',
+                                       'cpu_wa', 'cpu_hi', 'cpu_si', 'cpu_st'), deltas):
+                    cpu_data[key] = round(value * 100 / total, 2)
         
         return cpu_data
     except Exception as e:
         print(f"Error parsing CPU info: {e}")
         return None
 
-def parse_disk_info_from_host(hostname, timestamp):
-    """Parse disk info using host's df command"""
+def get_proc_reader():
+    """Return shared ProcReader, created on first use"""
+    global _proc_reader
+    with _proc_reader_lock:
+        if _proc_reader is None:
+            _proc_reader = ProcReader(HOST_PREFIX)
+    return _proc_reader
+
+def get_cgroup_reader():
+    """Return shared CgroupReader over the ProcReader descriptor cache"""
+    global _cgroup_reader
+    reader = get_proc_reader()
+    with _proc_reader_lock:
+        if _cgroup_reader is None:
+            _cgroup_reader = CgroupReader(reader)
+    return _cgroup_reader
+
+def parse_disk_info_from_host(host_id, timestamp):
+    """Parse disk info from host's mount table and statvfs"""
     try:
-        # Run df on host by using chroot
-        result = subprocess.run(
-            ["chroot", HOST_PREFIX, "df", "-h"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        
-        lines = result.stdout.strip().split('\n')[1:]
         disks = []
-        
-        for line in lines:
-            parts = line.split()
-            if len(parts) >= 6:
-                disk_data = {
-                    'hostname': hostname,
-                    'timestamp': timestamp,
-                    'filesystem': parts[0],
-                    'size': parts[1],
-                    'used': parts[2],
-                    'available': parts[3],
-                    'use_percent': parts[4],
-                    'mounted_on': parts[5]
-                }
-                disks.append(disk_data)
+        for mount in get_proc_reader().read_mounts():
+            used = mount['used_bytes']
+            avail = mount['available_bytes']
+            disks.append({
+                'host_id': host_id,
+                'timestamp': timestamp,
+                'filesystem': mount['filesystem'],
+                'mounted_on': mount['mounted_on'],
+                'size_bytes': mount['size_bytes'],
+                'used_bytes': used,
+                'available_bytes': avail,
+                # Как в df: процент от места, доступного непривилегированным пользователям
+                'use_percent': round(used * 100 / (used + avail), 2) if used + avail else 0.0
+            })
         
         return disks
     except Exception as e:
         print(f"Error parsing disk info: {e}")
         return []
 
-def parse_process_info_from_host(hostname, timestamp):
-    """Parse process info from host's /proc"""
+def command_id(command):
+    """Stable 64-bit id of a command line, the same on every host"""
+    return int.from_bytes(hashlib.blake2b(command.encode('utf-8', 'replace'), digest_size=8).digest(), 'big', signed=True)
+
+def _process_changed(baseline, current):
+    if baseline is None:
+        return True
+    if current['state'] != baseline['state']:
+        return True
+    if current['cpu_ticks'] - baseline['cpu_ticks'] >= PROCESS_CPU_SECONDS_THRESHOLD * CLOCK_TICKS:
+        return True
+    if abs(current['rss'] - baseline['rss']) >= PROCESS_RSS_THRESHOLD:
+        return True
+    for key in ('read_bytes', 'write_bytes'):
+        if current[key] is not None and baseline[key] is not None \
+                and current[key] - baseline[key] >= PROCESS_IO_THRESHOLD:
+            return True
+    return False
+
+def parse_process_info_from_host(host_id, timestamp):
+    """Sample every process from host's /proc.
+
+    Keyframe samples return a row per process; other samples return rows
+    only for new processes, processes that changed beyond the thresholds
+    since their last written row and processes that exited (state 'X').
+    Command lines go to process_commands once per keyframe period.
+    """
+    global _prev_proc_ticks, _prev_proc_time, _process_baseline, _process_samples, _sent_commands
     try:
-        # Use ps через chroot
-        result = subprocess.run(
-            ["chroot", HOST_PREFIX, "ps", "aux", "--sort=-%cpu"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        reader = get_proc_reader()
+        now = time.monotonic()
+        processes = reader.read_processes()
         
-        lines = result.stdout.strip().split('\n')[1:6]  # Только топ-5 процессов
-        processes = []
+        uptime = float(reader.read_text("/proc/uptime").split()[0])
+        boot_time = reader.boot_time()
+        mem_total_kb = reader.mem_total_kb() or 1
         
-        for line in lines:
-            parts = line.split(maxsplit=10)
-            if len(parts) >= 11:
-                process_data = {
-                    'hostname': hostname,
-                    'timestamp': timestamp,
-                    'user': parts[0],
-                    'pid': int(parts[1]),
-                    'cpu_percent': float(parts[2]),
-                    'mem_percent': float(parts[3]),
-                    'vsz': parts[4],
-                    'rss': parts[5],
-                    'tty': parts[6],
-                    'stat': parts[7],
-                    'start_time': parts[8],
-                    'cpu_time': parts[9],
-                    'command': parts[10] if len(parts) > 10 else ''
-                }
-                processes.append(process_data)
+        keyframe = _process_samples % PROCESS_KEYFRAME_EVERY == 0
+        _process_samples += 1
+        if keyframe:
+            _sent_commands = set()
         
-        return processes
+        # %CPU считаем по дельте тиков с прошлого сэмпла, для первого сэмпла - среднее за жизнь процесса как в ps
+        interval = now - _prev_proc_time if _prev_proc_time else None
+        ticks = {}
+        changed = []
+        for proc in processes:
+            key = (proc['pid'], proc['starttime'])
+            total = proc['utime'] + proc['stime']
+            ticks[key] = total
+            prev = _prev_proc_ticks.get(key)
+            if interval and prev is not None:
+                proc['cpu_percent'] = (total - prev) / CLOCK_TICKS * 100 / interval
+            else:
+                elapsed = uptime - proc['starttime'] / CLOCK_TICKS
+                proc['cpu_percent'] = total / CLOCK_TICKS * 100 / elapsed if elapsed > 0 else 0.0
+            
+            io = reader.read_process_io(proc['pid']) or {}
+            proc['current'] = {
+                'cpu_ticks': total,
+                'rss': proc['rss_pages'] * PAGE_SIZE,
+                'read_bytes': io.get('read_bytes'),
+                'write_bytes': io.get('write_bytes'),
+                'state': proc['state'],
+            }
+            if keyframe or _process_changed(_process_baseline.get(key), proc['current']):
+                changed.append(proc)
+        _prev_proc_ticks = ticks
+        _prev_proc_time = now
+        
+        if not keyframe and len(changed) > PROCESS_MAX_DELTA_ROWS:
+            # Новые процессы и самые активные - в первую очередь
+            changed.sort(key=lambda p: ((p['pid'], p['starttime']) not in _process_baseline, p['cpu_percent']),
+                         reverse=True)
+            changed = changed[:PROCESS_MAX_DELTA_ROWS]
+        
+        result = []
+        commands = []
+        for proc in changed:
+            key = (proc['pid'], proc['starttime'])
+            current = proc['current']
+            command = reader.process_cmdline(proc['pid'], proc['starttime'], proc['comm'])
+            cid = command_id(command)
+            if cid not in _sent_commands:
+                _sent_commands.add(cid)
+                commands.append({'command_id': cid, 'command': command, 'last_seen': timestamp})
+            uid = reader.process_uid(proc['pid'])
+            result.append({
+                'host_id': host_id,
+                'timestamp': timestamp,
+                'pid': proc['pid'],
+                'username': reader.user_name(uid) if uid is not None else None,
+                'cpu_percent': round(proc['cpu_percent'], 2),
+                'mem_percent': round(current['rss'] * 100 / (mem_total_kb * 1024), 2),
+                'vsz_bytes': proc['vsize'],
+                'rss_bytes': current['rss'],
+                'tty': reader.process_tty(proc['tty_nr']),
+                'state': proc['state'],
+                'start_time': datetime.utcfromtimestamp(boot_time + proc['starttime'] / CLOCK_TICKS),
+                'cpu_seconds': current['cpu_ticks'] / CLOCK_TICKS,
+                'command_id': cid,
+                'read_bytes': current['read_bytes'],
+                'write_bytes': current['write_bytes'],
+                'keyframe': keyframe
+            })
+            _process_baseline[key] = current
+        
+        # Завершившиеся процессы: строка с состоянием X закрывает их историю
+        for key in _process_baseline.keys() - ticks.keys():
+            baseline = _process_baseline.pop(key)
+            result.append({
+                'host_id': host_id,
+                'timestamp': timestamp,
+                'pid': key[0],
+                'username': None,
+                'cpu_percent': None,
+                'mem_percent': None,
+                'vsz_bytes': None,
+                'rss_bytes': baseline['rss'],
+                'tty': None,
+                'state': 'X',
+                'start_time': datetime.utcfromtimestamp(boot_time + key[1] / CLOCK_TICKS),
+                'cpu_seconds': baseline['cpu_ticks'] / CLOCK_TICKS,
+                'command_id': None,
+                'read_bytes': baseline['read_bytes'],
+                'write_bytes': baseline['write_bytes'],
+                'keyframe': False
+            })
+        
+        if commands:
+            save_to_database(commands, schema.COMMANDS_TABLE)
+        return result
     except Exception as e:
         print(f"Error parsing process info: {e}")
         return []
 
-def parse_network_info_from_host(hostname, timestamp):
-    """Parse network info from host"""
+def parse_network_info_from_host(host_id, timestamp):
+    """Parse listening sockets from host's /proc/net"""
     try:
-        # Используем ss через chroot
-        result = subprocess.run(
-            ["chroot", HOST_PREFIX, "ss", "-tulpn"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        
-        lines = result.stdout.strip().split('\n')[1:]
+        reader = get_proc_reader()
+        # Те же сокеты, что показывает ss -tulpn: TCP в LISTEN и все UDP.
+        # Остальные TCP-соединения учитываются только счётчиками в parse_tcp_states_from_host
+        sockets = reader.read_sockets(tcp_states={'LISTEN'})
+        owners = reader.socket_owners([s['inode'] for s in sockets])
         connections = []
         
-        for line in lines:
-            parts = line.split()
-            if len(parts) >= 5:
-                network_data = {
-                    'hostname': hostname,
-                    'timestamp': timestamp,
-                    'interface': parts[4] if len(parts) > 4 else '',
-                    'state': parts[0],
-                    'local_address': parts[4] if len(parts) > 4 else '',
-                    'foreign_address': parts[5] if len(parts) > 5 else '',
-                    'pid': 0,
-                    'program_name': parts[-1] if 'users:' in line else ''
-                }
-                connections.append(network_data)
+        for sock in sockets:
+            pid, program = owners.get(sock['inode'], (0, ''))
+            connections.append({
+                'host_id': host_id,
+                'timestamp': timestamp,
+                'proto': sock['proto'],
+                'state': sock['state'],
+                'local_address': sock['local_address'],
+                'foreign_address': sock['foreign_address'],
+                'pid': pid,
+                'program_name': program
+            })
         
         return connections
     except Exception as e:
         print(f"Error parsing network info: {e}")
         return []
 
+def parse_interface_info_from_host(host_id, timestamp):
+    """Per-interface rx/tx rates since the previous sample from host's /proc/net/dev"""
+    global _prev_net_dev, _prev_net_time
+    try:
+        reader = get_proc_reader()
+        now = time.monotonic()
+        counters = reader.read_net_dev()
+        prev, prev_time = _prev_net_dev, _prev_net_time
+        _prev_net_dev, _prev_net_time = counters, now
+        # Первый сэмпл только запоминает счётчики
+        if prev is None or now <= prev_time:
+            return []
+        
+        interval = now - prev_time
+        result = []
+        for interface, values in counters.items():
+            before = prev.get(interface)
+            # Новый интерфейс или сброс счётчиков (пересоздан) - ждём следующего сэмпла
+            if before is None or any(values[k] < before[k] for k in values):
+                continue
+            row = {'host_id': host_id, 'timestamp': timestamp, 'interface': interface}
+            for key, value in values.items():
+                row[f'{key}_per_sec'] = round((value - before[key]) / interval, 2)
+            result.append(row)
+        return result
+    except Exception as e:
+        print(f"Error parsing interface info: {e}")
+        return []
+
+def parse_container_stats_from_host(host_id, timestamp):
+    """Per-container CPU, memory and IO from the host cgroup v2 tree, rates since the previous sample"""
+    global _prev_container_stats, _prev_container_time
+    try:
+        now = time.monotonic()
+        stats = get_cgroup_reader().read_all()
+        prev, prev_time = _prev_container_stats or {}, _prev_container_time
+        _prev_container_stats, _prev_container_time = stats, now
+        interval = now - prev_time if prev_time is not None else 0
+        
+        rows = []
+        for container_id, values in stats.items():
+            before = prev.get(container_id)
+            # Новый контейнер или сброс счётчиков (cgroup пересоздан) - скорости со следующего сэмпла
+            if before is None or interval <= 0 or any(values[k] < before[k] for k in CONTAINER_COUNTERS):
+                delta = None
+            else:
+                delta = {k: (values[k] - before[k]) / interval for k in CONTAINER_COUNTERS}
+            rows.append({
+                'host_id': host_id,
+                'timestamp': timestamp,
+                'container_id': container_id,
+                # Проценты одного ядра, как docker stats: usec за секунду / 10^6 * 100
+                'cpu_percent': round(delta['cpu_usage_usec'] / 10000, 2) if delta else None,
+                'cpu_throttled_percent': round(delta['cpu_throttled_usec'] / 10000, 2) if delta else None,
+                'memory_bytes': values['memory_bytes'],
+                # Working set как у cAdvisor: без неактивного файлового кэша, который ядро отдаст первым
+                'memory_working_set_bytes': max(values['memory_bytes'] - values['memory_inactive_file_bytes'], 0),
+                'memory_anon_bytes': values['memory_anon_bytes'],
+                'memory_file_bytes': values['memory_file_bytes'],
+                'memory_limit_bytes': values['memory_limit_bytes'],
+                'read_bytes_per_sec': round(delta['io_read_bytes'], 2) if delta else None,
+                'write_bytes_per_sec': round(delta['io_write_bytes'], 2) if delta else None,
+                'read_ops_per_sec': round(delta['io_read_ops'], 2) if delta else None,
+                'write_ops_per_sec': round(delta['io_write_ops'], 2) if delta else None,
+            })
+        return rows
+    except Exception as e:
+        print(f"Error parsing container stats: {e}")
+        return []
+
+def parse_tcp_states_from_host(host_id, timestamp):
+    """Number of TCP connections per state from host's /proc/net/tcp{,6}"""
+    try:
+        counts = get_proc_reader().count_tcp_states()
+        return [
+            {'host_id': host_id, 'timestamp': timestamp, 'state': state, 'connections': count}
+            for state, count in sorted(counts.items())
+        ]
+    except Exception as e:
+        print(f"Error parsing TCP states: {e}")
+        return []
+
+def get_spool():
+    """On-disk spool for batches the database did not accept, None if disabled or unusable"""
+    if not SPOOL_DIR:
+        return None
+    try:
+        spool = Spool()
+    except OSError as e:
+        print(f"⚠️ Spool is disabled, cannot use {SPOOL_DIR}: {e}")
+        return None
+    if spool.has_data():
+        print(f"📦 Spool has {spool.size} bytes from an earlier run, they will be replayed")
+    return spool
+
+def get_writer():
+    """Return shared BatchWriter (or AgentPusher in push mode), created on first use"""
+    global _writer
+    if _writer is None:
+        if COLLECTOR_MODE == 'push':
+            _writer = AgentPusher(get_host_hostname())
+        else:
+            _writer = BatchWriter(DB_CONFIG, upserts=schema.UPSERT_TABLES, spool=get_spool())
+        _writer.start()
+    return _writer
+
 def save_to_database(data, table_name):
-    """Save parsed data to database"""
-    conn = get_db_connection()
-    if not conn or not data:
+    """Queue parsed data for batched insert into table_name"""
+    if not data:
         return False
     
     try:
-        with conn.cursor() as cur:
-            if isinstance(data, list):
-                for item in data:
-                    columns = item.keys()
-                    values = [item[column] for column in columns]
-                    insert_query = sql.SQL("INSERT INTO {} ({}) VALUES ({})").format(
-                        sql.Identifier(table_name),
-                        sql.SQL(', ').join(map(sql.Identifier, columns)),
-                        sql.SQL(', ').join(sql.Placeholder() * len(columns))
-                    )
-                    cur.execute(insert_query, values)
-            else:
-                columns = data.keys()
-                values = [data[column] for column in columns]
-                insert_query = sql.SQL("INSERT INTO {} ({}) VALUES ({})").format(
-                    sql.Identifier(table_name),
-                    sql.SQL(', ').join(map(sql.Identifier, columns)),
-                    sql.SQL(', ').join(sql.Placeholder() * len(columns))
-                )
-                cur.execute(insert_query, values)
-            
-            conn.commit()
-            return True
+        get_writer().add(table_name, data)
+        return True
     except Exception as e:
         print(f"Error saving to {table_name}: {e}")
-        conn.rollback()
         return False
-    finally:
-        conn.close()
 
-def animated_loading(text, dots=3, delay=0.5):
-    """Display animated loading dots"""
-    print(text, end="", flush=True)
-    for _ in range(dots):
-        print(".", end="", flush=True)
-        time.sleep(delay)
-    print(" готово")
+def get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis(
+            host='redis',
+            port=6379,
+            password=os.getenv('REDIS_PASSWORD', 'your_secure_redis_password_123'),
+            decode_responses=True,
+            socket_timeout=2
+        )
+    return _redis
 
-def main():
-    print("Запускаю скрипт сбора телеметрии с ХОСТА")
-    time.sleep(1)
-    
-    # Получаем хостовое имя
+def host_summary(collected):
+    """Few headline numbers of a sample for live dashboards and backend alert rules"""
+    summary = {}
+    mem_data = collected.get('memory')
+    if mem_data:
+        summary['memory_used_bytes'] = mem_data['used_bytes']
+        summary['memory_available_bytes'] = mem_data['available_bytes']
+        summary['swap_used_bytes'] = mem_data['swap_used_bytes']
+        if mem_data['total_bytes']:
+            # "Занято" без учёта кэша, как used в free -h
+            summary['memory_used_percent'] = round(
+                (mem_data['total_bytes'] - mem_data['available_bytes']) * 100 / mem_data['total_bytes'], 2)
+    cpu_data = collected.get('cpu')
+    if cpu_data:
+        for key in ('load_1', 'cpu_us', 'cpu_sy', 'cpu_id', 'cpu_wa', 'tasks_running'):
+            summary[key] = cpu_data[key]
+    for disk in collected.get('disk') or []:
+        summary[f"disk_use_percent:{disk['mounted_on']}"] = disk['use_percent']
+    interfaces = [i for i in collected.get('interface') or [] if i['interface'] != 'lo']
+    if interfaces:
+        for key in ('rx_bytes_per_sec', 'tx_bytes_per_sec', 'rx_errors_per_sec', 'tx_errors_per_sec'):
+            summary[f'net_{key}'] = round(sum(i[key] for i in interfaces), 2)
+    for row in collected.get('tcp_state') or []:
+        if row['state'] in ('ESTAB', 'TIME-WAIT', 'CLOSE-WAIT', 'SYN-RECV'):
+            summary[f"tcp_{row['state'].lower().replace('-', '_')}"] = row['connections']
+    return summary
+
+def publish_host_sample(hostname, timestamp, summary):
+    """Send changed summary fields to the Redis stream, never fails the sample"""
+    global _last_published, _published_since_keyframe
+    full = _published_since_keyframe == 0
+    # Запись уходит и без изменений: по ней alerter отсчитывает окна и for: правил
+    changed = summary if full else {k: v for k, v in summary.items() if _last_published.get(k) != v}
+    try:
+        with REDIS_DURATION.labels('publish_host_sample').time():
+            get_redis().xadd(
+                HOST_METRICS_STREAM,
+                {'host': hostname, 'timestamp': timestamp.isoformat(), 'full': int(full), 'data': json.dumps(changed)},
+                maxlen=HOST_METRICS_STREAM_MAXLEN,
+                approximate=True
+            )
+        _last_published = summary
+        _published_since_keyframe = (_published_since_keyframe + 1) % HOST_METRICS_KEYFRAME
+    except redis.RedisError as e:
+        print(f"Error publishing host sample: {e}")
+
+def publish_container_stats(hostname, timestamp, rows):
+    """Replace this host's container stats hash in Redis, never fails the sample"""
+    key = CONTAINER_STATS_KEY.format(host=hostname)
+    stats = {}
+    for row in rows:
+        data = {k: v for k, v in row.items() if k not in ('host_id', 'timestamp')}
+        data['host'] = hostname
+        data['timestamp'] = timestamp.isoformat()
+        stats[row['container_id']] = json.dumps(data)
+    try:
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.delete(key)
+        if stats:
+            pipe.hset(key, mapping=stats)
+            # Остановленный сборщик не оставляет устаревших цифр
+            pipe.expire(key, int(COLLECT_INTERVAL * 3) + 1)
+        pipe.sadd(CONTAINER_STATS_HOSTS, hostname)
+        pipe.incr(CONTAINER_STATS_VERSION)
+        with REDIS_DURATION.labels('publish_container_stats').time():
+            pipe.execute()
+    except redis.RedisError as e:
+        print(f"Error publishing container stats: {e}")
+
+def get_host_hostname():
+    """Read hostname of the host machine"""
+    hostname = read_host_file("/etc/hostname").strip()
+    return hostname or "unknown-host"
+
+def _run_collector(name, collect, host_id, timestamp, results):
+    started = time.monotonic()
     try:
-        hostname_content = read_host_file("/etc/hostname")
-        hostname = hostname_content.strip()
-    except:
-        hostname = "unknown-host"
+        data = collect(host_id, timestamp)
+    except Exception as e:
+        print(f"Error in {name} collector: {e}")
+        data = None
+    results[name] = (data, time.monotonic() - started)
+
+def collect_sample(host_id, hostname):
+    """Collect one sample of every metric family concurrently, save it and publish a summary.
+
+    Returns {collector: duration in seconds, None if it timed out or was skipped}.
+    """
+    timestamp = datetime.utcnow()
+    collectors = {
+        'memory': parse_memory_info_from_host,
+        'cpu': parse_cpu_info_from_host,
+        'disk': parse_disk_info_from_host,
+        'process': parse_process_info_from_host,
+        'network': parse_network_info_from_host,
+        'interface': parse_interface_info_from_host,
+        'tcp_state': parse_tcp_states_from_host,
+        'container': parse_container_stats_from_host,
+    }
     
-    # Initialize database
-    print("Инициализирую базу данных...")
-    if not create_tables():
-        print("Ошибка при инициализации базы данных!")
-        return
+    results = {}
+    threads = {}
+    durations = {}
+    collected = {}
+    for name, collect in collectors.items():
+        hung = _hung_collectors.get(name)
+        if hung is not None and hung.is_alive():
+            print(f"⚠️ {name} collector still hangs since an earlier sample, skipped")
+            durations[name] = None
+            continue
+        _hung_collectors.pop(name, None)
+        # daemon: зависший в statvfs поток не должен мешать завершению процесса
+        thread = threading.Thread(
+            target=_run_collector, args=(name, collect, host_id, timestamp, results),
+            name=f"collect-{name}", daemon=True
+        )
+        thread.start()
+        threads[name] = thread
     
-    timestamp = datetime.now()
+    deadline = time.monotonic() + COLLECTOR_TIMEOUT
+    for name, thread in threads.items():
+        thread.join(max(deadline - time.monotonic(), 0))
+        if thread.is_alive():
+            print(f"⚠️ {name} collector timed out after {COLLECTOR_TIMEOUT}s")
+            COLLECTOR_TIMEOUTS.labels(name).inc()
+            _hung_collectors[name] = thread
+            durations[name] = None
+            continue
+        collected[name], durations[name] = results[name]
+        COLLECTOR_DURATION.labels(name).observe(durations[name])
+        if collected[name]:
+            save_to_database(collected[name], schema.METRIC_TABLES[name])
     
-    # Collect data from HOST with loading animations
-    animated_loading("Собираю данные о памяти с хоста")
-    mem_data = parse_memory_info_from_host(hostname, timestamp)
-    if mem_data:
-        save_to_database(mem_data, "memory_info")
+    summary = host_summary(collected)
+    exporter.host_summary.update(hostname, summary)
+    if COLLECTOR_MODE == 'push':
+        # Агент может не видеть Redis центральной установки: сводку публикует backend при приёме,
+        # статистику контейнеров он берёт из строк container_stats_v2
+        get_writer().add_sample(timestamp, summary)
+    else:
+        publish_host_sample(hostname, timestamp, summary)
+        if collected.get('container') is not None:
+            publish_container_stats(hostname, timestamp, collected['container'])
+    return durations
+
+def _handle_stop(signum, frame):
+    print(f"Получен сигнал {signum}, останавливаю сборщик...")
+    _stop_event.set()
+
+def main():
+    print(f"Запускаю сборщик телеметрии с ХОСТА (интервал {COLLECT_INTERVAL}s, режим {COLLECTOR_MODE})")
+    signal.signal(signal.SIGTERM, _handle_stop)
+    signal.signal(signal.SIGINT, _handle_stop)
     
-    animated_loading("Собираю данные о CPU с хоста")
-    cpu_data = parse_cpu_info_from_host(hostname, timestamp)
-    if cpu_data:
-        save_to_database(cpu_data, "cpu_info")
+    hostname = get_host_hostname()
+    try:
+        exporter.start_metrics_server()
+    except OSError as e:
+        print(f"⚠️ Cannot start metrics server: {e}")
     
-    animated_loading("Собираю данные о дисках хоста")
-    disks_data = parse_disk_info_from_host(hostname, timestamp)
-    if disks_data:
-        save_to_database(disks_data, "disk_info")
+    if COLLECTOR_MODE == 'push':
+        # Агент не ходит в PostgreSQL: таблицы и id хоста - забота backend
+        host_id = None
+    else:
+        # Initialize database, ждём пока PostgreSQL станет доступен
+        print("Инициализирую базу данных...")
+        while not create_tables():
+            print("Ошибка при инициализации базы данных, повтор через 5s")
+            if _stop_event.wait(5):
+                return
+        
+        host_id = register_host(hostname)
+        while host_id is None:
+            if _stop_event.wait(5):
+                return
+            host_id = register_host(hostname)
     
-    animated_loading("Собираю данные о процессах хоста")
-    proc_data = parse_process_info_from_host(hostname, timestamp)
-    if proc_data:
-        save_to_database(proc_data, "process_info")
+    # Первое чтение /proc/stat и /proc/net/dev только запоминает счётчики для расчёта дельты
+    parse_cpu_info_from_host(host_id, datetime.utcnow())
+    parse_interface_info_from_host(host_id, datetime.utcnow())
+    parse_container_stats_from_host(host_id, datetime.utcnow())
     
-    animated_loading("Собираю данные о сети хоста")
-    net_data = parse_network_info_from_host(hostname, timestamp)
-    if net_data:
-        save_to_database(net_data, "network_info")
+    next_run = time.monotonic()
+    while True:
+        # Планируем от фиксированной сетки, чтобы интервал не дрейфовал
+        next_run += COLLECT_INTERVAL
+        delay = next_run - time.monotonic()
+        if delay < 0:
+            next_run = time.monotonic()
+            delay = 0
+        if _stop_event.wait(delay):
+            break
+        
+        started = time.monotonic()
+        durations = {}
+        try:
+            durations = collect_sample(host_id, hostname)
+        except Exception as e:
+            print(f"Error collecting sample: {e}")
+        elapsed = time.monotonic() - started
+        SAMPLE_DURATION.observe(elapsed)
+        details = ", ".join(
+            f"{name} {duration:.3f}s" if duration is not None else f"{name} timeout"
+            for name, duration in durations.items()
+        )
+        print(f"Сэмпл с хоста '{hostname}' сохранён за {elapsed:.3f}s ({details})")
     
-    print(f"Готово! Данные с хоста '{hostname}' сохранены в базу данных PostgreSQL")
+    if _writer:
+        _writer.close()
+    print(f"Сборщик остановлен, хост '{hostname}'")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
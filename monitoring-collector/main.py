@@ -1,5 +1,7 @@
-from collectors.docker_collector import main
+import threading
+from collectors import docker_collector
 from collectors.system_collector import main
 if __name__ == "__main__":
+    # Docker-коллектор живёт в фоне, системный сборщик - в главном потоке (ему нужны обработчики сигналов)
+    threading.Thread(target=docker_collector.main, name="docker-collector", daemon=True).start()
     main()
-    
\ No newline at end of file